@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import traceback
+
+from qgis.PyQt.QtCore import QCoreApplication
+from qgis.core import QgsTask, QgsVectorLayer, QgsMessageLog, Qgis
+
+
+class AnalysisTask(QgsTask):
+    # Ejecuta una función de análisis de network_algorithms (run_*_core) en segundo plano.
+    # La función recibe feedback=self: informa el avance con setProgress() y consulta
+    # isCanceled() entre orígenes. Las capas de memoria creadas en el hilo de la tarea se
+    # devuelven al hilo principal antes de llamar a on_finished(task, exito).
+    def __init__(self, description, function, args, kwargs, on_finished):
+        super().__init__(description, QgsTask.CanCancel)
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.on_finished = on_finished
+        self.result = None
+        self.error = None
+
+    def run(self):
+        try:
+            self.result = self.function(*self.args, feedback=self, **self.kwargs)
+        except Exception as e:
+            self.error = f"{e}\n{traceback.format_exc()}"
+            return False
+        main_thread = QCoreApplication.instance().thread()
+        for value in self.result[1:]:
+            if isinstance(value, QgsVectorLayer): value.moveToThread(main_thread)
+        return bool(self.result[0]) and not self.isCanceled()
+
+    def finished(self, result):
+        if self.error:
+            QgsMessageLog.logMessage(f"Excepción en la tarea '{self.description()}': {self.error}", "PluginError", Qgis.Critical)
+        self.on_finished(self, result)
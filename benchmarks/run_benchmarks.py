@@ -0,0 +1,200 @@
+# -*- coding: utf-8 -*-
+# Benchmarks reproducibles de las etapas del análisis sobre redes sintéticas (ver synthetic).
+# No requieren QGIS: llaman al mismo motor de ruteo (routing_engine) que usa network_algorithms
+# y escriben las salidas con pyogrio y od_matrix. Cada etapa se mide por separado y los resultados se
+# guardan en JSON (con el commit de git) para comparar entre versiones:
+#
+#   python benchmarks/run_benchmarks.py --sizes 1e3 1e4 1e5 --output resultados.json
+#   python benchmarks/run_benchmarks.py --compare base.json resultados.json
+#
+# Etapas: ingesta (lectura del GeoPackage y de los campos numéricos), construcción del grafo,
+# ajuste de puntos, DRO (todos los pares entre --dro-points puntos), DAI (árbol acotado y
+# polígonos desde --dai-points orígenes), DUMC (--dumc-origins orígenes, --dumc-facilities
+# utilidades) y escritura de las salidas (GeoPackage de rutas/líneas/polígonos y matriz OD).
+import argparse
+import datetime
+import importlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import shapely
+
+import synthetic
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+_plugin = os.path.basename(PLUGIN_DIR)
+routing_engine = importlib.import_module(f"{_plugin}.routing_engine")
+od_matrix = importlib.import_module(f"{_plugin}.od_matrix")
+
+STAGES = ("ingestion", "build", "snapping", "dro", "dai", "dumc", "output")
+DEFAULT_SIZES = (1e3, 1e4, 1e5, 1e6)
+REGRESSION_THRESHOLD = 1.10  # --compare marca las etapas más de un 10 % más lentas
+
+
+# --- Etapas ---
+def stage_ingestion(network_path):
+    import geopandas as gpd
+    frame = gpd.read_file(network_path, engine="pyogrio")
+    return {"geometries": frame.geometry.values, "direction": frame["DIR"].to_numpy(dtype=np.float64), "cost": frame["COSTO"].to_numpy(dtype=np.float64)}
+
+
+def stage_build(roads):
+    G, _ = routing_engine.build_graph(roads["geometries"], roads["direction"], roads["cost"], engine="csr")
+    return routing_engine.RoutingNetwork(G)
+
+
+def stage_snapping(routing, point_sets, snap_mode):
+    # -> (nodos de cada conjunto de puntos, overlay o None); un único overlay para todos
+    snapped, overlay, _ = routing.snap([shapely.points(points) for points in point_sets], mode=snap_mode)
+    return [nodes for nodes, _ in snapped], overlay
+
+
+def stage_dro(G, nodes, overlay):
+    # Un árbol por origen hacia todos los puntos; -> (matriz de costos, [(costo, coordenadas)])
+    nodes = [int(n) for n in nodes]
+    matrix = np.full((len(nodes), len(nodes)), np.nan); routes = []
+    for i in range(len(nodes)):
+        for j, cost, coords in routing_engine.dro_origin_routes(G, nodes, i, "tree", overlay):
+            matrix[i, j] = cost; routes.append((cost, coords))
+    return matrix, routes
+
+
+def stage_dai(routing, nodes, overlay, cutoff):
+    # Árbol de caminos mínimos acotado por origen: aristas del árbol y envolvente convexa
+    lines = []; polygons = []
+    for source in (int(n) for n in nodes):
+        tree_lines, reached = routing_engine.dai_origin(routing, source, cutoff, "tree", overlay)
+        lines.extend((cost, coords) for _, _, _, cost, coords in tree_lines)
+        polygons.extend(hull for _, hull in routing_engine.reach_polygons(reached, [cutoff]))
+    return lines, polygons
+
+
+def stage_dumc(G, origin_nodes, facility_nodes, overlay):
+    # Búsqueda multi-origen desde las utilidades sobre el grafo invertido
+    nearest = routing_engine.nearest_facility_routes(G, [int(n) for n in facility_nodes], [int(n) for n in origin_nodes], overlay)
+    return [(cost, coords) for _, _, cost, coords in nearest if coords is not None]
+
+
+def stage_output(out_dir, dro_matrix, dro_routes, dai_lines, dai_polygons, dumc_routes):
+    # Escritura sin QGIS: GeoPackage por salida (pyogrio) y matriz OD densa (.npy)
+    import geopandas as gpd
+    def write(name, costs, geometries):
+        gpd.GeoDataFrame({"COSTO": costs}, geometry=geometries, crs=synthetic.CRS).to_file(os.path.join(out_dir, name + ".gpkg"), driver="GPKG", engine="pyogrio")
+    def lines(items): return [cost for cost, _ in items], [shapely.linestrings(coords) for _, coords in items]
+    write("dro_rutas", *lines(dro_routes)); write("dai_lineas", *lines(dai_lines)); write("dumc_rutas", *lines(dumc_routes))
+    write("dai_poligonos", [0.0] * len(dai_polygons), dai_polygons)
+    with od_matrix.open_od_matrix_writer(os.path.join(out_dir, "matriz.npy"), range(len(dro_matrix))) as writer:
+        for row, costs in enumerate(dro_matrix): writer.write_row(row, costs)
+
+
+# --- Ejecución ---
+def _timed(timings, stage, function, *args):
+    start = time.perf_counter(); result = function(*args)
+    timings[stage] = time.perf_counter() - start
+    return result
+
+
+def run_case(kind, num_edges, args, work_dir):
+    network = synthetic.make_network(kind, num_edges, seed=args.seed)
+    network_path = synthetic.write_network(network, os.path.join(work_dir, f"{kind}_{int(num_edges)}.gpkg"))
+    dro_points = synthetic.random_points(network, args.dro_points, seed=args.seed + 1)
+    dai_points = synthetic.random_points(network, args.dai_points, seed=args.seed + 2)
+    dumc_origins = synthetic.random_points(network, args.dumc_origins, seed=args.seed + 3)
+    dumc_facilities = synthetic.random_points(network, args.dumc_facilities, seed=args.seed + 4)
+    repeats = []
+    for _ in range(args.repeat):
+        timings = {}
+        roads = _timed(timings, "ingestion", stage_ingestion, network_path)
+        routing = _timed(timings, "build", stage_build, roads); G = routing.graph
+        (dro_nodes, dai_nodes, origin_nodes, facility_nodes), overlay = _timed(
+            timings, "snapping", stage_snapping, routing, [dro_points, dai_points, dumc_origins, dumc_facilities], args.snap_mode)
+        # Umbral DAI: un cuarto del "radio" de la red en costo medio por arista
+        cutoff = float(np.mean(G.weights)) * np.sqrt(G.number_of_edges()) / 4.0
+        dro_matrix, dro_routes = _timed(timings, "dro", stage_dro, G, dro_nodes, overlay)
+        dai_lines, dai_polygons = _timed(timings, "dai", stage_dai, routing, dai_nodes, overlay, cutoff)
+        dumc_routes = _timed(timings, "dumc", stage_dumc, G, origin_nodes, facility_nodes, overlay)
+        out_dir = tempfile.mkdtemp(dir=work_dir)
+        _timed(timings, "output", stage_output, out_dir, dro_matrix, dro_routes, dai_lines, dai_polygons, dumc_routes)
+        shutil.rmtree(out_dir, ignore_errors=True)
+        repeats.append(timings)
+    stages = {stage: {"min": min(t[stage] for t in repeats), "median": float(np.median([t[stage] for t in repeats]))} for stage in STAGES}
+    return {"network": kind, "target_edges": int(num_edges), "roads": len(network.offsets) - 1,
+            "nodes": G.number_of_nodes(), "edges": G.number_of_edges(),
+            "outputs": {"dro_routes": len(dro_routes), "dai_lines": len(dai_lines), "dai_polygons": len(dai_polygons), "dumc_routes": len(dumc_routes)},
+            "stages": stages, "total": sum(s["min"] for s in stages.values())}
+
+
+def _git_commit():
+    try: return subprocess.run(["git", "-C", PLUGIN_DIR, "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError): return None
+
+
+def run(args):
+    results = {"commit": _git_commit(), "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+               "platform": platform.platform(), "python": platform.python_version(), "numpy": np.__version__,
+               "shapely": shapely.__version__, "cpu_count": os.cpu_count(), "args": vars(args), "cases": []}
+    work_dir = tempfile.mkdtemp(prefix="bench_redes_")
+    try:
+        for kind in args.networks:
+            for size in args.sizes:
+                case = run_case(kind, size, args, work_dir)
+                results["cases"].append(case)
+                print(f"{kind:>14} {case['edges']:>9} aristas  " + "  ".join(f"{stage} {case['stages'][stage]['min']:.3f}" for stage in STAGES), flush=True)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    with open(args.output, "w", encoding="utf-8") as fh: json.dump(results, fh, indent=2)
+    print(f"Resultados guardados en {args.output}")
+
+
+def compare(base_path, new_path, threshold=REGRESSION_THRESHOLD):
+    # Razón nuevo/base del tiempo mínimo por etapa; devuelve el número de regresiones
+    with open(base_path, encoding="utf-8") as fh: base = json.load(fh)
+    with open(new_path, encoding="utf-8") as fh: new = json.load(fh)
+    base_cases = {(c["network"], c["target_edges"]): c for c in base["cases"]}
+    print(f"base {base.get('commit')} -> nuevo {new.get('commit')}")
+    changed = sorted(k for k in ("snap_mode", "dro_points", "dai_points", "dumc_origins", "dumc_facilities", "seed") if base["args"].get(k) != new["args"].get(k))
+    if changed: print(f"Aviso: los parámetros difieren ({', '.join(changed)}); los tiempos no son comparables.")
+    regressions = 0
+    for case in new["cases"]:
+        reference = base_cases.get((case["network"], case["target_edges"]))
+        if reference is None: continue
+        cells = []
+        for stage in STAGES:
+            before = reference["stages"][stage]["min"]; after = case["stages"][stage]["min"]
+            ratio = after / before if before > 0 else float("inf")
+            slower = ratio > threshold
+            regressions += slower
+            cells.append(f"{stage} {ratio:.2f}{'!' if slower else ''}")
+        print(f"{case['network']:>14} {case['target_edges']:>9}  " + "  ".join(cells))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmarks de las etapas del análisis de redes sobre redes sintéticas.")
+    parser.add_argument("--networks", nargs="+", default=list(synthetic.NETWORK_KINDS), choices=synthetic.NETWORK_KINDS)
+    parser.add_argument("--sizes", nargs="+", type=float, default=list(DEFAULT_SIZES), help="número aproximado de vías por red")
+    parser.add_argument("--snap-mode", choices=("node", "edge"), default="node")
+    parser.add_argument("--dro-points", type=int, default=20)
+    parser.add_argument("--dai-points", type=int, default=5)
+    parser.add_argument("--dumc-origins", type=int, default=1000)
+    parser.add_argument("--dumc-facilities", type=int, default=20)
+    parser.add_argument("--repeat", type=int, default=1, help="repeticiones por caso; se guarda el mínimo y la mediana")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--compare", nargs=2, metavar=("BASE", "NUEVO"), help="compara dos archivos de resultados y termina")
+    args = parser.parse_args(argv)
+    if args.compare: return 1 if compare(*args.compare) else 0
+    run(args)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
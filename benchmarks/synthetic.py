@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+# Generadores de redes viales y capas de puntos sintéticas para los benchmarks. No dependen
+# de QGIS. Cada red se devuelve como búfer plano de coordenadas (como el del grafo CSR):
+# la vía i ocupa coords[offsets[i]:offsets[i + 1]], con su dirección (0 doble sentido,
+# 1 digitalización, 2 inverso) y su costo (longitud / velocidad). Con la misma semilla se
+# obtiene exactamente la misma red.
+import math
+from collections import namedtuple
+
+import numpy as np
+import shapely
+
+CRS = "EPSG:3857"  # CRS proyectado (metros) con el que se escriben las redes
+SyntheticNetwork = namedtuple("SyntheticNetwork", ["kind", "coords", "offsets", "direction", "cost", "bounds"])
+
+NETWORK_KINDS = ("grid", "radial", "random_planar")
+ONE_WAY_SHARE = 0.2  # fracción de vías de un solo sentido (mitad en cada sentido)
+SPEEDS = (8.0, 14.0, 25.0)  # velocidades por categoría de vía; el costo es un tiempo
+
+
+def _attributes(rng, lengths):
+    draw = rng.random(len(lengths))
+    direction = np.where(draw < ONE_WAY_SHARE / 2, 1, np.where(draw < ONE_WAY_SHARE, 2, 0)).astype(np.int64)
+    cost = lengths / rng.choice(SPEEDS, len(lengths))
+    return direction, cost
+
+
+def _network(kind, rng, coords, counts):
+    counts = np.asarray(counts, dtype=np.int64)
+    offsets = np.concatenate(([0], np.cumsum(counts)))
+    segment = np.hypot(*np.diff(coords, axis=0).T)
+    cumulative = np.concatenate(([0.0], np.cumsum(segment)))
+    lengths = cumulative[offsets[1:] - 1] - cumulative[offsets[:-1]]
+    direction, cost = _attributes(rng, lengths)
+    bounds = (*coords.min(axis=0), *coords.max(axis=0))
+    return SyntheticNetwork(kind, coords, offsets, direction, cost, bounds)
+
+
+def _straight_roads(rng, starts, ends, jitter):
+    # Vías de 3 vértices con el intermedio desplazado (las vías reales no son rectas)
+    middle = (starts + ends) / 2 + rng.uniform(-jitter, jitter, starts.shape)
+    coords = np.stack([starts, middle, ends], axis=1).reshape(-1, 2)
+    return coords, np.full(len(starts), 3)
+
+
+def grid_network(num_edges, spacing=100.0, seed=0):
+    # Cuadrícula de n x n manzanas: ~2 n (n + 1) vías
+    rng = np.random.default_rng(seed)
+    n = max(int(round(math.sqrt(num_edges / 2.0))), 1)
+    i, j = np.meshgrid(np.arange(n + 1), np.arange(n), indexing="ij")
+    i = i.ravel(); j = j.ravel()
+    horizontal = np.column_stack([j, i]), np.column_stack([j + 1, i])
+    vertical = np.column_stack([i, j]), np.column_stack([i, j + 1])
+    starts = np.concatenate([horizontal[0], vertical[0]]) * spacing
+    ends = np.concatenate([horizontal[1], vertical[1]]) * spacing
+    coords, counts = _straight_roads(rng, starts.astype(np.float64), ends.astype(np.float64), spacing * 0.05)
+    return _network("grid", rng, coords, counts)
+
+
+def radial_network(num_edges, ring_spacing=150.0, seed=0):
+    # Anillos concéntricos unidos por radiales: r anillos x s radiales, ~2 r s vías.
+    # Cada tramo de anillo es un arco de 5 vértices.
+    rng = np.random.default_rng(seed)
+    spokes = max(int(round(math.sqrt(num_edges / 2.0) * 1.5)), 3)
+    rings = max(int(round(num_edges / (2.0 * spokes))), 1)
+    angles = np.arange(spokes) * (2 * math.pi / spokes)
+    radius = np.arange(1, rings + 1) * ring_spacing
+    # Tramos de anillo
+    ring_idx, spoke_idx = np.meshgrid(np.arange(rings), np.arange(spokes), indexing="ij")
+    t = np.linspace(0.0, 1.0, 5)
+    theta = (angles[spoke_idx.ravel()][:, None] + t[None, :] * (2 * math.pi / spokes))
+    r = radius[ring_idx.ravel()][:, None]
+    arcs = np.stack([r * np.cos(theta), r * np.sin(theta)], axis=2)
+    arcs[:, -1] = np.stack([r[:, 0] * np.cos(angles[(spoke_idx.ravel() + 1) % spokes]), r[:, 0] * np.sin(angles[(spoke_idx.ravel() + 1) % spokes])], axis=1)
+    # Tramos radiales (desde el centro hasta el primer anillo y entre anillos)
+    inner = np.concatenate(([0.0], radius[:-1]))
+    radial_r0 = np.repeat(inner, spokes); radial_r1 = np.repeat(radius, spokes); radial_a = np.tile(angles, rings)
+    starts = np.column_stack([radial_r0 * np.cos(radial_a), radial_r0 * np.sin(radial_a)])
+    ends = np.column_stack([radial_r1 * np.cos(radial_a), radial_r1 * np.sin(radial_a)])
+    starts[radial_r0 == 0] = 0.0  # todas las radiales parten del mismo nodo central
+    radial_coords, radial_counts = _straight_roads(rng, starts, ends, ring_spacing * 0.03)
+    coords = np.concatenate([arcs.reshape(-1, 2), radial_coords])
+    counts = np.concatenate([np.full(len(arcs), 5), radial_counts])
+    return _network("radial", rng, coords, counts)
+
+
+def random_planar_network(num_edges, spacing=100.0, seed=0):
+    # Triangulación de Delaunay de puntos aleatorios (~3 aristas por punto), de la que se
+    # eliminan aristas al azar hasta el tamaño pedido: planar, sin cruces, grados variados
+    rng = np.random.default_rng(seed)
+    num_points = max(int(num_edges / 2.6), 4)
+    side = math.sqrt(num_points) * spacing
+    points = shapely.multipoints(rng.uniform(0.0, side, (num_points, 2)))
+    edges = shapely.get_parts(shapely.delaunay_triangles(points, only_edges=True))
+    if len(edges) > num_edges: edges = edges[np.sort(rng.choice(len(edges), num_edges, replace=False))]
+    coords = shapely.get_coordinates(edges)
+    starts = coords[0::2]; ends = coords[1::2]
+    coords, counts = _straight_roads(rng, starts, ends, spacing * 0.02)
+    return _network("random_planar", rng, coords, counts)
+
+
+_GENERATORS = {"grid": grid_network, "radial": radial_network, "random_planar": random_planar_network}
+
+
+def make_network(kind, num_edges, seed=0):
+    if kind not in _GENERATORS: raise ValueError(f"Tipo de red desconocido: '{kind}' (use {', '.join(NETWORK_KINDS)})")
+    return _GENERATORS[kind](int(num_edges), seed=seed)
+
+
+def random_points(network, count, seed=0, margin=0.05):
+    # Puntos uniformes dentro de la extensión de la red (reducida en `margin` por lado)
+    rng = np.random.default_rng(seed)
+    xmin, ymin, xmax, ymax = network.bounds
+    dx = (xmax - xmin) * margin; dy = (ymax - ymin) * margin
+    return np.column_stack([rng.uniform(xmin + dx, xmax - dx, count), rng.uniform(ymin + dy, ymax - dy, count)])
+
+
+def network_geometries(network):
+    # LineStrings Shapely de todas las vías
+    index = np.repeat(np.arange(len(network.offsets) - 1), np.diff(network.offsets))
+    return shapely.linestrings(network.coords, indices=index)
+
+
+def write_network(network, path):
+    # GeoPackage con los campos DIR y COSTO (para medir la ingesta desde archivo); requiere pyogrio
+    import geopandas as gpd
+    frame = gpd.GeoDataFrame({"DIR": network.direction, "COSTO": network.cost}, geometry=network_geometries(network), crs=CRS)
+    frame.to_file(path, driver="GPKG", engine="pyogrio")
+    return path
@@ -0,0 +1,263 @@
+# -*- coding: utf-8 -*-
+# Jerarquía de contracción (CH) sobre un CSRGraph, para redes que cambian poco y se
+# consultan muchas veces. No depende de QGIS.
+# - Preproceso: los nodos se contraen de a uno, en orden de importancia (diferencia de
+#   aristas); al contraer v, cada camino u -> v -> x sin un camino testigo igual o más
+#   corto que evite v se reemplaza por un atajo u -> x. El orden de contracción es el rango.
+# - Consulta: una búsqueda "ascendente" desde el origen (solo aristas hacia nodos de mayor
+#   rango) y otra invertida desde el destino; el costo es el mínimo sobre los nodos comunes
+#   y coincide con el de Dijkstra. Los atajos se desempaquetan hasta las posiciones de
+#   arista del grafo original, de modo que las rutas se arman igual que con CSRGraph.
+# Los nodos virtuales de un QueryOverlay se conectan a la jerarquía con una búsqueda previa
+# sobre las aristas virtuales hasta llegar a nodos del grafo (ver _overlay_phase).
+import heapq
+import math
+from collections import namedtuple
+
+import numpy as np
+
+# Arreglos de una jerarquía (también los nombres de archivo en la caché en disco)
+CH_ARRAYS = ("ch_rank", "ch_edge_source", "ch_edge_target", "ch_edge_weight", "ch_edge_original",
+             "ch_edge_first", "ch_edge_second", "ch_up_indptr", "ch_up_edges", "ch_down_indptr", "ch_down_edges")
+# Nodos que asienta cada búsqueda de testigos; más alto = menos atajos y preproceso más lento
+DEFAULT_WITNESS_SETTLE_LIMIT = 50
+
+# Punto de encuentro de una búsqueda hacia adelante y una invertida: kind es "ch" (nodo de
+# la jerarquía) o "overlay" (nodo alcanzado por ambas fases previas sobre aristas virtuales)
+Meeting = namedtuple("Meeting", ["cost", "node", "kind"])
+
+
+def _witness_costs(out, source, excluded, targets, max_cost, settle_limit):
+    # Dijkstra acotado desde source sin pasar por excluded; se detiene al asentar todos los
+    # targets, al superar max_cost o al asentar settle_limit nodos
+    tentative = {source: 0.0}; settled = set(); pending = set(targets)
+    heap = [(0.0, source)]
+    heappop, heappush = heapq.heappop, heapq.heappush
+    while heap and pending and len(settled) < settle_limit:
+        d, u = heappop(heap)
+        if u in settled: continue
+        if d > max_cost: break
+        settled.add(u); pending.discard(u)
+        for x, (w, _) in out[u].items():
+            if x == excluded or x in settled: continue
+            nd = d + w
+            if nd <= max_cost and nd < tentative.get(x, math.inf): tentative[x] = nd; heappush(heap, (nd, x))
+    return tentative
+
+
+def build_contraction_hierarchy(graph, witness_settle_limit=DEFAULT_WITNESS_SETTLE_LIMIT, feedback=None):
+    # Construye la jerarquía de un CSRGraph. feedback (opcional) recibe setProgress y se
+    # consulta con isCanceled; si se cancela devuelve None.
+    n = graph.number_of_nodes()
+    edge_source = graph.edge_sources.tolist(); edge_target = graph.indices.tolist(); edge_weight = graph.weights.tolist()
+    edge_original = list(range(len(edge_source))); edge_first = [-1] * len(edge_source); edge_second = [-1] * len(edge_source)
+    # Grafo restante (nodos aún no contraídos): out[u][v] = inc[v][u] = (costo, arista de la CH)
+    out = [dict() for _ in range(n)]; inc = [dict() for _ in range(n)]
+    for e, (u, v, w) in enumerate(zip(edge_source, edge_target, edge_weight)):
+        if u == v: continue
+        if v not in out[u] or w < out[u][v][0]: out[u][v] = (w, e); inc[v][u] = (w, e)
+    deleted_neighbors = [0] * n
+
+    def needed_shortcuts(v):
+        # [(u, x, costo, arista u->v, arista v->x)] de los atajos que exige contraer v
+        shortcuts = []; outs = out[v]
+        for u, (w_uv, e_uv) in inc[v].items():
+            targets = [x for x in outs if x != u]
+            if not targets: continue
+            witness = _witness_costs(out, u, v, targets, w_uv + max(outs[x][0] for x in targets), witness_settle_limit)
+            for x in targets:
+                w_vx, e_vx = outs[x]
+                if witness.get(x, math.inf) > w_uv + w_vx: shortcuts.append((u, x, w_uv + w_vx, e_uv, e_vx))
+        return shortcuts
+
+    def priority(v, shortcuts):
+        return len(shortcuts) - len(inc[v]) - len(out[v]) + deleted_neighbors[v]
+
+    heap = [(priority(v, needed_shortcuts(v)), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = np.empty(n, dtype=np.int64); order = 0
+    while heap:
+        if feedback is not None and order % 1000 == 0:
+            if feedback.isCanceled(): return None
+            feedback.setProgress(100.0 * order / max(n, 1))
+        _, v = heapq.heappop(heap)
+        # Actualización perezosa: si la prioridad real empeoró, el nodo vuelve a la cola
+        shortcuts = needed_shortcuts(v); current = priority(v, shortcuts)
+        if heap and current > heap[0][0]: heapq.heappush(heap, (current, v)); continue
+        for u, x, cost, e_uv, e_vx in shortcuts:
+            existing = out[u].get(x)
+            if existing is not None and existing[0] <= cost: continue
+            e = len(edge_source)
+            edge_source.append(u); edge_target.append(x); edge_weight.append(cost)
+            edge_original.append(-1); edge_first.append(e_uv); edge_second.append(e_vx)
+            out[u][x] = (cost, e); inc[x][u] = (cost, e)
+        for u in inc[v]: del out[u][v]; deleted_neighbors[u] += 1
+        for x in out[v]: del inc[x][v]; deleted_neighbors[x] += 1
+        out[v] = {}; inc[v] = {}
+        rank[v] = order; order += 1
+
+    edge_source = np.asarray(edge_source, dtype=np.int64); edge_target = np.asarray(edge_target, dtype=np.int64)
+    up_edges = np.nonzero(rank[edge_target] > rank[edge_source])[0]
+    up_edges = up_edges[np.argsort(edge_source[up_edges], kind="stable")]
+    down_edges = np.nonzero(rank[edge_source] > rank[edge_target])[0]
+    down_edges = down_edges[np.argsort(edge_target[down_edges], kind="stable")]
+    up_indptr = np.zeros(n + 1, dtype=np.int64); np.cumsum(np.bincount(edge_source[up_edges], minlength=n), out=up_indptr[1:])
+    down_indptr = np.zeros(n + 1, dtype=np.int64); np.cumsum(np.bincount(edge_target[down_edges], minlength=n), out=down_indptr[1:])
+    return ContractionHierarchy({
+        "ch_rank": rank, "ch_edge_source": edge_source, "ch_edge_target": edge_target,
+        "ch_edge_weight": np.asarray(edge_weight, dtype=np.float64), "ch_edge_original": np.asarray(edge_original, dtype=np.int64),
+        "ch_edge_first": np.asarray(edge_first, dtype=np.int64), "ch_edge_second": np.asarray(edge_second, dtype=np.int64),
+        "ch_up_indptr": up_indptr, "ch_up_edges": up_edges, "ch_down_indptr": down_indptr, "ch_down_edges": down_edges})
+
+
+def _overlay_phase(nodes, overlay, backward, num_nodes):
+    # Dijkstra solo sobre aristas virtuales desde los nodos de partida, sin continuar desde
+    # los nodos del grafo (desde ellos sigue la jerarquía). Devuelve (dist, pred, semillas
+    # {nodo del grafo: costo} para la búsqueda en la jerarquía).
+    nodes = [int(node) for node in nodes]
+    if overlay is None:
+        dist = {node: 0.0 for node in nodes}
+        return dist, {}, {node: 0.0 for node in nodes if node < num_nodes}
+    edges_of = overlay.inc if backward else overlay.out
+    neighbors = overlay.sources if backward else overlay.targets
+    dist = {}; pred = {}; tentative = {node: 0.0 for node in nodes}
+    heap = [(0.0, node) for node in tentative]; heapq.heapify(heap)
+    while heap:
+        d, u = heapq.heappop(heap)
+        if u in dist: continue
+        dist[u] = d
+        if u < num_nodes: continue
+        for pos in edges_of.get(u, ()):
+            v = neighbors[pos - overlay.base_edges]
+            if v in dist: continue
+            nd = d + overlay.weights[pos - overlay.base_edges]
+            if nd < tentative.get(v, math.inf): tentative[v] = nd; pred[v] = pos; heapq.heappush(heap, (nd, v))
+    return dist, {v: pred[v] for v in dist if v in pred}, {u: d for u, d in dist.items() if u < num_nodes}
+
+
+class CHSearch:
+    # Resultado de una búsqueda ascendente (o invertida, backward=True): costos y aristas de
+    # llegada en la jerarquía y en la fase previa sobre el overlay
+    def __init__(self, dist, pred, overlay_dist, overlay_pred, overlay, backward):
+        self.dist = dist; self.pred = pred
+        self.overlay_dist = overlay_dist; self.overlay_pred = overlay_pred
+        self.overlay = overlay; self.backward = backward
+
+
+class ContractionHierarchy:
+    def __init__(self, arrays):
+        self.arrays = arrays
+        for name in CH_ARRAYS: setattr(self, name[3:], arrays[name])
+        self._views = {name[3:]: memoryview(np.ascontiguousarray(arrays[name])) for name in CH_ARRAYS}
+
+    def number_of_nodes(self): return len(self.rank)
+
+    def number_of_shortcuts(self): return int(np.count_nonzero(np.asarray(self.edge_original) < 0))
+
+    @property
+    def nbytes(self): return int(sum(np.asarray(a).nbytes for a in self.arrays.values()))
+
+    # --- Búsquedas ---
+    def search(self, nodes, overlay=None, backward=False):
+        # Búsqueda ascendente desde uno o varios nodos (invertida con backward=True: costos
+        # desde cada nodo hasta el nodo de partida más cercano)
+        if isinstance(nodes, (int, np.integer)): nodes = (int(nodes),)
+        overlay_dist, overlay_pred, seeds = _overlay_phase(nodes, overlay, backward, self.number_of_nodes())
+        views = self._views
+        if backward: indptr, edge_list, neighbor = views["down_indptr"], views["down_edges"], views["edge_source"]
+        else: indptr, edge_list, neighbor = views["up_indptr"], views["up_edges"], views["edge_target"]
+        weights = views["edge_weight"]
+        dist = {}; pred = {}; tentative = dict(seeds)
+        heap = [(d, u) for u, d in seeds.items()]; heapq.heapify(heap)
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap:
+            d, u = heappop(heap)
+            if u in dist: continue
+            dist[u] = d
+            for k in range(indptr[u], indptr[u + 1]):
+                e = edge_list[k]; v = neighbor[e]
+                if v in dist: continue
+                nd = d + weights[e]
+                if nd < tentative.get(v, math.inf): tentative[v] = nd; pred[v] = e; heappush(heap, (nd, v))
+        return CHSearch(dist, {v: pred[v] for v in dist if v in pred}, overlay_dist, overlay_pred, overlay, backward)
+
+    @staticmethod
+    def meeting(forward, backward):
+        # Mejor punto de encuentro entre una búsqueda hacia adelante y una invertida, o None
+        best = None
+        for kind, fdist, bdist in (("ch", forward.dist, backward.dist), ("overlay", forward.overlay_dist, backward.overlay_dist)):
+            small, large = (fdist, bdist) if len(fdist) <= len(bdist) else (bdist, fdist)
+            for node, d in small.items():
+                other = large.get(node)
+                if other is not None and (best is None or d + other < best.cost): best = Meeting(d + other, node, kind)
+        return best
+
+    def route(self, source, target, overlay=None):
+        # Consulta punto a punto: (costo, posiciones de aristas) o None si no hay camino
+        forward, backward = self.search(source, overlay), self.search(target, overlay, backward=True)
+        meeting = self.meeting(forward, backward)
+        if meeting is None: return None
+        edges = self.path_edges(forward, backward, meeting)
+        return self.route_cost(edges, overlay), edges
+
+    # --- Reconstrucción de caminos ---
+    def _unpack(self, ch_edges):
+        # Posiciones de arista del grafo original de una secuencia de aristas de la CH
+        original, first, second = self._views["edge_original"], self._views["edge_first"], self._views["edge_second"]
+        edges = []; stack = list(reversed(ch_edges))
+        while stack:
+            e = stack.pop()
+            if original[e] >= 0: edges.append(original[e])
+            else: stack.append(second[e]); stack.append(first[e])
+        return edges
+
+    def _walk(self, search, node, kind):
+        # (aristas de la CH, aristas virtuales, nodo de partida) desde node hacia el inicio de la búsqueda
+        ch_edges = []; overlay_edges = []
+        if kind == "ch":
+            step = self._views["edge_target"] if search.backward else self._views["edge_source"]
+            while node in search.pred: e = search.pred[node]; ch_edges.append(e); node = step[e]
+        overlay = search.overlay
+        while node in search.overlay_pred:
+            pos = search.overlay_pred[node]; overlay_edges.append(pos)
+            node = (overlay.targets if search.backward else overlay.sources)[pos - overlay.base_edges]
+        return ch_edges, overlay_edges, node
+
+    def path_edges(self, forward, backward, meeting):
+        # Posiciones de aristas (grafo y overlay) del origen al destino, en sentido de circulación
+        ch_edges, overlay_edges, _ = self._walk(forward, meeting.node, meeting.kind)
+        edges = overlay_edges[::-1] + self._unpack(ch_edges[::-1])
+        ch_edges, overlay_edges, _ = self._walk(backward, meeting.node, meeting.kind)
+        return edges + self._unpack(ch_edges) + overlay_edges
+
+    def start_node(self, search, meeting):
+        # Nodo de partida de la búsqueda (p. ej. la utilidad más cercana en una búsqueda invertida multi-origen)
+        return self._walk(search, meeting.node, meeting.kind)[2]
+
+    def route_cost(self, edges, overlay=None):
+        # Costo sumado en orden de circulación, igual que lo acumula Dijkstra sobre el grafo
+        # original (las aristas originales conservan su posición como id en la CH)
+        weights = self._views["edge_weight"]; cost = 0.0
+        for pos in edges: cost += overlay.weights[pos - overlay.base_edges] if overlay is not None and pos >= overlay.base_edges else weights[pos]
+        return cost
+
+
+def bucket_index(backward_searches):
+    # Índice nodo -> [(j, costo)] de varias búsquedas invertidas, para consultas muchos a muchos
+    buckets = {"ch": {}, "overlay": {}}
+    for j, search in enumerate(backward_searches):
+        for node, d in search.dist.items(): buckets["ch"].setdefault(node, []).append((j, d))
+        for node, d in search.overlay_dist.items(): buckets["overlay"].setdefault(node, []).append((j, d))
+    return buckets
+
+
+def best_meetings(forward, buckets):
+    # {j: Meeting} con el mejor encuentro de la búsqueda hacia adelante con cada búsqueda invertida j
+    best = {}
+    for kind, fdist in (("ch", forward.dist), ("overlay", forward.overlay_dist)):
+        kind_buckets = buckets[kind]
+        for node, d in fdist.items():
+            for j, other in kind_buckets.get(node, ()):
+                current = best.get(j)
+                if current is None or d + other < current.cost: best[j] = Meeting(d + other, node, kind)
+    return best
@@ -0,0 +1,482 @@
+# -*- coding: utf-8 -*-
+# Grafo de ruteo compacto respaldado por arreglos NumPy (formato CSR).
+# No depende de QGIS ni de NetworkX: las búsquedas recorren directamente los arreglos.
+import heapq
+import math
+from collections import namedtuple
+
+import numpy as np
+
+
+class CSRGraph:
+    # indptr[u]:indptr[u+1] delimita las aristas salientes del nodo u dentro de
+    # indices (nodo destino), weights (costo float64) y edge_ids (parte de la vía que
+    # originó la arista). edge_reversed indica si la arista recorre la geometría de la
+    # parte en sentido contrario a la digitalización; así no se guardan copias invertidas.
+    # Las coordenadas de las partes viven en un solo búfer plano: part_coords[part_offsets[p]:
+    # part_offsets[p + 1]] son las de la parte p (ver gather_part_coords).
+    def __init__(self, indptr, indices, weights, edge_ids, node_xy=None, edge_reversed=None, geometries=None,
+                 part_coords=None, part_offsets=None):
+        self.indptr = np.ascontiguousarray(indptr, dtype=np.int64)
+        self.indices = np.ascontiguousarray(indices, dtype=np.int64)
+        self.weights = np.ascontiguousarray(weights, dtype=np.float64)
+        self.edge_ids = np.ascontiguousarray(edge_ids, dtype=np.int64)
+        self.edge_reversed = np.zeros(len(self.indices), dtype=bool) if edge_reversed is None else np.ascontiguousarray(edge_reversed, dtype=bool)
+        self.node_xy = None if node_xy is None else np.ascontiguousarray(node_xy, dtype=np.float64)
+        self.geometries = geometries
+        self.part_coords = None if part_coords is None else np.asarray(part_coords, dtype=np.float64)
+        self.part_offsets = None if part_offsets is None else np.asarray(part_offsets, dtype=np.int64)
+        self.storage_dir = None  # directorio de la caché en disco con estos arreglos, si existe
+        self.hierarchy = None  # jerarquía de contracción precalculada (ver contraction), si existe
+        self._edge_sources = None
+        self._views = None
+        self._reverse = None
+        self._cost_bound = None
+
+    @classmethod
+    def from_edge_arrays(cls, num_nodes, sources, targets, weights, edge_ids, node_xy=None, edge_reversed=None, geometries=None,
+                         part_coords=None, part_offsets=None):
+        sources = np.asarray(sources, dtype=np.int64); targets = np.asarray(targets, dtype=np.int64)
+        weights = np.asarray(weights, dtype=np.float64); edge_ids = np.asarray(edge_ids, dtype=np.int64)
+        edge_reversed = np.zeros(len(sources), dtype=bool) if edge_reversed is None else np.asarray(edge_reversed, dtype=bool)
+        keep = cheapest_parallel_edges(sources, targets, weights)
+        sources, targets, weights = sources[keep], targets[keep], weights[keep]
+        edge_ids, edge_reversed = edge_ids[keep], edge_reversed[keep]
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(sources, minlength=num_nodes), out=indptr[1:])
+        return cls(indptr, targets, weights, edge_ids, node_xy=node_xy, edge_reversed=edge_reversed, geometries=geometries,
+                   part_coords=part_coords, part_offsets=part_offsets)
+
+    def with_rows(self, rows, sources, targets, weights, edge_ids, edge_reversed, node_xy, geometries, part_coords, part_offsets):
+        # Copia del grafo con las aristas salientes de los nodos marcados en rows (máscara sobre
+        # los nodos de node_xy, que puede agregar nodos al final) reemplazadas por las dadas, ya
+        # deduplicadas y ordenadas por (origen, destino). Las demás filas se copian tal cual,
+        # sin reordenar: los ids de nodo y de parte no cambian. La jerarquía no se conserva.
+        num_nodes = len(node_xy); old_nodes = self.number_of_nodes()
+        counts = np.zeros(num_nodes, dtype=np.int64); counts[:old_nodes] = np.diff(self.indptr)
+        counts[rows] = 0; counts += np.bincount(sources, minlength=num_nodes)
+        indptr = np.zeros(num_nodes + 1, dtype=np.int64); np.cumsum(counts, out=indptr[1:])
+        indices = np.empty(indptr[-1], dtype=np.int64); new_weights = np.empty(indptr[-1], dtype=np.float64)
+        new_edge_ids = np.empty(indptr[-1], dtype=np.int64); new_reversed = np.empty(indptr[-1], dtype=bool)
+        # Aristas conservadas: misma posición dentro de su fila
+        kept = np.flatnonzero(~rows[:old_nodes][self.edge_sources]); kept_sources = self.edge_sources[kept]
+        destination = indptr[kept_sources] + (kept - self.indptr[kept_sources])
+        indices[destination] = self.indices[kept]; new_weights[destination] = self.weights[kept]
+        new_edge_ids[destination] = self.edge_ids[kept]; new_reversed[destination] = self.edge_reversed[kept]
+        # Aristas nuevas: en orden dentro de la fila de su origen
+        sources = np.asarray(sources, dtype=np.int64)
+        destination = indptr[sources] + np.arange(len(sources)) - np.searchsorted(sources, sources)
+        indices[destination] = targets; new_weights[destination] = weights
+        new_edge_ids[destination] = edge_ids; new_reversed[destination] = edge_reversed
+        return CSRGraph(indptr, indices, new_weights, new_edge_ids, node_xy=node_xy, edge_reversed=new_reversed, geometries=geometries,
+                        part_coords=part_coords, part_offsets=part_offsets)
+
+    # --- Consultas básicas (misma interfaz que nx.DiGraph donde aplica) ---
+    def number_of_nodes(self): return len(self.indptr) - 1
+
+    def number_of_edges(self): return len(self.indices)
+
+    def has_node(self, node):
+        return isinstance(node, (int, np.integer)) and 0 <= node < self.number_of_nodes()
+
+    @property
+    def nbytes(self):
+        arrays = [self.indptr, self.indices, self.weights, self.edge_ids, self.edge_reversed]
+        if self.node_xy is not None: arrays.append(self.node_xy)
+        if self.part_coords is not None: arrays.extend((self.part_coords, self.part_offsets))
+        if self._edge_sources is not None: arrays.append(self._edge_sources)
+        if self._reverse is not None: arrays.extend(self._reverse[0])
+        return int(sum(a.nbytes for a in arrays))
+
+    @property
+    def edge_sources(self):
+        # Nodo de origen de cada arista (derivado de indptr, se calcula una sola vez)
+        if self._edge_sources is None:
+            self._edge_sources = np.repeat(np.arange(self.number_of_nodes(), dtype=np.int64), np.diff(self.indptr))
+        return self._edge_sources
+
+    def find_edge(self, u, v, overlay=None):
+        # Posición de la arista u->v (la de menor costo tras la deduplicación) o -1
+        if overlay is not None:
+            pos = overlay.find_edge(u, v)
+            if pos >= 0 or u >= self.number_of_nodes(): return pos
+        start, end = self.indptr[u], self.indptr[u + 1]
+        hits = np.nonzero(self.indices[start:end] == v)[0]
+        return int(start + hits[0]) if len(hits) else -1
+
+    def edge_source(self, edge_pos, overlay=None):
+        if overlay is not None and edge_pos >= self.number_of_edges(): return overlay.sources[edge_pos - overlay.base_edges]
+        return int(self.edge_sources[edge_pos])
+
+    def edge_target(self, edge_pos, overlay=None):
+        if overlay is not None and edge_pos >= self.number_of_edges(): return overlay.targets[edge_pos - overlay.base_edges]
+        return int(self.indices[edge_pos])
+
+    def edge_coords(self, edge_pos, overlay=None):
+        # Coordenadas de la arista (arreglo n x 2) en el sentido de circulación
+        if edge_pos < 0: return None
+        return self.route_coords((edge_pos,), overlay)
+
+    def route_coords(self, edge_positions, overlay=None):
+        # Coordenadas de una ruta (arreglo n x 2) a partir de sus posiciones de arista. Los
+        # tramos sobre aristas del grafo se arman con un único gather sobre el búfer plano;
+        # las aristas virtuales del overlay se intercalan entre ellos.
+        if self.part_coords is None: return None
+        positions = np.asarray(edge_positions, dtype=np.int64)
+        if len(positions) == 0: return None
+        virtual = np.flatnonzero(positions >= self.number_of_edges()) if overlay is not None else ()
+        if len(virtual) == 0: return gather_part_coords(self.part_coords, self.part_offsets, self.edge_ids[positions], self.edge_reversed[positions])
+        pieces = []; start = 0
+        for k in virtual.tolist():
+            if k > start: pieces.append(gather_part_coords(self.part_coords, self.part_offsets, self.edge_ids[positions[start:k]], self.edge_reversed[positions[start:k]]))
+            pieces.append(np.asarray(overlay.coords[positions[k] - overlay.base_edges], dtype=np.float64)[:, :2])
+            start = k + 1
+        if start < len(positions): pieces.append(gather_part_coords(self.part_coords, self.part_offsets, self.edge_ids[positions[start:]], self.edge_reversed[positions[start:]]))
+        return np.concatenate([pieces[0]] + [piece[1:] for piece in pieces[1:]])
+
+    def _adjacency_views(self):
+        # memoryview evita copiar los arreglos a listas y entrega escalares de Python al indexar
+        if self._views is None:
+            self._views = (memoryview(self.indptr), memoryview(self.indices), memoryview(self.weights))
+        return self._views
+
+    def _reverse_adjacency_views(self):
+        # Aristas entrantes agrupadas por nodo destino (CSR del grafo invertido). Se construye
+        # una sola vez; rev_positions apunta a la posición de la arista en el grafo original.
+        if self._reverse is None:
+            num_nodes = self.number_of_nodes()
+            rev_positions = np.argsort(self.indices, kind="stable")
+            rev_indptr = np.zeros(num_nodes + 1, dtype=np.int64)
+            np.cumsum(np.bincount(self.indices, minlength=num_nodes), out=rev_indptr[1:])
+            rev_sources = self.edge_sources[rev_positions]; rev_weights = self.weights[rev_positions]
+            arrays = (rev_indptr, rev_sources, rev_weights, rev_positions)
+            self._reverse = (arrays, tuple(memoryview(a) for a in arrays))
+        return self._reverse[1]
+
+    # --- Búsquedas ---
+    def shortest_path_tree(self, sources, targets=None, cutoff=None, overlay=None, reverse=False):
+        # Dijkstra (uno o varios orígenes) sobre los arreglos CSR.
+        # Devuelve dist {nodo: costo} y pred {nodo: posición de la arista de llegada},
+        # solo para nodos asentados. Se detiene al asentar todos los targets, si se indican.
+        # overlay (QueryOverlay) añade nodos/aristas virtuales sin modificar el grafo.
+        # reverse=True recorre las aristas en sentido contrario: dist es el costo desde cada
+        # nodo hasta la fuente más cercana y pred la arista por la que se sale hacia ella.
+        if reverse: indptr, indices, weights, positions = self._reverse_adjacency_views()
+        else: (indptr, indices, weights), positions = self._adjacency_views(), None
+        num_nodes = self.number_of_nodes()
+        extra_out = {} if overlay is None else (overlay.inc if reverse else overlay.out)
+        extra_neighbors = None if overlay is None else (overlay.sources if reverse else overlay.targets)
+        if isinstance(sources, (int, np.integer)): sources = (int(sources),)
+        dist = {}; pred = {}; tentative = {}; heap = []
+        for s in sources:
+            s = int(s)
+            if s not in tentative: tentative[s] = 0.0; heap.append((0.0, s))
+        heapq.heapify(heap)
+        pending = None if targets is None else {int(t) for t in targets}
+        heappop, heappush = heapq.heappop, heapq.heappush
+        while heap:
+            d, u = heappop(heap)
+            if u in dist: continue
+            dist[u] = d
+            if pending is not None:
+                pending.discard(u)
+                if not pending: break
+            if u < num_nodes:
+                for pos in range(indptr[u], indptr[u + 1]):
+                    v = indices[pos]
+                    if v in dist: continue
+                    nd = d + weights[pos]
+                    if cutoff is not None and nd > cutoff: continue
+                    old = tentative.get(v)
+                    if old is None or nd < old:
+                        tentative[v] = nd; pred[v] = pos if positions is None else positions[pos]; heappush(heap, (nd, v))
+            if u in extra_out:
+                for pos in extra_out[u]:
+                    v = extra_neighbors[pos - overlay.base_edges]
+                    if v in dist: continue
+                    nd = d + overlay.weights[pos - overlay.base_edges]
+                    if cutoff is not None and nd > cutoff: continue
+                    old = tentative.get(v)
+                    if old is None or nd < old:
+                        tentative[v] = nd; pred[v] = pos; heappush(heap, (nd, v))
+        return dist, {v: pred[v] for v in dist if v in pred}
+
+    def cost_per_distance_bound(self):
+        # Mayor k tal que costo(arista) >= k * longitud de su geometría para todas las aristas.
+        # Como la longitud acota la distancia en línea recta, k * distancia euclídea es una
+        # heurística admisible y consistente para A*, también en los tramos del overlay
+        # (su costo es proporcional a la longitud recorrida).
+        if self._cost_bound is None:
+            bound = 0.0
+            if self.part_coords is not None and self.number_of_edges():
+                lengths = part_lengths(self.part_coords, self.part_offsets)[self.edge_ids]
+                positive = lengths > 0
+                if positive.any(): bound = max(float(np.min(self.weights[positive] / lengths[positive])), 0.0)
+            self._cost_bound = bound
+        return self._cost_bound
+
+    def _node_xy(self, node, overlay):
+        if overlay is not None and node >= self.number_of_nodes(): return overlay.node_coords(node)
+        return self.node_xy[node, 0], self.node_xy[node, 1]
+
+    def astar_path(self, source, target, overlay=None, heuristic_scale=None, stats=None):
+        # A* punto a punto con heurística euclídea (heuristic_scale * distancia en línea recta;
+        # por defecto cost_per_distance_bound). Devuelve (costo, posiciones de aristas) o None.
+        # stats (routing_engine.SearchStats) cuenta la búsqueda y los nodos asentados.
+        scale = self.cost_per_distance_bound() if heuristic_scale is None else float(heuristic_scale)
+        if self.node_xy is None: scale = 0.0
+        indptr, indices, weights = self._adjacency_views()
+        num_nodes = self.number_of_nodes()
+        extra_out = {} if overlay is None else overlay.out
+        xy = None if self.node_xy is None else memoryview(self.node_xy.reshape(-1))
+        hypot = math.hypot
+        tx, ty = self._node_xy(target, overlay) if scale > 0 else (0.0, 0.0)
+
+        def h(v):
+            if scale <= 0: return 0.0
+            if v < num_nodes: return scale * hypot(xy[2 * v] - tx, xy[2 * v + 1] - ty)
+            x, y = overlay.node_coords(v); return scale * hypot(x - tx, y - ty)
+
+        closed = set(); pred = {}; best = {source: 0.0}
+        heap = [(h(source), 0.0, source)]
+        heappop, heappush = heapq.heappop, heapq.heappush
+        found = None
+        while heap:
+            _, d, u = heappop(heap)
+            if u in closed: continue
+            if u == target: found = d, self.path_edges(pred, target, overlay); break
+            closed.add(u)
+            if u < num_nodes:
+                for pos in range(indptr[u], indptr[u + 1]):
+                    v = indices[pos]
+                    if v in closed: continue
+                    nd = d + weights[pos]; old = best.get(v)
+                    if old is None or nd < old: best[v] = nd; pred[v] = pos; heappush(heap, (nd + h(v), nd, v))
+            if u in extra_out:
+                for pos in extra_out[u]:
+                    v = overlay.targets[pos - overlay.base_edges]
+                    if v in closed: continue
+                    nd = d + overlay.weights[pos - overlay.base_edges]; old = best.get(v)
+                    if old is None or nd < old: best[v] = nd; pred[v] = pos; heappush(heap, (nd + h(v), nd, v))
+        if stats is not None: stats.searched(len(closed) + (found is not None))
+        return found
+
+    def bidirectional_path(self, source, target, overlay=None, stats=None):
+        # Dijkstra bidireccional: avanza alternadamente desde source (aristas salientes) y
+        # desde target (aristas entrantes) y termina cuando la suma de los dos frentes supera
+        # el mejor encuentro. Devuelve (costo, posiciones de aristas) o None.
+        if source == target:
+            if stats is not None: stats.searched(1)
+            return 0.0, []
+        num_nodes = self.number_of_nodes()
+        sides = []
+        for reverse in (False, True):
+            if reverse: indptr, indices, weights, positions = self._reverse_adjacency_views()
+            else: (indptr, indices, weights), positions = self._adjacency_views(), None
+            extra_out = {} if overlay is None else (overlay.inc if reverse else overlay.out)
+            extra_neighbors = None if overlay is None else (overlay.sources if reverse else overlay.targets)
+            start = target if reverse else source
+            sides.append(((indptr, indices, weights, positions, extra_out, extra_neighbors), {}, {}, {start: 0.0}, [(0.0, start)]))
+        heappop, heappush = heapq.heappop, heapq.heappush
+        best_cost = math.inf; meeting = None; side = 1
+        while sides[0][4] and sides[1][4]:
+            if sides[0][4][0][0] + sides[1][4][0][0] >= best_cost: break
+            side = 1 - side
+            (indptr, indices, weights, positions, extra_out, extra_neighbors), dist, pred, tentative, heap = sides[side]
+            other_tentative = sides[1 - side][3]
+            d, u = heappop(heap)
+            if u in dist: continue
+            dist[u] = d
+            neighbors = []
+            if u < num_nodes: neighbors.extend((indices[pos], weights[pos], pos if positions is None else positions[pos]) for pos in range(indptr[u], indptr[u + 1]))
+            if u in extra_out: neighbors.extend((extra_neighbors[pos - overlay.base_edges], overlay.weights[pos - overlay.base_edges], pos) for pos in extra_out[u])
+            for v, w, edge_pos in neighbors:
+                if v in dist: continue
+                nd = d + w; old = tentative.get(v)
+                if old is None or nd < old:
+                    tentative[v] = nd; pred[v] = edge_pos; heappush(heap, (nd, v))
+                    if v in other_tentative and nd + other_tentative[v] < best_cost: best_cost = nd + other_tentative[v]; meeting = v
+        if stats is not None: stats.searched(len(sides[0][1]) + len(sides[1][1]))
+        if meeting is None: return None
+        forward_pred, backward_pred = sides[0][2], sides[1][2]
+        return best_cost, self.path_edges(forward_pred, meeting, overlay) + self.path_edges(backward_pred, meeting, overlay, reverse=True)
+
+    def path_edges(self, pred, target, overlay=None, reverse=False):
+        # Posiciones de aristas desde la raíz del árbol hasta target, en sentido de
+        # circulación; con un árbol invertido (reverse=True), desde target hasta la raíz
+        edges = []; node = target
+        while node in pred:
+            pos = pred[node]; edges.append(pos)
+            node = self.edge_target(pos, overlay) if reverse else self.edge_source(pos, overlay)
+        if not reverse: edges.reverse()
+        return edges
+
+    def path_nodes(self, pred, target, overlay=None, reverse=False):
+        edges = self.path_edges(pred, target, overlay, reverse)
+        if not edges: return [target]
+        return [self.edge_source(edges[0], overlay)] + [self.edge_target(pos, overlay) for pos in edges]
+
+
+def cheapest_parallel_edges(sources, targets, weights):
+    # Índices de las aristas a conservar, ordenados por (origen, destino): de cada grupo de
+    # aristas paralelas queda la de menor costo (a igual costo, la primera). Ambos motores
+    # deduplican con esta misma regla, así devuelven las mismas rutas.
+    sources = np.asarray(sources); targets = np.asarray(targets)
+    order = np.lexsort((weights, targets, sources))
+    if len(order) < 2: return order
+    s, t = sources[order], targets[order]
+    keep = np.ones(len(order), dtype=bool)
+    keep[1:] = (s[1:] != s[:-1]) | (t[1:] != t[:-1])
+    return order[keep]
+
+
+def part_lengths(part_coords, part_offsets):
+    # Longitud de cada parte del búfer plano (suma de sus segmentos)
+    part_offsets = np.asarray(part_offsets, dtype=np.int64)
+    cumulative = np.concatenate(([0.0], np.cumsum(np.hypot(*np.diff(np.asarray(part_coords, dtype=np.float64), axis=0).T))))
+    return cumulative[part_offsets[1:] - 1] - cumulative[part_offsets[:-1]]
+
+
+def gather_part_coords(part_coords, part_offsets, parts, reversed_flags):
+    # Coordenadas de una cadena de partes recorridas en orden (cada una al derecho o al revés),
+    # sin repetir el vértice compartido entre partes consecutivas: un solo gather de índices
+    # sobre el búfer plano, sin listas intermedias de Python.
+    parts = np.asarray(parts, dtype=np.int64); reversed_flags = np.asarray(reversed_flags, dtype=bool)
+    starts = part_offsets[parts]; ends = part_offsets[parts + 1]
+    step = np.where(reversed_flags, -1, 1)
+    first = np.where(reversed_flags, ends - 1, starts); first[1:] += step[1:]
+    counts = ends - starts; counts[1:] -= 1
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    return part_coords[np.repeat(first, counts) + np.repeat(step, counts) * within]
+
+
+class QueryOverlay:
+    # Nodos y aristas virtuales locales a una consulta (p. ej. puntos proyectados sobre
+    # una arista). Los ids de nodo continúan después de los del grafo y las posiciones de
+    # arista después de graph.number_of_edges(), de modo que el grafo compartido no se
+    # modifica ni se reconstruye.
+    def __init__(self, graph):
+        self.base_nodes = graph.number_of_nodes(); self.base_edges = graph.number_of_edges()
+        self.node_xy = []
+        self.sources = []; self.targets = []; self.weights = []; self.coords = []
+        self.out = {}  # nodo -> posiciones de aristas virtuales salientes
+        self.inc = {}  # nodo -> posiciones de aristas virtuales entrantes
+        self._pairs = {}  # (u, v) -> posición de la arista virtual de menor costo
+
+    def number_of_nodes(self): return len(self.node_xy)
+
+    def number_of_edges(self): return len(self.sources)
+
+    def add_node(self, x, y):
+        self.node_xy.append((float(x), float(y)))
+        return self.base_nodes + len(self.node_xy) - 1
+
+    def add_edge(self, u, v, weight, coords):
+        pos = self.base_edges + len(self.sources)
+        self.sources.append(int(u)); self.targets.append(int(v)); self.weights.append(float(weight)); self.coords.append(coords)
+        self.out.setdefault(int(u), []).append(pos); self.inc.setdefault(int(v), []).append(pos)
+        best = self._pairs.get((u, v))
+        if best is None or weight < self.weights[best - self.base_edges]: self._pairs[(u, v)] = pos
+        return pos
+
+    def find_edge(self, u, v): return self._pairs.get((u, v), -1)
+
+    def has_node(self, node): return self.base_nodes <= node < self.base_nodes + len(self.node_xy)
+
+    def node_coords(self, node): return self.node_xy[node - self.base_nodes]
+
+
+# --- Construcción vectorizada de la topología ---
+# Recibe los extremos de cada parte de vía como arreglos de coordenadas y produce todas
+# las aristas de una sola vez. Los nodos se deduplican con un único np.unique sobre las
+# coordenadas cuantizadas a `precision` decimales; los ids se asignan en orden de primera
+# aparición (inicio y fin de cada parte, en orden), igual que la construcción fila a fila.
+# Los arreglos por parte (part_u ... part_backward) permiten regenerar las aristas de una
+# parte al actualizar el grafo (ver routing_engine.RoutingNetwork.update).
+TopologyArrays = namedtuple("TopologyArrays", ["node_xy", "sources", "targets", "weights", "part_ids", "reversed", "unknown_direction_mask",
+                                               "part_u", "part_v", "part_weights", "part_forward", "part_backward"])
+
+def node_keys(xy, precision=6):
+    # Clave entera de cada coordenada: dos extremos de parte son el mismo nodo si sus claves coinciden
+    return np.rint(np.asarray(xy, dtype=np.float64).reshape(-1, 2) * (10.0 ** precision)).astype(np.int64)
+
+def build_topology_arrays(start_xy, end_xy, lengths, direction, cost, precision=6, min_cost=0.00001):
+    start_xy = np.asarray(start_xy, dtype=np.float64).reshape(-1, 2); end_xy = np.asarray(end_xy, dtype=np.float64).reshape(-1, 2)
+    num_parts = len(start_xy)
+    endpoints = np.empty((2 * num_parts, 2), dtype=np.float64)
+    endpoints[0::2] = start_xy; endpoints[1::2] = end_xy
+    keys = node_keys(endpoints, precision)
+    _, first_idx, inverse = np.unique(keys, axis=0, return_index=True, return_inverse=True)
+    inverse = inverse.reshape(-1)
+    # Renumerar según la primera aparición para conservar ids estables
+    order = np.argsort(first_idx, kind="stable")
+    rank = np.empty(len(order), dtype=np.int64); rank[order] = np.arange(len(order), dtype=np.int64)
+    node_ids = rank[inverse]
+    node_xy = endpoints[first_idx[order]]
+    u_ids = node_ids[0::2]; v_ids = node_ids[1::2]
+    weights, forward, backward, unknown_direction = part_directions(u_ids, v_ids, lengths, direction, cost, min_cost)
+    sources, targets, edge_weights, part_ids, reversed_flags = part_edges(np.arange(num_parts), u_ids, v_ids, weights, forward, backward)
+    return TopologyArrays(node_xy, sources, targets, edge_weights, part_ids, reversed_flags, unknown_direction,
+                          u_ids, v_ids, weights, forward, backward)
+
+def part_directions(u_ids, v_ids, lengths, direction, cost, min_cost=0.00001):
+    # Costo y sentidos habilitados de cada parte -> (costo, digitalización, inverso, dirección no reconocida)
+    # Costo: valores no numéricos o nulos (NaN) usan la longitud de la parte; <= 0 usa min_cost
+    weights = np.asarray(cost, dtype=np.float64).copy()
+    missing = np.isnan(weights); weights[missing] = np.asarray(lengths, dtype=np.float64)[missing]
+    weights[~(weights > 0)] = min_cost
+    # Dirección: 0 ambos sentidos, 1 digitalización, 2 contrario, 3 restringida; nulos -> 0
+    direction = np.asarray(direction, dtype=np.float64)
+    direction = np.where(np.isfinite(direction), np.trunc(direction), 0.0)
+    unknown_direction = ~np.isin(direction, (0.0, 1.0, 2.0, 3.0))
+    usable = np.asarray(u_ids) != np.asarray(v_ids)
+    forward = usable & ((direction == 0.0) | (direction == 1.0))
+    backward = usable & ((direction == 0.0) | (direction == 2.0))
+    return weights, forward, backward, unknown_direction
+
+def part_edges(parts, u_ids, v_ids, weights, forward, backward):
+    # Aristas de las partes indicadas (índices en los arreglos por parte), ordenadas por parte
+    # y sentido -> (orígenes, destinos, costos, partes, invertidas)
+    parts = np.asarray(parts, dtype=np.int64)
+    fwd_parts = parts[forward[parts]]; bwd_parts = parts[backward[parts]]
+    part_ids = np.concatenate([fwd_parts, bwd_parts])
+    reversed_flags = np.concatenate([np.zeros(len(fwd_parts), dtype=bool), np.ones(len(bwd_parts), dtype=bool)])
+    edge_order = np.lexsort((reversed_flags, part_ids))
+    part_ids = part_ids[edge_order]; reversed_flags = reversed_flags[edge_order]
+    sources = np.where(reversed_flags, v_ids[part_ids], u_ids[part_ids])
+    targets = np.where(reversed_flags, u_ids[part_ids], v_ids[part_ids])
+    return sources, targets, weights[part_ids], part_ids, reversed_flags
+
+
+class NodeKeyIndex:
+    # Búsqueda de nodos por su clave (ver node_keys), para que las partes agregadas al actualizar
+    # el grafo reutilicen los nodos existentes: las claves se ordenan una vez y se consultan con
+    # searchsorted. Los nodos nuevos reciben ids a continuación de los existentes.
+    _KEY = [("x", np.int64), ("y", np.int64)]
+
+    def __init__(self, keys):
+        self.keys = np.ascontiguousarray(keys, dtype=np.int64).reshape(-1, 2)
+        self._order = np.argsort(self.keys.view(self._KEY).ravel(), kind="stable")
+        self._sorted = self.keys.view(self._KEY).ravel()[self._order]
+
+    def __len__(self): return len(self.keys)
+
+    def lookup(self, keys):
+        # Id de nodo de cada clave, o -1 si no existe
+        keys = np.ascontiguousarray(keys, dtype=np.int64).reshape(-1, 2).view(self._KEY).ravel()
+        pos = np.minimum(np.searchsorted(self._sorted, keys), max(len(self._sorted) - 1, 0))
+        found = (self._sorted[pos] == keys) if len(self._sorted) else np.zeros(len(keys), dtype=bool)
+        return np.where(found, self._order[pos] if len(self._sorted) else -1, -1)
+
+    def assign(self, keys):
+        # -> (id de nodo de cada clave, índice extendido, posición en keys de cada nodo nuevo en orden de id)
+        keys = np.ascontiguousarray(keys, dtype=np.int64).reshape(-1, 2)
+        ids = self.lookup(keys); missing = np.flatnonzero(ids < 0)
+        if len(missing) == 0: return ids, self, np.empty(0, dtype=np.int64)
+        # Claves nuevas en orden de primera aparición, como en build_topology_arrays
+        _, first_idx, inverse = np.unique(keys[missing], axis=0, return_index=True, return_inverse=True)
+        order = np.argsort(first_idx, kind="stable")
+        rank = np.empty(len(order), dtype=np.int64); rank[order] = np.arange(len(order), dtype=np.int64)
+        ids[missing] = len(self) + rank[inverse.reshape(-1)]
+        new_rows = missing[first_idx[order]]
+        return ids, NodeKeyIndex(np.concatenate([self.keys, keys[new_rows]])), new_rows
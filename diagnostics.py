@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# Diagnósticos agregados de una capa: por categoría de problema se guardan todos los ids de
+# las entidades afectadas, pero el log recibe una sola línea por categoría con el conteo y
+# unos pocos ids de muestra (un mensaje por entidad satura el panel de mensajes y frena la
+# interfaz con capas grandes). La lista completa alimenta la capa de entidades inválidas.
+# No depende de QGIS.
+from collections import OrderedDict
+
+import numpy as np
+
+MAX_SAMPLE_IDS = 5
+
+
+class Diagnostics:
+    def __init__(self):
+        self._ids = OrderedDict()
+
+    def add(self, category, ids):
+        # ids: uno o varios ids de entidad; las categorías conservan el orden de alta
+        ids = np.atleast_1d(np.asarray(ids))
+        if not len(ids): return
+        previous = self._ids.get(category)
+        self._ids[category] = ids if previous is None else np.concatenate([previous, ids])
+
+    def categories(self): return list(self._ids)
+
+    def count(self, category): return len(self._ids.get(category, ()))
+
+    def ids(self, category): return self._ids.get(category, np.empty(0, dtype=np.int64))
+
+    def total(self): return sum(len(ids) for ids in self._ids.values())
+
+    def without(self, ids):
+        # Copia sin los ids dados, p. ej. los de las entidades editadas antes de agregar los nuevos
+        diagnostics = Diagnostics()
+        for category, category_ids in self._ids.items(): diagnostics.add(category, category_ids[~np.isin(category_ids, np.asarray(list(ids)))])
+        return diagnostics
+
+    def summary(self, category, text, max_samples=MAX_SAMPLE_IDS):
+        # "<texto>: <n> (IDs 3, 8, 15 ...)"
+        ids = self.ids(category)
+        sample = ", ".join(str(value) for value in ids[:max_samples].tolist())
+        return f"{text}: {len(ids)} (IDs {sample}{' ...' if len(ids) > max_samples else ''})"
+
+    def as_arrays(self, prefix=""):
+        # {prefijo + categoría: ids}, para guardar junto a la caché en disco del grafo
+        return {prefix + category: ids for category, ids in self._ids.items()}
+
+    @classmethod
+    def from_arrays(cls, arrays, prefix=""):
+        diagnostics = cls()
+        for name, ids in arrays.items():
+            if name.startswith(prefix): diagnostics.add(name[len(prefix):], np.asarray(ids))
+        return diagnostics
@@ -0,0 +1,270 @@
+# -*- coding: utf-8 -*-
+# Cachés del grafo de ruteo. No depende de QGIS: las capas solo se usan a través de sus
+# señales (connect/disconnect), id() e isEditable().
+# - En disco: cada entrada es un directorio con un .npy por arreglo (CSR, coordenadas de
+#   nodos y de las partes de vía) que se abre con np.load(mmap_mode="r").
+# - En memoria: GraphCache, con varias entradas y expulsión LRU por tamaño.
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+CACHE_FORMAT_VERSION = 1
+_GRAPH_ARRAYS = ("indptr", "indices", "weights", "edge_ids", "edge_reversed", "node_xy")
+
+
+def cache_key(*components):
+    # Hash estable de los componentes de la clave (fuente, campos, filtro, mtime, ...)
+    payload = json.dumps([CACHE_FORMAT_VERSION] + [str(c) for c in components], ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+def source_mtime(path):
+    # Fecha de modificación más reciente del archivo de datos y sus archivos asociados
+    if not path or not os.path.isfile(path): return None
+    base, ext = os.path.splitext(path)
+    candidates = [path, path + "-wal"]
+    if ext.lower() == ".shp": candidates += [base + ".dbf", base + ".shx", base + ".DBF", base + ".SHX"]
+    return max(os.path.getmtime(p) for p in candidates if os.path.isfile(p))
+
+
+def save_graph(cache_root, key, graph, part_coords, part_offsets, metadata=None):
+    # Escritura atómica: se arma en un directorio temporal y luego se renombra
+    os.makedirs(cache_root, exist_ok=True)
+    final_dir = os.path.join(cache_root, key)
+    tmp_dir = tempfile.mkdtemp(prefix=key + ".", dir=cache_root)
+    try:
+        for name in _GRAPH_ARRAYS: np.save(os.path.join(tmp_dir, name + ".npy"), getattr(graph, name))
+        np.save(os.path.join(tmp_dir, "part_coords.npy"), np.ascontiguousarray(part_coords, dtype=np.float64))
+        np.save(os.path.join(tmp_dir, "part_offsets.npy"), np.ascontiguousarray(part_offsets, dtype=np.int64))
+        with open(os.path.join(tmp_dir, "meta.json"), "w", encoding="utf-8") as fh:
+            json.dump(dict(metadata or {}, version=CACHE_FORMAT_VERSION, key=key), fh, ensure_ascii=False)
+        if os.path.isdir(final_dir): shutil.rmtree(final_dir, ignore_errors=True)
+        os.replace(tmp_dir, final_dir)
+    except Exception:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+    return final_dir
+
+
+def load_graph_arrays(cache_root, key, mmap=True):
+    # Devuelve (dict de arreglos, metadata) o None si la entrada no existe o está incompleta
+    entry_dir = os.path.join(cache_root, key)
+    meta_path = os.path.join(entry_dir, "meta.json")
+    if not os.path.isfile(meta_path): return None
+    with open(meta_path, encoding="utf-8") as fh: metadata = json.load(fh)
+    if metadata.get("version") != CACHE_FORMAT_VERSION: return None
+    mmap_mode = "r" if mmap else None
+    arrays = {}
+    for name in _GRAPH_ARRAYS + ("part_coords", "part_offsets"):
+        path = os.path.join(entry_dir, name + ".npy")
+        if not os.path.isfile(path): return None
+        arrays[name] = np.load(path, mmap_mode=mmap_mode)
+    return arrays, metadata
+
+
+def save_entry_arrays(entry_dir, arrays):
+    # Agrega arreglos derivados (p. ej. una jerarquía de contracción) a una entrada existente;
+    # cada archivo se escribe con un nombre temporal y se renombra
+    for name, array in arrays.items():
+        tmp_path = os.path.join(entry_dir, f".{name}.tmp.npy")
+        np.save(tmp_path, np.ascontiguousarray(array))
+        os.replace(tmp_path, os.path.join(entry_dir, name + ".npy"))
+
+
+def load_entry_arrays(entry_dir, names, mmap=True):
+    # Arreglos derivados de una entrada, o None si falta alguno
+    paths = [os.path.join(entry_dir, name + ".npy") for name in names]
+    if not all(os.path.isfile(path) for path in paths): return None
+    return {name: np.load(path, mmap_mode="r" if mmap else None) for name, path in zip(names, paths)}
+
+
+def prune_entries(cache_root, keep_key, prefix_key):
+    # Elimina entradas antiguas de la misma capa (mismo prefix_key en la metadata)
+    if not os.path.isdir(cache_root): return
+    for name in os.listdir(cache_root):
+        if name == keep_key: continue
+        meta_path = os.path.join(cache_root, name, "meta.json")
+        try:
+            with open(meta_path, encoding="utf-8") as fh:
+                if json.load(fh).get("layer_key") == prefix_key: shutil.rmtree(os.path.join(cache_root, name), ignore_errors=True)
+        except (OSError, ValueError):
+            continue
+
+
+# --- Caché en memoria ---
+# Entradas actualizables: las ediciones de la capa no las invalidan; se anotan los ids de las
+# entidades editadas, con el número de versión de la edición, para que quien usa la entrada
+# actualice el grafo (ver take_edits)
+_EDIT_SIGNALS = ("featureAdded", "featureDeleted", "geometryChanged", "attributeValueChanged")
+_SCHEMA_SIGNALS = ("attributeAdded", "attributeDeleted", "willBeDeleted")
+
+class GraphCache:
+    # Guarda varios grafos construidos; al superar max_bytes expulsa los menos usados.
+    # Las entradas se asocian a la capa de origen y se invalidan cuando la capa emite
+    # dataChanged o afterCommitChanges, o cuando va a ser eliminada (willBeDeleted).
+    # Las entradas actualizables (put(..., updatable=True)) siguen las señales de edición de la
+    # capa: cada edición anota el id de la entidad, al deshacer la sesión (afterRollBack) se anotan
+    # todas las entidades tocadas en ella y al guardarla, los ids definitivos de las entidades
+    # nuevas. Si la entrada se creó con la sesión ya empezada no se sabe qué deshacer: el
+    # rollback la invalida. dataChanged solo las invalida fuera de una sesión de edición (p. ej.
+    # al recargar la capa); los cambios de campos y la eliminación de la capa, siempre.
+    def __init__(self, max_bytes=2 * 1024 ** 3):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # clave -> (valor, bytes, id de capa)
+        self._layer_keys = {}  # id de capa -> set de claves
+        self._layer_slots = {}  # id de capa -> (capa, [(señal, slot)])
+        self._edits = {}  # clave de entrada actualizable -> [{id editado pendiente: versión}, ids tocados en la sesión o None]
+        self._version = 0  # número de la última edición anotada
+        self._committed = set()  # capas con una sesión recién guardada (se ignora su próximo dataChanged)
+        self._lock = threading.RLock()
+
+    def __len__(self): return len(self._entries)
+
+    def __contains__(self, key): return key in self._entries
+
+    @property
+    def total_bytes(self):
+        with self._lock: return sum(size for _, size, _ in self._entries.values())
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None: return None
+            self._entries.move_to_end(key)
+            return item[0]
+
+    def version(self):
+        # Número de la última edición anotada; quien lee la capa lo guarda para take_edits
+        with self._lock: return self._version
+
+    def put(self, key, value, nbytes, layer=None, updatable=False):
+        # Una entrada existente de la misma capa se reemplaza en el lugar (p. ej. con el grafo ya
+        # actualizado): sigue atada a las señales de la capa y conserva las ediciones pendientes
+        # y las de la sesión en curso
+        with self._lock:
+            layer_id = layer.id() if layer is not None else None
+            item = self._entries.get(key)
+            if item is not None and item[2] == layer_id:
+                self._entries[key] = (value, int(nbytes), layer_id); self._entries.move_to_end(key)
+                if not updatable: self._edits.pop(key, None)
+                elif layer_id is not None and key not in self._edits: self._edits[key] = [{}, None if layer.isEditable() else set()]
+                self._evict(keep=key)
+                return
+            self._discard(key)
+            self._entries[key] = (value, int(nbytes), layer_id)
+            if layer_id is not None:
+                self._layer_keys.setdefault(layer_id, set()).add(key)
+                if updatable: self._edits[key] = [{}, None if layer.isEditable() else set()]
+                if layer_id not in self._layer_slots: self._watch_layer(layer)
+            self._evict(keep=key)
+
+    def take_edits(self, key, version=None):
+        # Ids de las entidades editadas pendientes (set vacío si no hay o la entrada no es
+        # actualizable); las entidades borradas ya no existen en la capa. Con version, solo las
+        # editadas hasta esa versión: las posteriores no están en lo que se leyó de la capa y
+        # quedan pendientes para la próxima llamada.
+        with self._lock:
+            edits = self._edits.get(key)
+            if edits is None: return set()
+            pending = {fid for fid, edit_version in edits[0].items() if version is None or edit_version <= version}
+            for fid in pending: del edits[0][fid]
+            return pending
+
+    def invalidate(self, key):
+        with self._lock: self._discard(key)
+
+    def invalidate_layer(self, layer_id):
+        with self._lock:
+            for key in list(self._layer_keys.get(layer_id, ())): self._discard(key)
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries): self._discard(key)
+
+    def _discard(self, key):
+        item = self._entries.pop(key, None)
+        if item is None: return
+        self._edits.pop(key, None)
+        layer_id = item[2]
+        keys = self._layer_keys.get(layer_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys: self._layer_keys.pop(layer_id, None); self._unwatch_layer(layer_id)
+
+    def _evict(self, keep=None):
+        total = sum(size for _, size, _ in self._entries.values())
+        for key in list(self._entries):
+            if total <= self.max_bytes: break
+            if key == keep: continue
+            total -= self._entries[key][1]; self._discard(key)
+
+    # --- Señales de la capa ---
+    def _invalidate_fixed(self, layer_id):
+        # Invalida las entradas no actualizables de la capa
+        with self._lock:
+            for key in list(self._layer_keys.get(layer_id, ())):
+                if key not in self._edits: self._discard(key)
+
+    def _on_edit(self, layer_id, fid):
+        with self._lock:
+            self._invalidate_fixed(layer_id); self._version += 1
+            for key in self._layer_keys.get(layer_id, ()):
+                pending, session = self._edits[key]; pending[fid] = self._version
+                if session is not None: session.add(fid)
+
+    def _on_data_changed(self, layer):
+        layer_id = layer.id()
+        with self._lock:
+            if layer.isEditable(): self._invalidate_fixed(layer_id)
+            elif layer_id in self._committed: self._committed.discard(layer_id); self._invalidate_fixed(layer_id)
+            else: self.invalidate_layer(layer_id)
+
+    def _on_rollback(self, layer_id):
+        with self._lock:
+            self._version += 1
+            for key in list(self._layer_keys.get(layer_id, ())):
+                edits = self._edits.get(key)
+                if edits is None or edits[1] is None: self._discard(key)
+                else: edits[0].update(dict.fromkeys(edits[1], self._version)); edits[1].clear()
+
+    def _on_committed_features(self, layer_id, features):
+        # Las entidades nuevas reciben su id definitivo al guardar (los ids temporales son
+        # negativos; quien actualiza el grafo descarta los que ya no existen)
+        with self._lock:
+            self._version += 1
+            for key in self._layer_keys.get(layer_id, ()):
+                if key in self._edits: self._edits[key][0].update(dict.fromkeys((feature.id() for feature in features), self._version))
+
+    def _on_commit(self, layer_id):
+        with self._lock:
+            self._invalidate_fixed(layer_id); self._committed.add(layer_id)
+            for key in self._layer_keys.get(layer_id, ()): self._edits[key][1] = set()
+
+    def _watch_layer(self, layer):
+        layer_id = layer.id()
+        slots = [(name, lambda *args: self._on_edit(layer_id, args[0])) for name in _EDIT_SIGNALS]
+        slots += [(name, lambda *args: self.invalidate_layer(layer_id)) for name in _SCHEMA_SIGNALS]
+        slots += [("dataChanged", lambda *args: self._on_data_changed(layer)),
+                  ("afterRollBack", lambda *args: self._on_rollback(layer_id)),
+                  ("committedFeaturesAdded", lambda _layer_id, features: self._on_committed_features(layer_id, features)),
+                  ("afterCommitChanges", lambda *args: self._on_commit(layer_id)),
+                  ("editingStarted", lambda *args: self._committed.discard(layer_id))]
+        connected = []
+        for signal_name, slot in slots:
+            signal = getattr(layer, signal_name, None)
+            if signal is not None: signal.connect(slot); connected.append((signal, slot))
+        self._layer_slots[layer_id] = (layer, connected)
+
+    def _unwatch_layer(self, layer_id):
+        watched = self._layer_slots.pop(layer_id, None)
+        self._committed.discard(layer_id)
+        if watched is None: return
+        for signal, slot in watched[1]:
+            try: signal.disconnect(slot)
+            except (RuntimeError, TypeError): pass  # La capa ya fue destruida del lado C++
@@ -1,10 +1,13 @@
 # -*- coding: utf-8 -*-
 import os
+import sys
 from qgis.PyQt.QtGui import QIcon
 from qgis.PyQt.QtWidgets import QAction
+from qgis.core import QgsApplication, QgsMessageLog, Qgis
 
-# Importar el diálogo
-from .plugin_dialog import PluginDialog
+# Importar el proveedor de Processing. El diálogo (y con él network_algorithms, geopandas
+# y shapely) se importa al abrirlo por primera vez, para no demorar el inicio de QGIS.
+from .processing_provider import AnalisisRedesProvider
 
 class MainPlugin:
     def __init__(self, iface):
@@ -12,11 +15,19 @@ class MainPlugin:
         self.plugin_dir = os.path.dirname(__file__)
         self.actions = []
         self.menu_name = "&Análisis Redes Transporte" # Nombre del menú
-        self.toolbar = self.iface.addToolBar("AnálisisRedesPluginToolbar")
-        self.toolbar.setObjectName("AnálisisRedesPluginToolbar")
+        self.toolbar = None
         self.dialog = None # Para mantener una única instancia del diálogo
+        self.provider = None
+
+    def initProcessing(self):
+        # También lo llama qgis_process (sin interfaz gráfica, iface = None)
+        self.provider = AnalisisRedesProvider()
+        QgsApplication.processingRegistry().addProvider(self.provider)
 
     def initGui(self):
+        self.initProcessing()
+        self.toolbar = self.iface.addToolBar("AnálisisRedesPluginToolbar")
+        self.toolbar.setObjectName("AnálisisRedesPluginToolbar")
         icon_path = os.path.join(self.plugin_dir, 'icon.png')
         
         self.action = QAction(QIcon(icon_path), 
@@ -34,21 +45,34 @@ class MainPlugin:
         self.actions.append(self.action)
 
     def unload(self):
+        if self.provider:
+            QgsApplication.processingRegistry().removeProvider(self.provider)
+            self.provider = None
         for action in self.actions:
             self.iface.removePluginMenu(self.menu_name, action)
             self.iface.removeToolBarIcon(action)
-        del self.toolbar
+        if self.toolbar:
+            del self.toolbar
+            self.toolbar = None
         
         # Limpiar la instancia del diálogo si existe
         if self.dialog:
             del self.dialog
             self.dialog = None
+        # Liberar los grafos en memoria, solo si el módulo de análisis llegó a cargarse
+        network_algorithms = sys.modules.get(__package__ + ".network_algorithms")
+        if network_algorithms is not None: network_algorithms.clear_graph_cache()
 
     def run(self):
         # Crear y mostrar el diálogo.
         # Si ya existe una instancia, simplemente muéstrala.
         # Esto evita múltiples ventanas del mismo plugin.
         if self.dialog is None:
+            try: from .plugin_dialog import PluginDialog
+            except ImportError as e:
+                QgsMessageLog.logMessage(f"No se pudo cargar el plugin: {e}", "PluginError", Qgis.Critical)
+                self.iface.messageBar().pushMessage("Error Dependencia", str(e), level=Qgis.Critical)
+                return
             self.dialog = PluginDialog(self.iface, self.iface.mainWindow())
         
         # Limpiar campos antes de mostrar, si es necesario (opcional)
@@ -1,23 +1,58 @@
 # -*- coding: utf-8 -*-
+import atexit
 import os
+import shutil
+import struct
+import tempfile
+import threading
+import time
 import traceback
+from collections import OrderedDict, namedtuple
 
 # --- NUEVAS DEPENDENCIAS EXTERNAS ---
+# networkx solo lo necesita el motor "networkx" y se importa en routing_engine al usarlo
 try:
+    import numpy as np
+    import pandas as pd
     import geopandas as gpd
-    import networkx as nx
-    from shapely.geometry import Point, LineString, MultiLineString as ShapelyMultiLineString
+    import shapely
+    from shapely.geometry import Point
 except ImportError as e:
-    print(f"NETWORK_ALGORITHMS.PY: Error importando librerías (geopandas, networkx, shapely): {e}")
-    raise ImportError(f"Librerías (geopandas, networkx, shapely) no encontradas. Instálelas en el entorno Python de QGIS. Error: {e}") from e
+    print(f"NETWORK_ALGORITHMS.PY: Error importando librerías (geopandas, shapely): {e}")
+    raise ImportError(f"Librerías (geopandas, shapely) no encontradas. Instálelas en el entorno Python de QGIS. Error: {e}") from e
 
 from qgis.core import (
-    QgsVectorLayer, QgsFeature, QgsFields, QgsField, QgsGeometry, QgsPointXY,
+    QgsVectorLayer, QgsFeature, QgsFields, QgsField, QgsGeometry,
     QgsProject, QgsVectorFileWriter, QgsWkbTypes, Qgis, QgsMessageLog,
-    QgsCoordinateReferenceSystem, QgsCoordinateTransform
+    QgsCoordinateTransform, QgsFeatureRequest, QgsCsException, QgsApplication, QgsVectorLayerFeatureSource
 )
 from qgis.PyQt.QtCore import QVariant
 
+from .csr_graph import CSRGraph
+from . import graph_cache
+from . import routing_engine
+from .routing_engine import RoutingNetwork
+from .options import (GRAPH_ENGINES, DEFAULT_GRAPH_ENGINE, DEFAULT_SNAP_MODE, DEFAULT_DAI_LINE_OUTPUT,
+                      DRO_SEARCH_METHODS, DEFAULT_DRO_SEARCH, DEFAULT_WORKERS)
+from .od_matrix import OD_MATRIX_FORMATS, open_od_matrix_writer, remove_od_matrix
+from . import parallel
+from . import contraction
+from . import profiling
+from .diagnostics import Diagnostics
+
+# Adaptador QGIS del motor de ruteo (routing_engine): convierte capas en arreglos, llama al
+# motor y escribe los resultados en capas. Los motores de grafo, modos de ajuste, salidas DAI,
+# búsquedas DRO y procesos por defecto (GRAPH_ENGINES, DEFAULT_SNAP_MODE, ...) se definen en options.
+# Caché persistente (solo motor CSR): el grafo construido se guarda en disco y se reutiliza
+# mientras no cambien la fuente, los campos, el filtro, el CRS ni la fecha de modificación.
+PERSISTENT_GRAPH_CACHE = True
+# Tamaño máximo (estimado) de los grafos retenidos en la caché en memoria
+GRAPH_CACHE_MAX_BYTES = 2 * 1024 ** 3
+# Distancia máxima (unidades del CRS de vías) para ajustar un punto a la red; los puntos más
+# lejanos se omiten. None ajusta siempre al nodo o la arista más cercana. La distancia de
+# ajuste de cada punto se escribe en las salidas (campos DIST_AJ_*).
+DEFAULT_SNAP_TOLERANCE = None
+
 # --- Funciones Auxiliares de Creación de Capas QGIS (Para archivos en disco) ---
 def create_file_writer(path, layer_name_log, fields_structure, geom_type_qgis, crs):
     driver_name = "ESRI Shapefile"
@@ -30,6 +65,82 @@ def create_file_writer(path, layer_name_log, fields_structure, geom_type_qgis, c
         return None
     return writer
 
+# --- Salida de resultados en lotes ---
+DEFAULT_SINK_BATCH = 5000
+
+class FeatureSink:
+    # Salida común para capas de memoria y archivos (Shapefile/GPKG): acumula QgsFeature y las
+    # escribe en lotes con addFeatures. Las capas de memoria se escriben directamente en su
+    # proveedor (sin startEditing) y las geometrías se construyen desde WKB, no desde WKT.
+    # seconds acumula el tiempo de armado y escritura de entidades (perfil de ejecución).
+    def __init__(self, path, default_name, log_name, fields, wkb_type, crs, batch_size=DEFAULT_SINK_BATCH):
+        self.path = path; self.fields = fields; self.batch_size = batch_size
+        self.layer = None; self.writer = None; self._target = None; self._buffer = []; self.count = 0; self.seconds = 0.0
+        if path.startswith("memory:"):
+            uri_parts = path.split(':', 1); name = uri_parts[1] if len(uri_parts) > 1 and uri_parts[1] else default_name
+            uri_schema = f"{QgsWkbTypes.displayString(wkb_type)}?crs={crs.authid()}"
+            for fld in fields: uri_schema += f"&field={fld.name()}:{QVariant.typeToName(fld.type())}({fld.length() if fld.length() > 0 else 255})"
+            layer = QgsVectorLayer(uri_schema, name, "memory")
+            if layer.isValid(): self.layer = layer; self._target = layer.dataProvider()
+            else: QgsMessageLog.logMessage(f"Error creando capa memoria {log_name}: {name}", "PluginError", Qgis.Critical)
+        else:
+            self.writer = create_file_writer(path, log_name, fields, wkb_type, crs); self._target = self.writer
+
+    def is_valid(self): return self._target is not None
+
+    def add(self, geometry, attributes):
+        start = time.perf_counter()
+        feat = QgsFeature(self.fields); feat.setGeometry(geometry); feat.setAttributes(attributes)
+        self._buffer.append(feat)
+        self.seconds += time.perf_counter() - start
+        if len(self._buffer) >= self.batch_size: self.flush()
+
+    def add_line(self, coords, attributes):
+        start = time.perf_counter(); geometry = coords_to_qgs_linestring(coords); self.seconds += time.perf_counter() - start
+        self.add(geometry, attributes)
+
+    def add_shapely(self, shapely_geom, attributes):
+        start = time.perf_counter(); geometry = shapely_to_qgs_geometry(shapely_geom); self.seconds += time.perf_counter() - start
+        self.add(geometry, attributes)
+
+    def flush(self):
+        if not self._buffer or self._target is None: return
+        start = time.perf_counter()
+        ok = self._target.addFeatures(self._buffer)
+        if isinstance(ok, tuple): ok = ok[0]  # el proveedor devuelve (éxito, entidades); el writer solo el éxito
+        if not ok: QgsMessageLog.logMessage(f"No se pudieron escribir {len(self._buffer)} entidades en {self.path}", "PluginWarning", Qgis.Warning)
+        else: self.count += len(self._buffer)
+        self._buffer = []
+        self.seconds += time.perf_counter() - start
+
+    def close(self):
+        # Vacía el búfer y cierra el archivo; devuelve la capa de memoria o la ruta de salida
+        if self._target is None: return None
+        self.flush()
+        start = time.perf_counter()
+        result = self.layer if self.layer is not None else self.path
+        if self.layer is not None: self.layer.updateExtents()
+        self.writer = None; self._target = None
+        self.seconds += time.perf_counter() - start
+        return result
+
+    def discard(self):
+        # Descarta lo escrito; en un archivo, el writer se libera (lo cierra) y el archivo parcial se borra
+        partial_file = self.writer is not None
+        self._buffer = []; self.writer = None; self._target = None
+        if partial_file: remove_output_file(self.path)
+
+def remove_output_file(path):
+    # Borra un archivo de salida (Shapefile con sus archivos asociados, GPKG con su -wal/-shm/-journal)
+    if not path or path.startswith("memory:") or not os.path.exists(path): return
+    try:
+        if path.lower().endswith(".shp"):
+            if not QgsVectorFileWriter.deleteShapeFile(path): raise OSError("deleteShapeFile falló")
+            return
+        for candidate in (path, path + "-wal", path + "-shm", path + "-journal"):
+            if os.path.exists(candidate): os.remove(candidate)
+    except OSError as e: QgsMessageLog.logMessage(f"No se pudo borrar {path}: {e}", "FileError", Qgis.Warning)
+
 # --- Funciones Auxiliares para Conversión ---
 def qgs_feature_to_shapely(qgs_feature, source_crs_qgis, target_crs_qgis=None):
     geom_qgs = qgs_feature.geometry()
@@ -48,15 +159,25 @@ def qgs_feature_to_shapely(qgs_feature, source_crs_qgis, target_crs_qgis=None):
 
 def shapely_to_qgs_geometry(shapely_geom): 
     if shapely_geom is None or shapely_geom.is_empty: return QgsGeometry()
-    try: return QgsGeometry.fromWkt(shapely_geom.wkt)
+    try:
+        qgs_geom = QgsGeometry(); qgs_geom.fromWkb(shapely.to_wkb(shapely_geom))
+        return qgs_geom
     except Exception as e: QgsMessageLog.logMessage(f"Error convirtiendo Shapely a QgsGeometry: {e}. WKT: {shapely_geom.wkt}", "ConversionError", Qgis.Warning); return QgsGeometry()
 
-def qgs_layer_to_gdf(qgs_layer, target_crs_qgis=None):
+def coords_to_qgs_linestring(coords):
+    # LineString 2D directamente desde un arreglo de coordenadas, armando el WKB sin pasar por Shapely
+    coords = np.ascontiguousarray(np.asarray(coords, dtype=np.float64)[:, :2])
+    qgs_geom = QgsGeometry(); qgs_geom.fromWkb(struct.pack("<BII", 1, 2, len(coords)) + coords.tobytes())
+    return qgs_geom
+
+def qgs_layer_to_gdf(qgs_layer, target_crs_qgis=None, bulk=True, field_names=None, fids=None):
+    # fids: lee solo esas entidades (las que no existen se ignoran)
     if not qgs_layer or not qgs_layer.isValid(): QgsMessageLog.logMessage("qgs_layer_to_gdf: Capa inválida.", "GDF_Conversion", Qgis.Critical); return None
-    features_data = []; field_names = [field.name() for field in qgs_layer.fields()]
     source_crs_qgis = qgs_layer.crs()
     final_target_crs_qgis = target_crs_qgis if target_crs_qgis and target_crs_qgis.isValid() else source_crs_qgis
-    for qgs_feat in qgs_layer.getFeatures():
+    if bulk: return _qgs_layer_to_gdf_bulk(qgs_layer, source_crs_qgis, final_target_crs_qgis, field_names, filter_fids=fids)
+    features_data = []; field_names = [field.name() for field in qgs_layer.fields()]
+    for qgs_feat in qgs_layer.getFeatures(QgsFeatureRequest() if fids is None else QgsFeatureRequest().setFilterFids(set(fids))):
         shapely_geom = qgs_feature_to_shapely(qgs_feat, source_crs_qgis, final_target_crs_qgis)
         attrs = {name: qgs_feat[name] for name in field_names}
         attrs['_qgs_fid_'] = qgs_feat.id() if qgs_feat.isValid() else None
@@ -65,469 +186,795 @@ def qgs_layer_to_gdf(qgs_layer, target_crs_qgis=None):
     if not features_data: return gpd.GeoDataFrame(columns=field_names + ['_qgs_fid_', 'geometry'], crs=gdf_crs_wkt)
     return gpd.GeoDataFrame(features_data, geometry='geometry', crs=gdf_crs_wkt)
 
-_G_nx = None; _nodo_id_map_nx = {}; _id_nodo_counter_nx = 0
-_id_to_shapely_point_nx = {}; _vias_gdf_for_snapping_nx = None
-_vias_layer_source_path_nx = None; _vias_qgs_crs_obj_cache = None
-
-def _get_or_create_nx_node_id(shapely_point):
-    global _id_nodo_counter_nx; key = (round(shapely_point.x, 6), round(shapely_point.y, 6))
-    if key not in _nodo_id_map_nx: _nodo_id_map_nx[key] = _id_nodo_counter_nx; _id_to_shapely_point_nx[_id_nodo_counter_nx] = shapely_point; _id_nodo_counter_nx += 1
-    return _nodo_id_map_nx[key]
-
-def _snap_to_nearest_vertex_nx(shapely_point_to_snap, list_of_road_shapely_geoms, tolerance=1e-6):
-    min_dist_sq = float('inf'); nearest_vertex_as_shapely_point = None
-    for road_shapely_geom in list_of_road_shapely_geoms:
-        if road_shapely_geom is None or road_shapely_geom.is_empty: continue
-        candidate_coords_for_snap = []
-        if isinstance(road_shapely_geom, LineString):
-            if len(road_shapely_geom.coords) >= 2: candidate_coords_for_snap.extend([road_shapely_geom.coords[0], road_shapely_geom.coords[-1]])
-        elif isinstance(road_shapely_geom, ShapelyMultiLineString):
-            for part_linestring in road_shapely_geom.geoms:
-                if len(part_linestring.coords) >= 2: candidate_coords_for_snap.extend([part_linestring.coords[0], part_linestring.coords[-1]])
-        for coord_tuple in candidate_coords_for_snap:
-            vertex_pt = Point(coord_tuple); dx = shapely_point_to_snap.x - vertex_pt.x
-            dy = shapely_point_to_snap.y - vertex_pt.y; dist_sq = dx*dx + dy*dy
-            if dist_sq < min_dist_sq: min_dist_sq = dist_sq; nearest_vertex_as_shapely_point = vertex_pt
-    if nearest_vertex_as_shapely_point and min_dist_sq < (tolerance * tolerance): return nearest_vertex_as_shapely_point
-    return shapely_point_to_snap
-
-def _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, force_rebuild=False):
-    global _G_nx, _nodo_id_map_nx, _id_nodo_counter_nx, _id_to_shapely_point_nx, \
-           _vias_gdf_for_snapping_nx, _vias_layer_source_path_nx, _vias_qgs_crs_obj_cache
-    current_vias_source = vias_qgs_layer.source()
-    if not force_rebuild and _G_nx is not None and _vias_layer_source_path_nx == current_vias_source:
-        QgsMessageLog.logMessage("Reutilizando grafo NetworkX y GDF.", "NetworkX_Cache", Qgis.Info)
-        return _G_nx, _vias_gdf_for_snapping_nx, _vias_qgs_crs_obj_cache
-
-    QgsMessageLog.logMessage(f"Construyendo nuevo grafo NetworkX para: {current_vias_source}", "NetworkX_Build", Qgis.Info)
-    _G_nx = nx.DiGraph(); _nodo_id_map_nx = {}; _id_nodo_counter_nx = 0; _id_to_shapely_point_nx = {}
-    _vias_qgs_crs_obj_cache = vias_qgs_layer.crs()
-    vias_gdf = qgs_layer_to_gdf(vias_qgs_layer, target_crs_qgis=_vias_qgs_crs_obj_cache)
-    if vias_gdf is None or vias_gdf.empty: QgsMessageLog.logMessage("Capa de vías vacía o inválida para GDF.", "NetworkX_Build", Qgis.Critical); _G_nx = None; return None, None, None
-    _vias_gdf_for_snapping_nx = vias_gdf; _vias_layer_source_path_nx = current_vias_source
-
-    for _, row_via in vias_gdf.iterrows():
-        geom_via = row_via.geometry; feature_id_for_log = row_via.get('_qgs_fid_', f"ÍndiceGDF_{_}")
-        if geom_via is None or geom_via.is_empty: continue
-        parts_coords_list = []
-        if isinstance(geom_via, LineString):
-            if len(geom_via.coords) >= 2: parts_coords_list.append(list(geom_via.coords))
-            else: QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log} (LineString): < 2 coords, omitiendo para nodos.", "NetworkX_Build", Qgis.Warning)
-        elif isinstance(geom_via, ShapelyMultiLineString):
-            for part_idx, part_linestring in enumerate(geom_via.geoms):
-                if len(part_linestring.coords) >= 2: parts_coords_list.append(list(part_linestring.coords))
-                else: QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log}, parte {part_idx} de MultiLineString: < 2 coords, omitiendo para nodos.", "NetworkX_Build", Qgis.Warning)
-        else: QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log}: Geometría no es LineString ni MultiLineString ({type(geom_via)}), omitiendo para nodos.", "NetworkX_Build", Qgis.Warning); continue
-        for line_coords in parts_coords_list: _get_or_create_nx_node_id(Point(line_coords[0])); _get_or_create_nx_node_id(Point(line_coords[-1]))
-    
-    for _, row_via in vias_gdf.iterrows():
-        geom_via = row_via.geometry; feature_id_for_log = row_via.get('_qgs_fid_', f"ÍndiceGDF_{_}")
-        if geom_via is None or geom_via.is_empty: continue
-        cost_val_attr = row_via.get(cost_field_name); direction_attr = row_via.get(dir_field_name)
-        direction_to_compare = "0"
-        if direction_attr is not None:
-            try: direction_to_compare = str(int(float(direction_attr)))
-            except (ValueError, TypeError): QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log}: Dirección '{direction_attr}' inválida, usando '0'.", "NetworkX_Build", Qgis.Warning)
-        
-        edge_geoms_parts = [];
-        if isinstance(geom_via, LineString):
-            if len(geom_via.coords) >= 2: edge_geoms_parts.append(geom_via)
-        elif isinstance(geom_via, ShapelyMultiLineString):
-            for part in geom_via.geoms:
-                if len(part.coords) >= 2: edge_geoms_parts.append(part)
-        if not edge_geoms_parts: continue
-
-        for edge_geom_part in edge_geoms_parts:
-            current_edge_cost = edge_geom_part.length if cost_val_attr is None else 0.0
-            if cost_val_attr is not None:
-                try: cost = float(cost_val_attr); current_edge_cost = cost if cost > 0 else 0.00001
-                except (ValueError, TypeError): current_edge_cost = edge_geom_part.length; QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log}: Costo '{cost_val_attr}' no numérico, usando longitud de parte ({current_edge_cost:.2f}).", "NetworkX_Build", Qgis.Warning)
-            else: current_edge_cost = edge_geom_part.length; QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log}: Campo de costo ('{cost_field_name}') no encontrado o nulo, usando longitud de parte ({current_edge_cost:.2f}).", "NetworkX_Build", Qgis.Info)
-            if current_edge_cost <= 0: current_edge_cost = 0.00001
-            
-            start_pt = Point(edge_geom_part.coords[0]); end_pt = Point(edge_geom_part.coords[-1])
-            u_id = _get_or_create_nx_node_id(start_pt); v_id = _get_or_create_nx_node_id(end_pt)
-            if u_id == v_id: continue
-
-            if direction_to_compare == "1": _G_nx.add_edge(u_id, v_id, geometry=edge_geom_part, weight=current_edge_cost)
-            elif direction_to_compare == "2": _G_nx.add_edge(v_id, u_id, geometry=LineString(edge_geom_part.coords[::-1]), weight=current_edge_cost)
-            elif direction_to_compare == "0": _G_nx.add_edge(u_id, v_id, geometry=edge_geom_part, weight=current_edge_cost); _G_nx.add_edge(v_id, u_id, geometry=LineString(edge_geom_part.coords[::-1]), weight=current_edge_cost)
-            elif direction_to_compare != "3": QgsMessageLog.logMessage(f"Vía FID {feature_id_for_log}: Dirección '{direction_to_compare}' no reconocida. Omitida.", "NetworkX_Build", Qgis.Warning)
-            
-    QgsMessageLog.logMessage(f"Grafo NetworkX construido. Nodos: {_G_nx.number_of_nodes()}, Aristas: {_G_nx.number_of_edges()}", "NetworkX_Build", Qgis.Success)
-    return _G_nx, _vias_gdf_for_snapping_nx, _vias_qgs_crs_obj_cache
-
+def _qgis_value_to_python(value):
+    # Los NULL de QGIS llegan como QVariant nulos; se normalizan a None para pandas
+    if isinstance(value, QVariant) and value.isNull(): return None
+    return value
+
+# --- Ingesta masiva: WKB + decodificación vectorizada ---
+# Lee la geometría de cada feature como WKB (sin pasar por WKT), reutiliza una única
+# transformación de CRS para toda la capa, acumula los atributos por columna y
+# decodifica todas las geometrías con una sola llamada a shapely.from_wkb.
+def _qgs_layer_to_gdf_bulk(qgs_layer, source_crs_qgis, target_crs_qgis, field_names=None, filter_fids=None):
+    layer_fields = qgs_layer.fields()
+    if field_names is None: field_names = [field.name() for field in layer_fields]
+    else: field_names = [name for name in dict.fromkeys(field_names) if name and layer_fields.indexOf(name) >= 0]
+    field_indices = [layer_fields.indexOf(name) for name in field_names]
+
+    transform = None
+    if source_crs_qgis.isValid() and target_crs_qgis.isValid() and source_crs_qgis.authid() != target_crs_qgis.authid():
+        transform = QgsCoordinateTransform(source_crs_qgis, target_crs_qgis, qgs_layer.transformContext())
+        if not transform.isValid(): QgsMessageLog.logMessage(f"Transformación CRS inválida para la capa {qgs_layer.name()}", "ConversionError", Qgis.Warning); return None
+
+    request = QgsFeatureRequest()
+    request.setSubsetOfAttributes(field_indices)
+    if filter_fids is not None: request.setFilterFids(set(filter_fids))
+    columns = [[] for _ in field_names]; fids = []; wkbs = []; transform_errors = []
+    for qgs_feat in qgs_layer.getFeatures(request):
+        geom_qgs = qgs_feat.geometry(); wkb = None
+        if not geom_qgs.isNull() and geom_qgs.constGet():
+            try:
+                if transform is not None: geom_qgs.transform(transform)
+                wkb = bytes(geom_qgs.asWkb())
+            except QgsCsException: transform_errors.append(qgs_feat.id())
+        wkbs.append(wkb); fids.append(qgs_feat.id())
+        attrs = qgs_feat.attributes()
+        for column, field_idx in zip(columns, field_indices): column.append(_qgis_value_to_python(attrs[field_idx]))
+    if transform_errors:
+        diagnostics = Diagnostics(); diagnostics.add("transform", transform_errors)
+        QgsMessageLog.logMessage(diagnostics.summary("transform", f"{qgs_layer.name()}: entidades que no se pudieron transformar al CRS de la red"), "ConversionError", Qgis.Warning)
+
+    gdf_crs_wkt = target_crs_qgis.toWkt() if target_crs_qgis and target_crs_qgis.isValid() else None
+    if not wkbs: return gpd.GeoDataFrame(columns=field_names + ['_qgs_fid_', 'geometry'], crs=gdf_crs_wkt)
+    geometries = shapely.from_wkb(np.array(wkbs, dtype=object), on_invalid="warn")
+    data = {name: column for name, column in zip(field_names, columns)}
+    data['_qgs_fid_'] = fids
+    return gpd.GeoDataFrame(data, geometry=gpd.GeoSeries(geometries, crs=gdf_crs_wkt), crs=gdf_crs_wkt)
+
+# --- Capas de entrada para los análisis en segundo plano ---
+class LayerSnapshot:
+    # Vista de solo lectura de una QgsVectorLayer para leerla desde el hilo de una QgsTask o de
+    # un algoritmo de Processing. Se crea en el hilo principal: copia los datos de la capa que
+    # usan los análisis y lee las entidades con un QgsVectorLayerFeatureSource, que conserva el
+    # estado de la capa al crearlo (incluidas las ediciones sin guardar) y se puede recorrer
+    # desde otro hilo. layer es la capa original, a cuyas señales se ata la caché de grafos;
+    # edit_version es la última edición que anotó la caché al crear la vista (ver take_edits).
+    def __init__(self, layer):
+        self.layer = layer
+        self.edit_version = _graph_cache_nx.version()
+        self._feature_source = QgsVectorLayerFeatureSource(layer)
+        self._id = layer.id(); self._name = layer.name(); self._source = layer.source(); self._crs = layer.crs()
+        self._fields = layer.fields(); self._subset = layer.subsetString(); self._wkb_type = layer.wkbType()
+        self._valid = layer.isValid(); self._modified = layer.isModified(); self._editable = layer.isEditable()
+        self._transform_context = layer.transformContext()
+        self.in_project = QgsProject.instance().mapLayer(self._id) is not None
+
+    def id(self): return self._id
+
+    def name(self): return self._name
+
+    def source(self): return self._source
+
+    def crs(self): return self._crs
+
+    def fields(self): return self._fields
+
+    def subsetString(self): return self._subset
+
+    def wkbType(self): return self._wkb_type
+
+    def isValid(self): return self._valid
+
+    def isModified(self): return self._modified
+
+    def isEditable(self): return self._editable
+
+    def transformContext(self): return self._transform_context
+
+    def getFeatures(self, request=None): return self._feature_source.getFeatures(request if request is not None else QgsFeatureRequest())
+
+def snapshot_layer(layer):
+    # LayerSnapshot de la capa (la misma si ya lo es). Los análisis lo llaman al empezar; el
+    # diálogo y Processing ya lo hacen en el hilo principal antes de lanzar el análisis.
+    if layer is None or isinstance(layer, LayerSnapshot): return layer
+    return LayerSnapshot(layer)
+
+# --- Ajuste de puntos a la red (índices espaciales sobre nodos o aristas) ---
+def _snap_point_layers(network, point_layers, snap_tolerance, snap_mode=DEFAULT_SNAP_MODE):
+    # point_layers: lista de (GeoDataFrame, campo ID, prefijo para el log). Todas las capas
+    # se ajustan juntas, de modo que en modo "edge" comparten un único QueryOverlay.
+    # Devuelve ([lista por capa de (id original, nodo, geometría, distancia de ajuste)], overlay o None)
+    for puntos_gdf, id_field_name, _ in point_layers:
+        if id_field_name not in puntos_gdf.columns: raise KeyError(id_field_name)
+    layer_geometries = [np.asarray(puntos_gdf.geometry.values, dtype=object) for puntos_gdf, _, _ in point_layers]
+    snapped_sets, overlay, used_mode = network.snap(layer_geometries, snap_tolerance, snap_mode)
+    if snap_mode == "edge" and used_mode != "edge" and point_layers: QgsMessageLog.logMessage("Ajuste a aristas solo disponible con el motor CSR; se ajusta al nodo más cercano.", "PluginWarning", Qgis.Warning)
+    results = [_collect_snapped_points(network.graph, puntos_gdf, id_field_name, geoms, node_ids, snap_distances, snap_tolerance, log_prefix, overlay)
+               for (puntos_gdf, id_field_name, log_prefix), geoms, (node_ids, snap_distances) in zip(point_layers, layer_geometries, snapped_sets)]
+    return results, overlay
+
+def _collect_snapped_points(G, puntos_gdf, id_field_name, geometries, node_ids, snap_distances, snap_tolerance, log_prefix, overlay=None):
+    original_ids = [str(value) for value in puntos_gdf[id_field_name].tolist()]
+    snapped = []; outside_tolerance = []; not_in_graph = []
+    for original_id, geom, node_id, snap_dist in zip(original_ids, geometries, node_ids.tolist(), snap_distances.tolist()):
+        if geom is None or geom.is_empty: continue
+        if node_id < 0: outside_tolerance.append(original_id); continue
+        if not (G.has_node(node_id) or (overlay is not None and overlay.has_node(node_id))): not_in_graph.append(original_id); continue
+        snapped.append((original_id, node_id, geom, snap_dist))
+    if outside_tolerance:
+        QgsMessageLog.logMessage(f"{log_prefix}: {len(outside_tolerance)} puntos a más de {snap_tolerance} de la red, omitidos: {', '.join(outside_tolerance[:20])}{' ...' if len(outside_tolerance) > 20 else ''}", "PluginWarning", Qgis.Warning)
+    if not_in_graph:
+        QgsMessageLog.logMessage(f"{log_prefix}: {len(not_in_graph)} puntos ajustados a nodos fuera del grafo, omitidos: {', '.join(not_in_graph[:20])}{' ...' if len(not_in_graph) > 20 else ''}", "PluginWarning", Qgis.Warning)
+    if snapped:
+        dists = np.array([item[3] for item in snapped])
+        QgsMessageLog.logMessage(f"{log_prefix}: {len(snapped)} puntos ajustados a la red. Distancia de ajuste media {dists.mean():.3f}, máxima {dists.max():.3f} (ID '{snapped[int(dists.argmax())][0]}').", "PluginInfo", Qgis.Info)
+    return snapped
+
+def _node_point(network, node_id, overlay=None):
+    return Point(network.node_coords(node_id, overlay))
+
+# --- Caché en memoria de grafos construidos ---
+# Clave: (fuente, campo dirección, campo costo, filtro, CRS, motor, id de capa, fecha de
+# modificación del archivo). Las entradas de capas del proyecto siguen las señales de la capa (ver
+# graph_cache.GraphCache): las ediciones no las invalidan, sino que el grafo se actualiza con las
+# entidades editadas al usarlo (ver _apply_layer_edits); por eso su clave no lleva la fecha del
+# archivo, que cambia al guardar la edición, sino el id de la capa: dos capas del proyecto sobre la
+# misma fuente (p. ej. una capa duplicada) se editan por separado y no comparten entrada. Las capas que Processing carga desde una ruta se
+# eliminan al terminar cada ejecución: sus entradas no se atan a la capa y se validan solo con la
+# fecha del archivo, así las ejecuciones consecutivas (p. ej. en modo por lotes) comparten el
+# grafo. No hay un grafo activo global: cada análisis recibe su entrada (RoutingNetwork con el
+# grafo y sus índices de ajuste, vías, CRS y diagnósticos) y la pasa a cada paso, así varias
+# tareas o ejecuciones de Processing pueden correr a la vez. Las entradas no se modifican:
+# una actualización crea otra. La consulta, construcción y actualización de entradas se
+# serializa con _graph_lock; la exportación del grafo y su jerarquía, con _graph_files_lock.
+_GraphCacheEntry = namedtuple("_GraphCacheEntry", ["network", "vias_gdf", "crs", "diagnostics"])
+_graph_cache_nx = graph_cache.GraphCache(max_bytes=GRAPH_CACHE_MAX_BYTES)
+_graph_lock = threading.RLock()
+_graph_files_lock = threading.RLock()
+
+def _graph_memory_key(vias_qgs_layer, dir_field_name, cost_field_name, engine):
+    source = vias_qgs_layer.source()
+    watched = _cache_watch_layer(vias_qgs_layer) is not None
+    layer_id = vias_qgs_layer.id() if watched else None
+    mtime = None if watched else graph_cache.source_mtime(source.split('|')[0])
+    return (source, dir_field_name, cost_field_name, vias_qgs_layer.subsetString(), vias_qgs_layer.crs().authid(), engine, layer_id, mtime)
+
+def _cache_watch_layer(vias_qgs_layer):
+    # Capa original (vias_qgs_layer es un LayerSnapshot) a cuyas señales se ata la entrada, o
+    # None para una capa de archivo ajena al proyecto
+    if not vias_qgs_layer.in_project and not vias_qgs_layer.isModified() and graph_cache.source_mtime(vias_qgs_layer.source().split('|')[0]) is not None: return None
+    return vias_qgs_layer.layer
+
+def _estimate_graph_bytes(G, vias_gdf, node_count):
+    # Estimación gruesa: arreglos CSR + geometrías + índices de nodos
+    geom_bytes = 0
+    if vias_gdf is not None and len(vias_gdf): geom_bytes = int(shapely.get_num_coordinates(np.asarray(vias_gdf.geometry.values, dtype=object)).sum()) * 16 + len(vias_gdf) * 200
+    if isinstance(G, CSRGraph): graph_bytes = G.nbytes + G.number_of_edges() * 16
+    else: graph_bytes = G.number_of_nodes() * 300 + G.number_of_edges() * 700
+    return graph_bytes + geom_bytes + node_count * 250
+
+def _cache_graph_entry(memory_key, vias_qgs_layer, entry):
+    # Solo se pueden actualizar las entradas con las vías leídas de la capa (no las de la caché en disco)
+    updatable = entry.vias_gdf is not None and "_qgs_fid_" in entry.vias_gdf.columns
+    nbytes = _estimate_graph_bytes(entry.network.graph, entry.vias_gdf, len(entry.network.node_xy))
+    _graph_cache_nx.put(memory_key, entry, nbytes, layer=_cache_watch_layer(vias_qgs_layer), updatable=updatable)
+    return entry
+
+def clear_graph_cache():
+    _graph_cache_nx.clear()
+
+# --- Caché persistente en disco ---
+def _graph_cache_root():
+    return os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "analisis_redes_grafos")
+
+def _persistent_cache_keys(vias_qgs_layer, dir_field_name, cost_field_name):
+    # (clave de la capa, clave completa) o (None, None) si la capa no es un archivo local sin ediciones pendientes
+    source = vias_qgs_layer.source()
+    mtime = graph_cache.source_mtime(source.split('|')[0])
+    if mtime is None or vias_qgs_layer.isModified(): return None, None
+    layer_key = graph_cache.cache_key(source, dir_field_name, cost_field_name, vias_qgs_layer.subsetString(), vias_qgs_layer.crs().authid())
+    return layer_key, graph_cache.cache_key(layer_key, mtime)
+
+def _load_persistent_graph(cache_key, crs_qgis):
+    # -> (grafo, GeoDataFrame de partes, Diagnostics o None si la entrada no los guardó)
+    try: loaded = graph_cache.load_graph_arrays(_graph_cache_root(), cache_key)
+    except Exception as e: QgsMessageLog.logMessage(f"No se pudo leer la caché del grafo: {e}", "NetworkX_Cache", Qgis.Warning); return None, None, None
+    if loaded is None: return None, None, None
+    arrays, metadata = loaded
+    part_offsets = np.asarray(arrays["part_offsets"])
+    part_index = np.repeat(np.arange(len(part_offsets) - 1), np.diff(part_offsets))
+    parts = shapely.linestrings(np.asarray(arrays["part_coords"]), indices=part_index)
+    G = CSRGraph(arrays["indptr"], arrays["indices"], arrays["weights"], arrays["edge_ids"],
+                 node_xy=arrays["node_xy"], edge_reversed=arrays["edge_reversed"], geometries=parts,
+                 part_coords=arrays["part_coords"], part_offsets=part_offsets)
+    G.storage_dir = os.path.join(_graph_cache_root(), cache_key)
+    crs_wkt = crs_qgis.toWkt() if crs_qgis and crs_qgis.isValid() else None
+    diagnostics = None
+    if "issues" in metadata:
+        issue_arrays = graph_cache.load_entry_arrays(G.storage_dir, [_ISSUE_PREFIX + category for category in metadata["issues"]], mmap=False)
+        if issue_arrays is not None: diagnostics = Diagnostics.from_arrays(issue_arrays, _ISSUE_PREFIX)
+    return G, gpd.GeoDataFrame(geometry=gpd.GeoSeries(parts, crs=crs_wkt), crs=crs_wkt), diagnostics
+
+def _save_persistent_graph(layer_key, cache_key, G, source, diagnostics):
+    # Los ids de las vías con problemas se guardan en la entrada (issue_<categoría>.npy)
+    try:
+        G.storage_dir = graph_cache.save_graph(_graph_cache_root(), cache_key, G, G.part_coords, G.part_offsets, metadata={"layer_key": layer_key, "source": source, "issues": diagnostics.categories()})
+        graph_cache.save_entry_arrays(G.storage_dir, diagnostics.as_arrays(_ISSUE_PREFIX))
+        graph_cache.prune_entries(_graph_cache_root(), cache_key, layer_key)
+    except Exception as e: QgsMessageLog.logMessage(f"No se pudo guardar la caché del grafo: {e}", "NetworkX_Cache", Qgis.Warning)
+
+# --- Diagnósticos de la capa de vías (ver diagnostics) ---
+# Una línea de log por categoría con el conteo y algunos ids de muestra; el detalle completo
+# (una entidad por vía y problema) lo escribe run_invalid_roads_core
+_ROAD_ISSUES = OrderedDict([
+    ("no_geometry", ("Vías sin geometría o con geometría ilegible; omitidas", Qgis.Warning)),
+    ("wrong_type", ("Vías que no son LineString ni MultiLineString; omitidas", Qgis.Warning)),
+    ("short_parts", ("Vías con partes de menos de 2 coordenadas; partes omitidas", Qgis.Warning)),
+    ("bad_direction", ("Vías con dirección no numérica; se usa '0'", Qgis.Warning)),
+    ("unknown_direction", ("Vías con dirección no reconocida; omitidas", Qgis.Warning)),
+    ("missing_cost", ("Vías sin costo numérico; se usa su longitud", Qgis.Info)),
+])
+_ISSUE_PREFIX = "issue_"
+
+def _road_diagnostics(vias_gdf, issue_rows):
+    # issue_rows: {categoría: filas de vias_gdf}; los ids son los de las entidades de la capa
+    fids = vias_gdf["_qgs_fid_"].to_numpy()
+    diagnostics = Diagnostics()
+    for category in _ROAD_ISSUES:
+        rows = issue_rows.get(category)
+        if rows is not None and len(rows): diagnostics.add(category, fids[rows])
+    return diagnostics
+
+def _log_road_diagnostics(diagnostics):
+    for category in diagnostics.categories():
+        text, level = _ROAD_ISSUES[category]
+        QgsMessageLog.logMessage(diagnostics.summary(category, text), "NetworkX_Build", level)
+
+def _road_values(vias_gdf, dir_field_name, cost_field_name):
+    # Conversión numérica masiva de dirección y costo (nulos/no numéricos -> NaN)
+    def _numeric_column(field_name):
+        if field_name and field_name in vias_gdf.columns: return pd.to_numeric(vias_gdf[field_name], errors="coerce").to_numpy(dtype=np.float64)
+        return np.full(len(vias_gdf), np.nan)
+    return _numeric_column(dir_field_name), _numeric_column(cost_field_name)
+
+def _report_diagnostics(vias_gdf, report, direction_values, dir_field_name, cost_field_name):
+    issue_rows = dict(report.issues)
+    if dir_field_name in vias_gdf.columns: issue_rows["bad_direction"] = np.nonzero(np.isnan(direction_values) & vias_gdf[dir_field_name].notna().to_numpy())[0]
+    # Sin campo de costo todas las vías usan su longitud: no es un problema de la capa
+    if not (cost_field_name and cost_field_name in vias_gdf.columns): issue_rows.pop("missing_cost", None)
+    return _road_diagnostics(vias_gdf, issue_rows)
+
+def _graph_from_roads(vias_gdf, dir_field_name, cost_field_name, engine):
+    # Red y diagnósticos a partir de las vías leídas de la capa; -> (RoutingNetwork o None, Diagnostics).
+    # Las partes de la red guardan el id de entidad de su vía, para actualizarla con las ediciones.
+    direction_values, cost_values = _road_values(vias_gdf, dir_field_name, cost_field_name)
+    road_ids = vias_gdf["_qgs_fid_"].to_numpy() if "_qgs_fid_" in vias_gdf.columns else None
+    network, report = routing_engine.build_network(vias_gdf.geometry.values, direction_values, cost_values, engine, road_ids)
+    diagnostics = _report_diagnostics(vias_gdf, report, direction_values, dir_field_name, cost_field_name); _log_road_diagnostics(diagnostics)
+    if network is None: QgsMessageLog.logMessage("Capa de vías sin partes lineales válidas.", "NetworkX_Build", Qgis.Critical)
+    return network, diagnostics
+
+def _apply_layer_edits(vias_qgs_layer, dir_field_name, cost_field_name, engine, entry, edited_fids, memory_key, profile):
+    # Actualiza la entrada con las entidades editadas desde que se construyó: solo esas
+    # entidades se vuelven a leer de la capa (las borradas ya no están). Sus partes se quitan de
+    # la red y las nuevas se agregan sin renumerar nodos (RoutingNetwork.update): se rearman
+    # solo las aristas de los nodos tocados y los índices de ajuste conservan sus árboles.
+    # Devuelve la entrada actualizada, o None si hay que reconstruirla desde cero.
+    if entry.vias_gdf is None or "_qgs_fid_" not in entry.vias_gdf.columns or entry.diagnostics is None: return None
+    # Las entidades nuevas tienen ids temporales (negativos) hasta que se guarda la edición
+    fid_values = entry.vias_gdf["_qgs_fid_"].to_numpy()
+    edited_fids = set(edited_fids) | set(fid_values[fid_values < 0].tolist())
+    with profile.stage("ingestion"): edited_gdf = qgs_layer_to_gdf(vias_qgs_layer, target_crs_qgis=entry.crs, field_names=[dir_field_name, cost_field_name], fids=edited_fids)
+    if edited_gdf is None: return None
+    start = time.perf_counter()
+    direction_values, cost_values = _road_values(edited_gdf, dir_field_name, cost_field_name)
+    network, report = entry.network.update(edited_fids, edited_gdf.geometry.values, direction_values, cost_values, edited_gdf["_qgs_fid_"].to_numpy())
+    if network is None: return None
+    vias_gdf = entry.vias_gdf[~entry.vias_gdf["_qgs_fid_"].isin(list(edited_fids))]
+    vias_gdf = pd.concat([vias_gdf, edited_gdf], ignore_index=True) if len(edited_gdf) else vias_gdf.reset_index(drop=True)
+    # Diagnósticos: los de las entidades no editadas se conservan; los de las editadas se recalculan
+    kept, edited = entry.diagnostics.without(edited_fids), _report_diagnostics(edited_gdf, report, direction_values, dir_field_name, cost_field_name)
+    diagnostics = Diagnostics()
+    for category in _ROAD_ISSUES: diagnostics.add(category, kept.ids(category)); diagnostics.add(category, edited.ids(category))
+    _log_road_diagnostics(diagnostics)
+    entry = _cache_graph_entry(memory_key, vias_qgs_layer, _GraphCacheEntry(network, vias_gdf, entry.crs, diagnostics))
+    profile.set_detail("build", "source", "updated"); profile.set_detail("build", "edited_features", len(edited_fids))
+    G = network.graph
+    QgsMessageLog.logMessage(f"Grafo ({engine}) actualizado con {len(edited_fids)} entidades editadas en {time.perf_counter() - start:.2f} s. Nodos: {G.number_of_nodes()}, Aristas: {G.number_of_edges()}", "NetworkX_Cache", Qgis.Info)
+    return entry
+
+def _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, force_rebuild=False, engine=DEFAULT_GRAPH_ENGINE, profile=None, require_diagnostics=False):
+    # Devuelve la entrada del grafo de la capa (_GraphCacheEntry) o None si no se pudo construir.
+    # profile (profiling.RunProfile): la lectura de la capa de vías se mide como etapa "ingestion"
+    # y el origen del grafo (memoria, disco o construido) queda en la etapa "build".
+    # require_diagnostics descarta las entradas de caché que no guardaron los diagnósticos de la capa.
+    if profile is None: profile = profiling.RunProfile("grafo")
+    if engine not in GRAPH_ENGINES: QgsMessageLog.logMessage(f"Motor de grafo '{engine}' desconocido.", "NetworkX_Build", Qgis.Critical); return None
+    vias_qgs_layer = snapshot_layer(vias_qgs_layer)
+    with _graph_lock:
+        # force_rebuild descarta la caché en memoria; la caché en disco se valida con su propia clave
+        current_vias_source = vias_qgs_layer.source()
+        memory_key = _graph_memory_key(vias_qgs_layer, dir_field_name, cost_field_name, engine)
+        cached_entry = None if force_rebuild else _graph_cache_nx.get(memory_key)
+        if cached_entry is not None and not (require_diagnostics and cached_entry.diagnostics is None):
+            profile.set_detail("build", "source", "memory")
+            # Solo las ediciones hechas antes de tomar la vista de la capa: las posteriores no
+            # están en lo que se va a leer y quedan para el próximo análisis
+            edited_fids = _graph_cache_nx.take_edits(memory_key, vias_qgs_layer.edit_version)
+            if not edited_fids:
+                QgsMessageLog.logMessage(f"Reutilizando grafo ({engine}) en memoria para: {current_vias_source}", "NetworkX_Cache", Qgis.Info)
+                return cached_entry
+            updated_entry = _apply_layer_edits(vias_qgs_layer, dir_field_name, cost_field_name, engine, cached_entry, edited_fids, memory_key, profile)
+            if updated_entry is not None: return updated_entry
+
+        vias_qgs_crs = vias_qgs_layer.crs()
+        layer_cache_key, persistent_cache_key = (None, None)
+        if engine == "csr" and PERSISTENT_GRAPH_CACHE: layer_cache_key, persistent_cache_key = _persistent_cache_keys(vias_qgs_layer, dir_field_name, cost_field_name)
+        if persistent_cache_key:
+            cached_G, cached_gdf, cached_diagnostics = _load_persistent_graph(persistent_cache_key, vias_qgs_crs)
+            if cached_G is not None and not (require_diagnostics and cached_diagnostics is None):
+                entry = _cache_graph_entry(memory_key, vias_qgs_layer, _GraphCacheEntry(RoutingNetwork(cached_G), cached_gdf, vias_qgs_crs, cached_diagnostics))
+                profile.set_detail("build", "source", "disk")
+                QgsMessageLog.logMessage(f"Grafo cargado desde caché en disco. Nodos: {cached_G.number_of_nodes()}, Aristas: {cached_G.number_of_edges()}", "NetworkX_Cache", Qgis.Info)
+                return entry
+
+        QgsMessageLog.logMessage(f"Construyendo nuevo grafo ({engine}) para: {current_vias_source}", "NetworkX_Build", Qgis.Info)
+        with profile.stage("ingestion"): vias_gdf = qgs_layer_to_gdf(vias_qgs_layer, target_crs_qgis=vias_qgs_crs, field_names=[dir_field_name, cost_field_name])
+        if vias_gdf is None or vias_gdf.empty: QgsMessageLog.logMessage("Capa de vías vacía o inválida para GDF.", "NetworkX_Build", Qgis.Critical); return None
+        profile.set_detail("build", "source", "built")
+
+        network, diagnostics = _graph_from_roads(vias_gdf, dir_field_name, cost_field_name, engine)
+        if network is None: return None
+        G = network.graph
+        if persistent_cache_key: _save_persistent_graph(layer_cache_key, persistent_cache_key, G, current_vias_source, diagnostics)
+        entry = _cache_graph_entry(memory_key, vias_qgs_layer, _GraphCacheEntry(network, vias_gdf, vias_qgs_crs, diagnostics))
+        QgsMessageLog.logMessage(f"Grafo ({engine}) construido. Nodos: {G.number_of_nodes()}, Aristas: {G.number_of_edges()}", "NetworkX_Build", Qgis.Success)
+        return entry
+
+# --- Avance y cancelación ---
+# feedback es cualquier objeto con setProgress(porcentaje) e isCanceled(): QgsTask, QgsFeedback
+# o QgsProcessingFeedback. Con feedback=None los análisis se ejecutan sin informar avance.
+def _with_progress(items, total, feedback):
+    # Recorre items informando el avance; deja de iterar si se cancela la tarea. Al salir
+    # (fin, cancelación o error) cierra items si es un generador, p. ej. el de parallel.run_jobs,
+    # que así termina su pool de procesos en vez de esperar a la recolección de basura.
+    try:
+        for done, item in enumerate(items, 1):
+            if _is_canceled(feedback): return
+            yield item
+            if feedback is not None and total: feedback.setProgress(100.0 * done / total)
+    finally:
+        close = getattr(items, "close", None)
+        if close is not None: close()
+
+def _is_canceled(feedback):
+    return feedback is not None and feedback.isCanceled()
+
+def _push_message(iface, title, text, level):
+    # Las tareas en segundo plano no tienen iface: el mensaje queda solo en el log
+    if iface is not None: iface.messageBar().pushMessage(title, text, level=level)
+
+# --- Perfil de ejecución (ver profiling) ---
+# Cada análisis mide tiempo y memoria pico por etapa y lo registra en una sola entrada del log
+# (pestaña 'PluginPerfil'); con profile_sidecar=True también lo guarda en <salida>.perfil.json.
+WRITE_PROFILE_SIDECAR = False
+
+def _graph_profile_counts(profile, G):
+    profile.count("nodes", G.number_of_nodes()); profile.count("edges", G.number_of_edges())
+
+def _finish_profile(profile, stats, features_written, output_path, profile_sidecar):
+    # stats: routing_engine.SearchStats del análisis. En paralelo, el tiempo de armado de rutas
+    # es la suma de los workers (ya incluido, en pared, en la etapa de búsquedas).
+    profile.count("searches", stats.searches); profile.count("settled_nodes", stats.settled); profile.count("routes", stats.routes)
+    profile.set_detail("search", "route_seconds", stats.route_seconds)
+    profile.count("features_written", features_written)
+    QgsMessageLog.logMessage(profile.finish().summary(), "PluginPerfil", Qgis.Info)
+    if profile_sidecar and output_path and not output_path.startswith("memory:"):
+        try: QgsMessageLog.logMessage(f"Perfil de ejecución guardado en {profile.write_sidecar(output_path)}", "PluginPerfil", Qgis.Info)
+        except OSError as e: QgsMessageLog.logMessage(f"No se pudo guardar el perfil de ejecución: {e}", "PluginWarning", Qgis.Warning)
+
+# --- Ejecución en paralelo (pool de procesos) ---
+def _parallel_graph_dir(G, workers):
+    # Directorio del grafo para los workers, o None si se debe ejecutar en secuencia.
+    # Si el grafo no está en la caché en disco se exporta a un directorio temporal.
+    if workers == 1: return None
+    if not isinstance(G, CSRGraph):
+        QgsMessageLog.logMessage("La ejecución en paralelo requiere el motor CSR; se ejecuta en secuencia.", "PluginWarning", Qgis.Warning); return None
+    with _graph_files_lock:
+        if G.storage_dir and os.path.isdir(G.storage_dir): return G.storage_dir
+        temp_root = tempfile.mkdtemp(prefix="analisis_redes_"); atexit.register(shutil.rmtree, temp_root, True)
+        G.storage_dir = graph_cache.save_graph(temp_root, "grafo", G, G.part_coords, G.part_offsets)
+        return G.storage_dir
+
+# --- Jerarquía de contracción (consultas repetidas sobre una red estática) ---
+# Se construye una vez por versión del grafo y se guarda junto a él en la caché en disco;
+# los análisis la usan con search="ch" (solo motor CSR).
+def _contraction_hierarchy(G, feedback=None):
+    # Jerarquía del grafo: ya en memoria, leída de la caché en disco o construida. None si se cancela.
+    # Una sola tarea la construye por grafo; las demás esperan y la reutilizan.
+    if G.hierarchy is not None: return G.hierarchy
+    with _graph_files_lock:
+        if G.hierarchy is not None: return G.hierarchy
+        if G.storage_dir:
+            try: arrays = graph_cache.load_entry_arrays(G.storage_dir, contraction.CH_ARRAYS)
+            except Exception as e: arrays = None; QgsMessageLog.logMessage(f"No se pudo leer la jerarquía de contracción: {e}", "NetworkX_Cache", Qgis.Warning)
+            if arrays is not None:
+                G.hierarchy = contraction.ContractionHierarchy(arrays)
+                QgsMessageLog.logMessage("Jerarquía de contracción cargada desde caché en disco.", "NetworkX_Cache", Qgis.Info)
+                return G.hierarchy
+        QgsMessageLog.logMessage(f"Construyendo jerarquía de contracción ({G.number_of_nodes()} nodos)...", "NetworkX_Build", Qgis.Info)
+        start = time.perf_counter()
+        hierarchy = contraction.build_contraction_hierarchy(G, feedback=feedback)
+        if hierarchy is None: return None
+        QgsMessageLog.logMessage(f"Jerarquía de contracción construida en {time.perf_counter() - start:.1f} s ({hierarchy.number_of_shortcuts()} atajos).", "NetworkX_Build", Qgis.Success)
+        if G.storage_dir:
+            try: graph_cache.save_entry_arrays(G.storage_dir, hierarchy.arrays)
+            except Exception as e: QgsMessageLog.logMessage(f"No se pudo guardar la jerarquía de contracción: {e}", "NetworkX_Cache", Qgis.Warning)
+        G.hierarchy = hierarchy
+        return hierarchy
+
+def _resolve_search(G, search, log_prefix):
+    # La jerarquía de contracción requiere el motor CSR; con NetworkX se usa el árbol por origen
+    if search == "ch" and not isinstance(G, CSRGraph):
+        QgsMessageLog.logMessage(f"{log_prefix}: la jerarquía de contracción requiere el motor CSR; se usa el árbol por origen.", "PluginWarning", Qgis.Warning); return "tree"
+    return search
+
+def prepare_contraction_hierarchy(vias_qgs_layer, dir_field_name, cost_field_name, feedback=None):
+    # Preproceso opcional: construye (o carga) y guarda la jerarquía de contracción de la red
+    vias_qgs_layer = snapshot_layer(vias_qgs_layer)
+    entry = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, engine="csr")
+    return entry is not None and _contraction_hierarchy(entry.network.graph, feedback) is not None
 
 # --- Lógica de DRO ---
 def run_dro_analysis_core(vias_qgs_layer, dir_field_name, cost_field_name,
                           puntos_qgs_layer, id_puntos_field_name,
-                          output_path, iface):
-    global _G_nx, _id_to_shapely_point_nx 
-    
-    writer = None 
-    output_layer_object = None
+                          output_path, iface=None, engine=DEFAULT_GRAPH_ENGINE, snap_tolerance=DEFAULT_SNAP_TOLERANCE, snap_mode=DEFAULT_SNAP_MODE,
+                          workers=DEFAULT_WORKERS, search=DEFAULT_DRO_SEARCH, feedback=None, profile_sidecar=WRITE_PROFILE_SIDECAR):
+    sink = None
     try:
-        if 'gpd' not in globals() or 'nx' not in globals():
-            err_msg = "Geopandas/NetworkX no instalados."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
-            iface.messageBar().pushMessage("Error Dependencia", err_msg, level=Qgis.Critical); return False, None
-
-        G, vias_gdf_for_snapping, vias_qgs_crs = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, force_rebuild=True)
-        if G is None: return False, None
+        if 'gpd' not in globals():
+            err_msg = "Geopandas no instalado."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
+            _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None
+        vias_qgs_layer, puntos_qgs_layer = snapshot_layer(vias_qgs_layer), snapshot_layer(puntos_qgs_layer)
+        if search not in DRO_SEARCH_METHODS:
+            QgsMessageLog.logMessage(f"DRO: búsqueda '{search}' desconocida (use {', '.join(DRO_SEARCH_METHODS)}).", "PluginError", Qgis.Critical); return False, None
+
+        profile = profiling.RunProfile("DRO", engine=engine, snap_mode=snap_mode, search=search, workers=workers)
+        with profile.stage("build"): entry = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, engine=engine, profile=profile)
+        if entry is None: return False, None
+        G, vias_qgs_crs = entry.network.graph, entry.crs
+        _graph_profile_counts(profile, G)
 
         out_fields_qgis = QgsFields()
         out_fields_qgis.append(QgsField("ORIGEN_ID", QVariant.String)); out_fields_qgis.append(QgsField("DESTINO_ID", QVariant.String))
         out_fields_qgis.append(QgsField("COSTO_ACC", QVariant.Double))
+        out_fields_qgis.append(QgsField("DIST_AJ_OR", QVariant.Double)); out_fields_qgis.append(QgsField("DIST_AJ_DE", QVariant.Double))
         
-        is_memory_output = output_path.startswith("memory:")
-        dp = None
-
-        if is_memory_output:
-            uri_parts = output_path.split(':', 1); layer_name = uri_parts[1] if len(uri_parts)>1 else "rutas_optimas_temp"
-            crs_str = vias_qgs_crs.authid()
-            memory_uri_schema = f"LineString?crs={crs_str}"
-            for field in out_fields_qgis: memory_uri_schema += f"&field={field.name()}:{QVariant.typeToName(field.type())}({field.length() if field.length() > 0 else 255})"
-            
-            output_layer_object = QgsVectorLayer(memory_uri_schema, layer_name, "memory")
-            if not output_layer_object.isValid(): QgsMessageLog.logMessage(f"Error creando capa memoria DRO: {layer_name}", "PluginError", Qgis.Critical); return False, None
-            dp = output_layer_object.dataProvider(); output_layer_object.startEditing()
-        else:
-            writer = create_file_writer(output_path, "rutas_optimas_dro_nx", out_fields_qgis, QgsWkbTypes.LineString, vias_qgs_crs)
-            if not writer: return False, None
+        sink = FeatureSink(output_path, "rutas_optimas_temp", "rutas_optimas_dro_nx", out_fields_qgis, QgsWkbTypes.LineString, vias_qgs_crs)
+        if not sink.is_valid(): return False, None
 
-        puntos_gdf = qgs_layer_to_gdf(puntos_qgs_layer, target_crs_qgis=vias_qgs_crs)
+        with profile.stage("ingestion"): puntos_gdf = qgs_layer_to_gdf(puntos_qgs_layer, target_crs_qgis=vias_qgs_crs, field_names=[id_puntos_field_name])
         if puntos_gdf is None or puntos_gdf.empty: QgsMessageLog.logMessage("DRO: Capa de puntos vacía.", "PluginError", Qgis.Warning) 
         
-        map_original_id_to_nx_id = {}; processed_point_ids_in_graph = []
-        # Usar la columna de geometría del GeoDataFrame de vías para el snapping
-        road_geoms_for_snap = vias_gdf_for_snapping['geometry'].tolist() if vias_gdf_for_snapping is not None else []
-
-
+        map_original_id_to_nx_id = {}; snap_dist_by_id = {}; processed_point_ids_in_graph = []; overlay = None
         if puntos_gdf is not None and not puntos_gdf.empty:
-            for _, row_punto in puntos_gdf.iterrows():
-                try: original_id = str(row_punto[id_puntos_field_name])
-                except KeyError: 
-                    QgsMessageLog.logMessage(f"DRO: Campo ID '{id_puntos_field_name}' no en puntos.", "PluginError", Qgis.Critical)
-                    if writer is not None: del writer # Limpieza
-                    return False, None
-                shapely_point_original = row_punto.geometry
-                if not shapely_point_original or shapely_point_original.is_empty: continue
-                snapped_point_shapely = _snap_to_nearest_vertex_nx(shapely_point_original, road_geoms_for_snap)
-                nx_node_id = _get_or_create_nx_node_id(snapped_point_shapely)
-                if not G.has_node(nx_node_id): QgsMessageLog.logMessage(f"DRO: Punto ID '{original_id}' (nodo NX {nx_node_id}) no en grafo.", "PluginWarning", Qgis.Warning); continue
-                map_original_id_to_nx_id[original_id] = nx_node_id
+            try:
+                with profile.stage("snapping"): (snapped_points,), overlay = _snap_point_layers(entry.network, [(puntos_gdf, id_puntos_field_name, "DRO")], snap_tolerance, snap_mode)
+            except KeyError: 
+                QgsMessageLog.logMessage(f"DRO: Campo ID '{id_puntos_field_name}' no en puntos.", "PluginError", Qgis.Critical)
+                sink.discard(); return False, None
+            for original_id, nx_node_id, _, snap_dist in snapped_points:
+                map_original_id_to_nx_id[original_id] = nx_node_id; snap_dist_by_id[original_id] = snap_dist
                 if original_id not in processed_point_ids_in_graph: processed_point_ids_in_graph.append(original_id)
 
         if len(processed_point_ids_in_graph) < 2: 
             QgsMessageLog.logMessage("DRO: Menos de 2 puntos válidos/mapeados.", "PluginError", Qgis.Warning)
-            if writer is not None: del writer # Limpieza
-            # Si es capa de memoria, no hay 'writer' que borrar aquí, se devuelve None
-            return False, None
+            sink.discard(); return False, None
             
         rutas_calculadas_count = 0
-        for i in range(len(processed_point_ids_in_graph)):
-            for j in range(len(processed_point_ids_in_graph)):
-                if i == j: continue
-                orig_id_str = processed_point_ids_in_graph[i]; dest_id_str = processed_point_ids_in_graph[j]
-                source_node = map_original_id_to_nx_id.get(orig_id_str); target_node = map_original_id_to_nx_id.get(dest_id_str)
-                if source_node is None or target_node is None or not G.has_node(source_node) or not G.has_node(target_node): continue
-                try:
-                    path_data = nx.single_source_dijkstra(G, source_node, target=target_node, weight='weight')
-                    total_cost, path_nx_nodes = path_data[0], path_data[1]
-                    route_coords = []
-                    if len(path_nx_nodes) >= 2:
-                        for k_idx in range(len(path_nx_nodes) - 1):
-                            u_n, v_n = path_nx_nodes[k_idx], path_nx_nodes[k_idx+1]; edge_data = G.get_edge_data(u_n, v_n)
-                            if edge_data and "geometry" in edge_data:
-                                edge_s_geom = edge_data["geometry"]
-                                if not route_coords: route_coords.extend(list(edge_s_geom.coords))
-                                else: route_coords.extend(list(edge_s_geom.coords)[1:])
-                            else: route_coords = []; QgsMessageLog.logMessage(f"DRO: Falta geometría en arista {u_n}-{v_n} para ruta {orig_id_str}->{dest_id_str}", "PluginWarning", Qgis.Warning); break 
-                    if route_coords and len(route_coords) >=2:
-                        route_s_geom = LineString(route_coords); route_q_geom = shapely_to_qgs_geometry(route_s_geom)
-                        feat = QgsFeature(out_fields_qgis); feat.setGeometry(route_q_geom); feat.setAttributes([orig_id_str, dest_id_str, total_cost])
-                        if is_memory_output and dp: dp.addFeature(feat)
-                        elif writer: writer.addFeature(feat)
-                        rutas_calculadas_count +=1
-                except (nx.NetworkXNoPath, nx.NodeNotFound, KeyError): continue
-        
-        if is_memory_output and output_layer_object: 
-            output_layer_object.commitChanges(); output_layer_object.updateExtents()
-        elif writer is not None: 
-            del writer; writer = None 
-
-        if rutas_calculadas_count > 0: return True, output_layer_object if is_memory_output else output_path
+        point_nodes = [map_original_id_to_nx_id[point_id] for point_id in processed_point_ids_in_graph]
+        point_snap_dists = [snap_dist_by_id[point_id] for point_id in processed_point_ids_in_graph]
+        profile.count("points", len(point_nodes)); stats = routing_engine.SearchStats()
+        search = _resolve_search(G, search, "DRO")
+        with profile.stage("search"):
+            if search == "ch":
+                with profile.stage("build"): hierarchy = _contraction_hierarchy(G, feedback)
+                origin_routes = routing_engine.dro_hierarchy_routes(G, hierarchy, point_nodes, overlay, stats) if hierarchy is not None else iter(())
+            else:
+                # En paralelo los orígenes se reparten en un pool de procesos; las rutas se escriben aquí al llegar
+                graph_dir = _parallel_graph_dir(G, workers)
+                if graph_dir: origin_routes = parallel.run_jobs(parallel.dro_job, range(len(point_nodes)), graph_dir, overlay, {"nodes": point_nodes, "search": search}, workers, stats=stats, feedback=feedback)
+                else: origin_routes = ((orig_index, routing_engine.dro_origin_routes(G, point_nodes, orig_index, search, overlay, stats)) for orig_index in range(len(point_nodes)))
+            for orig_index, routes in _with_progress(origin_routes, len(point_nodes), feedback):
+                for dest_index, total_cost, route_coords in routes:
+                    sink.add_line(route_coords, [processed_point_ids_in_graph[orig_index], processed_point_ids_in_graph[dest_index], total_cost,
+                                                 point_snap_dists[orig_index], point_snap_dists[dest_index]])
+                    rutas_calculadas_count +=1
+        profile.move_time("search", "output", sink.seconds)
+
+        if _is_canceled(feedback):
+            QgsMessageLog.logMessage("DRO cancelado por el usuario.", "PluginWarning", Qgis.Warning)
+            sink.discard(); return False, None
+
+        with profile.stage("output"): output = sink.close()
+        _finish_profile(profile, stats, sink.count, output_path, profile_sidecar)
+        if rutas_calculadas_count > 0: return True, output
         else: 
             QgsMessageLog.logMessage("DRO (NX) finalizado, no se generaron rutas.", "PluginWarning", Qgis.Warning)
-            # Limpiar capa de memoria si no se generaron rutas
-            if is_memory_output and output_layer_object is not None:
-                # No hay una forma directa de "borrar" un objeto QgsVectorLayer que no se añadió al proyecto.
-                # Simplemente no lo devolvemos.
-                pass
             return False, None
 
     except ImportError as e_imp:
         err_msg = f"ImportError: {e_imp}."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
-        iface.messageBar().pushMessage("Error Dependencia", err_msg, level=Qgis.Critical); return False, None
+        _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None
     except Exception as e:
         QgsMessageLog.logMessage(f"Error en run_dro_analysis_core (NX): {e}\n{traceback.format_exc()}", "PluginError", Qgis.Critical)
-        if 'writer' in locals() and writer is not None: # CORREGIDO
-            try: del writer
-            except Exception as e_del: QgsMessageLog.logMessage(f"Excepción menor al intentar 'del writer' en DRO except: {e_del}", "PluginDebug", Qgis.Debug)
-        if output_path and os.path.exists(output_path) and not output_path.startswith("memory:"):
-             try: os.remove(output_path)
-             except Exception as e_rem: QgsMessageLog.logMessage(f"No se pudo borrar {output_path}: {e_rem}", "FileError", Qgis.Warning)
+        if sink is not None: sink.discard()
         return False, None
 
+# --- Matriz de costos OD (DRO sin geometrías) ---
+def run_dro_matrix_core(vias_qgs_layer, dir_field_name, cost_field_name,
+                        puntos_qgs_layer, id_puntos_field_name,
+                        output_path, iface=None, engine=DEFAULT_GRAPH_ENGINE, snap_tolerance=DEFAULT_SNAP_TOLERANCE, snap_mode=DEFAULT_SNAP_MODE,
+                        workers=DEFAULT_WORKERS, search="tree", feedback=None, profile_sidecar=WRITE_PROFILE_SIDECAR):
+    # Igual que DRO pero solo calcula la matriz de costos; las filas se escriben por origen
+    # (formato según la extensión: .npy denso, .csv/.parquet en formato largo).
+    # search: "tree" (un árbol por origen) o "ch" (muchos a muchos sobre la jerarquía de contracción)
+    try:
+        if 'gpd' not in globals():
+            err_msg = "Geopandas no instalado."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
+            _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None
+        vias_qgs_layer, puntos_qgs_layer = snapshot_layer(vias_qgs_layer), snapshot_layer(puntos_qgs_layer)
+        if os.path.splitext(output_path)[1].lower() not in OD_MATRIX_FORMATS:
+            QgsMessageLog.logMessage(f"DRO (matriz): formato de salida no soportado '{output_path}'. Use {', '.join(OD_MATRIX_FORMATS)}.", "PluginError", Qgis.Critical); return False, None
+
+        profile = profiling.RunProfile("DRO (matriz)", engine=engine, snap_mode=snap_mode, search=search, workers=workers)
+        with profile.stage("build"): entry = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, engine=engine, profile=profile)
+        if entry is None: return False, None
+        G, vias_qgs_crs = entry.network.graph, entry.crs
+        _graph_profile_counts(profile, G)
+
+        with profile.stage("ingestion"): puntos_gdf = qgs_layer_to_gdf(puntos_qgs_layer, target_crs_qgis=vias_qgs_crs, field_names=[id_puntos_field_name])
+        if puntos_gdf is None or puntos_gdf.empty: QgsMessageLog.logMessage("DRO (matriz): Capa de puntos vacía.", "PluginError", Qgis.Warning); return False, None
+        try:
+            with profile.stage("snapping"): (snapped_points,), overlay = _snap_point_layers(entry.network, [(puntos_gdf, id_puntos_field_name, "DRO (matriz)")], snap_tolerance, snap_mode)
+        except KeyError:
+            QgsMessageLog.logMessage(f"DRO (matriz): Campo ID '{id_puntos_field_name}' no en puntos.", "PluginError", Qgis.Critical); return False, None
+        map_original_id_to_nx_id = {}
+        for original_id, nx_node_id, _, _ in snapped_points: map_original_id_to_nx_id.setdefault(original_id, nx_node_id)
+        if len(map_original_id_to_nx_id) < 2:
+            QgsMessageLog.logMessage("DRO (matriz): Menos de 2 puntos válidos/mapeados.", "PluginError", Qgis.Warning); return False, None
+
+        point_ids = list(map_original_id_to_nx_id); point_nodes = [map_original_id_to_nx_id[i] for i in point_ids]
+        pares_con_ruta = 0; filas_escritas = 0; write_seconds = 0.0
+        profile.count("points", len(point_nodes)); stats = routing_engine.SearchStats()
+        if _resolve_search(G, search, "DRO (matriz)") == "ch":
+            with profile.stage("build"): hierarchy = _contraction_hierarchy(G, feedback)
+            rows = routing_engine.od_matrix_hierarchy_rows(hierarchy, point_nodes, overlay, stats) if hierarchy is not None else iter(())
+        else:
+            graph_dir = _parallel_graph_dir(G, workers)
+            if graph_dir: rows = parallel.run_jobs(parallel.dro_matrix_job, range(len(point_nodes)), graph_dir, overlay, {"nodes": point_nodes}, workers, stats=stats, feedback=feedback)
+            else: rows = ((row_index, routing_engine.od_matrix_row(G, point_nodes, row_index, overlay, stats)) for row_index in range(len(point_nodes)))
+        with profile.stage("output"), open_od_matrix_writer(output_path, point_ids) as matrix_writer:
+            with profile.stage("search"):
+                for row_index, row_costs in _with_progress(rows, len(point_nodes), feedback):
+                    start = time.perf_counter(); matrix_writer.write_row(row_index, row_costs); write_seconds += time.perf_counter() - start
+                    pares_con_ruta += int(np.count_nonzero(~np.isnan(row_costs))) - 1; filas_escritas += 1
+            profile.move_time("search", "output", write_seconds)
+        if _is_canceled(feedback):
+            QgsMessageLog.logMessage("DRO (matriz) cancelado por el usuario.", "PluginWarning", Qgis.Warning)
+            _discard_od_matrix(output_path); return False, None
+        _finish_profile(profile, stats, filas_escritas, output_path, profile_sidecar)
+        QgsMessageLog.logMessage(f"DRO (matriz): {len(point_ids)}x{len(point_ids)} costos escritos en {output_path} ({pares_con_ruta} pares con ruta).", "PluginSuccess", Qgis.Success)
+        return True, output_path
+
+    except ImportError as e_imp:
+        err_msg = f"ImportError: {e_imp}."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
+        _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None
+    except Exception as e:
+        QgsMessageLog.logMessage(f"Error en run_dro_matrix_core: {e}\n{traceback.format_exc()}", "PluginError", Qgis.Critical)
+        _discard_od_matrix(output_path)
+        return False, None
+
+def _discard_od_matrix(output_path):
+    try: remove_od_matrix(output_path)
+    except OSError as e_rem: QgsMessageLog.logMessage(f"No se pudo borrar {output_path}: {e_rem}", "FileError", Qgis.Warning)
+
 # --- Lógica de DAI ---
 def run_dai_analysis_core(vias_qgs_layer, dir_field_name, cost_field_name,
                           puntos_qgs_layer, id_puntos_field_name, umbral_costo,
-                          output_line_path, output_poly_path, iface):
-    global _G_nx, _id_to_shapely_point_nx
-    line_writer, poly_writer = None, None; line_layer_obj, poly_layer_obj = None, None
-    dp_line, dp_poly = None, None
+                          output_line_path, output_poly_path, iface=None, engine=DEFAULT_GRAPH_ENGINE, snap_tolerance=DEFAULT_SNAP_TOLERANCE, snap_mode=DEFAULT_SNAP_MODE,
+                          line_output=DEFAULT_DAI_LINE_OUTPUT, workers=DEFAULT_WORKERS, feedback=None, profile_sidecar=WRITE_PROFILE_SIDECAR):
+    line_sink, poly_sink = None, None
     try:
-        if 'gpd' not in globals() or 'nx' not in globals():
-            err_msg = "Geopandas/NetworkX no instalados."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
-            iface.messageBar().pushMessage("Error Dependencia", err_msg, level=Qgis.Critical); return False, None, None
-
-        G, vias_gdf, vias_qgs_crs = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, force_rebuild=True)
-        if G is None: return False, None, None
+        if 'gpd' not in globals():
+            err_msg = "Geopandas no instalado."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
+            _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None, None
+        vias_qgs_layer, puntos_qgs_layer = snapshot_layer(vias_qgs_layer), snapshot_layer(puntos_qgs_layer)
+
+        # umbral_costo puede ser un valor o una lista de umbrales (bandas); se hace una sola
+        # búsqueda con el mayor y cada banda se obtiene de los mismos costos
+        umbrales = np.unique(np.atleast_1d(np.asarray(umbral_costo, dtype=np.float64)))
+        if len(umbrales) == 0 or not (umbrales > 0).all():
+            QgsMessageLog.logMessage(f"DAI: umbrales de costo no válidos: {umbral_costo}", "PluginError", Qgis.Critical); return False, None, None
+        umbral_busqueda = float(umbrales[-1])
+
+        profile = profiling.RunProfile("DAI", engine=engine, snap_mode=snap_mode, line_output=line_output, workers=workers, thresholds=umbrales.tolist())
+        with profile.stage("build"): entry = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, engine=engine, profile=profile)
+        if entry is None: return False, None, None
+        G, vias_qgs_crs = entry.network.graph, entry.crs
+        _graph_profile_counts(profile, G)
             
         out_line_fields = QgsFields(); out_line_fields.append(QgsField("ORIGEN_ID", QVariant.String))
-        out_line_fields.append(QgsField("DEST_NODO_ID", QVariant.Int)); out_line_fields.append(QgsField("COSTO_ACC", QVariant.Double))
+        if line_output == "routes":
+            out_line_fields.append(QgsField("DEST_NODO_ID", QVariant.Int)); out_line_fields.append(QgsField("COSTO_ACC", QVariant.Double))
+        else:
+            out_line_fields.append(QgsField("NODO_INI", QVariant.Int)); out_line_fields.append(QgsField("NODO_FIN", QVariant.Int))
+            out_line_fields.append(QgsField("COSTO_INI", QVariant.Double)); out_line_fields.append(QgsField("COSTO_FIN", QVariant.Double))
+        out_line_fields.append(QgsField("UMBRAL", QVariant.Double)); out_line_fields.append(QgsField("DIST_AJ_OR", QVariant.Double))
         out_poly_fields = QgsFields(); out_poly_fields.append(QgsField("ORIGEN_ID", QVariant.String)); out_poly_fields.append(QgsField("UMBRAL", QVariant.Double))
+        out_poly_fields.append(QgsField("DIST_AJ_OR", QVariant.Double))
 
-        is_mem_line = output_line_path.startswith("memory:")
-        is_mem_poly = output_poly_path.startswith("memory:")
+        line_sink = FeatureSink(output_line_path, "dai_lineas_temp", "dai_lineas_nx", out_line_fields, QgsWkbTypes.LineString, vias_qgs_crs)
+        if not line_sink.is_valid(): return False, None, None
+        poly_sink = FeatureSink(output_poly_path, "dai_polys_temp", "dai_poligonos_nx", out_poly_fields, QgsWkbTypes.Polygon, vias_qgs_crs)
+        if not poly_sink.is_valid(): line_sink.discard(); return False, None, None
 
-        if is_mem_line:
-            uri_parts = output_line_path.split(':', 1); name = uri_parts[1] if len(uri_parts)>1 else "dai_lineas_temp"
-            uri_schema = f"LineString?crs={vias_qgs_crs.authid()}"
-            for fld in out_line_fields: uri_schema += f"&field={fld.name()}:{QVariant.typeToName(fld.type())}({fld.length() if fld.length() > 0 else 255})"
-            line_layer_obj = QgsVectorLayer(uri_schema, name, "memory")
-            if not line_layer_obj.isValid(): return False, None, None
-            dp_line = line_layer_obj.dataProvider(); line_layer_obj.startEditing()
-        else:
-            line_writer = create_file_writer(output_line_path, "dai_lineas_nx", out_line_fields, QgsWkbTypes.LineString, vias_qgs_crs)
-            if not line_writer: return False, None, None
-
-        if is_mem_poly:
-            uri_parts = output_poly_path.split(':', 1); name = uri_parts[1] if len(uri_parts)>1 else "dai_polys_temp"
-            uri_schema = f"Polygon?crs={vias_qgs_crs.authid()}"
-            for fld in out_poly_fields: uri_schema += f"&field={fld.name()}:{QVariant.typeToName(fld.type())}({fld.length() if fld.length() > 0 else 255})"
-            poly_layer_obj = QgsVectorLayer(uri_schema, name, "memory")
-            if not poly_layer_obj.isValid(): return False, None, None
-            dp_poly = poly_layer_obj.dataProvider(); poly_layer_obj.startEditing()
-        else:
-            poly_writer = create_file_writer(output_poly_path, "dai_poligonos_nx", out_poly_fields, QgsWkbTypes.Polygon, vias_qgs_crs)
-            if not poly_writer: 
-                if 'line_writer' in locals() and line_writer is not None: del line_writer # Corrected syntax
-                return False, None, None
-        
-        puntos_gdf = qgs_layer_to_gdf(puntos_qgs_layer, target_crs_qgis=vias_qgs_crs)
-        if puntos_gdf is None or puntos_gdf.empty: return False, None, None 
-        
-        road_geoms_for_snap = vias_gdf['geometry'].tolist() if vias_gdf is not None else []
-
-
-        for _, row_origen in puntos_gdf.iterrows():
-            original_id_origen = str(row_origen[id_puntos_field_name])
-            shapely_point_origen = row_origen.geometry
-            if not shapely_point_origen or shapely_point_origen.is_empty: continue
-            snapped_origen_shapely = _snap_to_nearest_vertex_nx(shapely_point_origen, road_geoms_for_snap)
-            source_nx_node = _get_or_create_nx_node_id(snapped_origen_shapely)
-            if not G.has_node(source_nx_node): continue
-            try: costs_from_source, paths_from_source = nx.single_source_dijkstra(G, source_nx_node, cutoff=umbral_costo, weight='weight')
-            except nx.NodeNotFound: continue
-            
-            reachable_path_endpoints_shapely = []
-            for target_node_id, cost_to_target in costs_from_source.items():
-                path_nx_nodes = paths_from_source.get(target_node_id)
-                if not path_nx_nodes: 
-                    continue
-                route_coords = []
-                if len(path_nx_nodes) >= 2:
-                    for k_idx in range(len(path_nx_nodes) - 1):
-                        u_n, v_n = path_nx_nodes[k_idx], path_nx_nodes[k_idx+1]; edge_data = G.get_edge_data(u_n, v_n)
-                        if edge_data and "geometry" in edge_data:
-                            edge_s_geom = edge_data["geometry"]
-                            if not route_coords: route_coords.extend(list(edge_s_geom.coords))
-                            else: route_coords.extend(list(edge_s_geom.coords)[1:])
-                        else: route_coords = []; break
-                    if route_coords and len(route_coords) >=2:
-                        route_s_geom = LineString(route_coords); route_q_geom = shapely_to_qgs_geometry(route_s_geom)
-                        feat = QgsFeature(out_line_fields); feat.setGeometry(route_q_geom); feat.setAttributes([original_id_origen, target_node_id, cost_to_target])
-                        if is_mem_line and dp_line: dp_line.addFeature(feat)
-                        elif line_writer: line_writer.addFeature(feat)
-                        if target_node_id in _id_to_shapely_point_nx: reachable_path_endpoints_shapely.append(_id_to_shapely_point_nx[target_node_id])
-                        elif path_nx_nodes and route_coords: reachable_path_endpoints_shapely.append(Point(route_coords[-1]))
-                elif len(path_nx_nodes) == 1 and source_nx_node == target_node_id: 
-                    if source_nx_node in _id_to_shapely_point_nx: reachable_path_endpoints_shapely.append(_id_to_shapely_point_nx[source_nx_node])
-            
-            if len(reachable_path_endpoints_shapely) >= 3:
-                points_for_hull = [p for p in reachable_path_endpoints_shapely if p and not p.is_empty]
-                if len(points_for_hull) >=3:
-                    from shapely.geometry import MultiPoint as ShapelyMultiPoint
-                    hull_input_geom = ShapelyMultiPoint(points_for_hull)
-                    if not hull_input_geom.is_empty:
-                        convex_hull_geom = hull_input_geom.convex_hull
-                        if not convex_hull_geom.is_empty and convex_hull_geom.geom_type == 'Polygon':
-                            poly_q_geom = shapely_to_qgs_geometry(convex_hull_geom)
-                            feat = QgsFeature(out_poly_fields); feat.setGeometry(poly_q_geom); feat.setAttributes([original_id_origen, umbral_costo])
-                            if is_mem_poly and dp_poly: dp_poly.addFeature(feat)
-                            elif poly_writer: poly_writer.addFeature(feat)
-            # ... (buffer para < 3 puntos) ...
-
-        if is_mem_line and line_layer_obj: line_layer_obj.commitChanges(); line_layer_obj.updateExtents()
-        elif line_writer is not None: del line_writer; line_writer = None
-        if is_mem_poly and poly_layer_obj: poly_layer_obj.commitChanges(); poly_layer_obj.updateExtents()
-        elif poly_writer is not None: del poly_writer; poly_writer = None
+        with profile.stage("ingestion"): puntos_gdf = qgs_layer_to_gdf(puntos_qgs_layer, target_crs_qgis=vias_qgs_crs, field_names=[id_puntos_field_name])
+        if puntos_gdf is None or puntos_gdf.empty: line_sink.discard(); poly_sink.discard(); return False, None, None
         
+        with profile.stage("snapping"): (snapped_origenes,), overlay = _snap_point_layers(entry.network, [(puntos_gdf, id_puntos_field_name, "DAI")], snap_tolerance, snap_mode)
+        # -> (índice de origen, líneas, [(costo, x, y)] de los nodos alcanzados); ver routing_engine.dai_origin
+        origin_nodes = [node for _, node, _, _ in snapped_origenes]
+        profile.count("points", len(origin_nodes)); stats = routing_engine.SearchStats()
+        with profile.stage("search"):
+            graph_dir = _parallel_graph_dir(G, workers)
+            if graph_dir: origins = parallel.run_jobs(parallel.dai_job, range(len(origin_nodes)), graph_dir, overlay, {"nodes": origin_nodes, "cutoff": umbral_busqueda, "line_output": line_output}, workers, stats=stats, feedback=feedback)
+            else: origins = ((origin_index, *routing_engine.dai_origin(entry.network, node, umbral_busqueda, line_output, overlay, stats)) for origin_index, node in enumerate(origin_nodes))
+            for origin_index, lines, reached in _with_progress(origins, len(origin_nodes), feedback):
+                original_id_origen, snap_dist_origen = snapped_origenes[origin_index][0], snapped_origenes[origin_index][3]
+                for line in lines:
+                    if line_output == "routes": line_sink.add_line(line[-1], [original_id_origen, line[0], line[1], routing_engine.threshold_band(umbrales, line[1]), snap_dist_origen])
+                    else: line_sink.add_line(line[-1], [original_id_origen, line[0], line[1], line[2], line[3], routing_engine.threshold_band(umbrales, line[3]), snap_dist_origen])
+                # Un polígono por banda, con los nodos alcanzados dentro de cada umbral
+                for umbral_banda, convex_hull_geom in routing_engine.reach_polygons(reached, umbrales):
+                    poly_sink.add_shapely(convex_hull_geom, [original_id_origen, umbral_banda, snap_dist_origen])
+                # ... (buffer para < 3 puntos) ...
+        profile.move_time("search", "output", line_sink.seconds + poly_sink.seconds)
+
+        if _is_canceled(feedback):
+            QgsMessageLog.logMessage("DAI cancelado por el usuario.", "PluginWarning", Qgis.Warning)
+            line_sink.discard(); poly_sink.discard()
+            return False, None, None
+
+        with profile.stage("output"): line_output_obj, poly_output_obj = line_sink.close(), poly_sink.close()
+        _finish_profile(profile, stats, line_sink.count + poly_sink.count, output_line_path, profile_sidecar)
         QgsMessageLog.logMessage("DAI (NX) completado.", "PluginSuccess", Qgis.Success)
-        return True, line_layer_obj if is_mem_line else output_line_path, poly_layer_obj if is_mem_poly else output_poly_path
+        return True, line_output_obj, poly_output_obj
     except ImportError as e_imp:
         err_msg = f"ImportError: {e_imp}."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
-        iface.messageBar().pushMessage("Error Dependencia", err_msg, level=Qgis.Critical); return False, None, None
+        _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None, None
     except Exception as e:
         QgsMessageLog.logMessage(f"Error en DAI (NX): {e}\n{traceback.format_exc()}", "PluginError", Qgis.Critical)
-        if 'line_writer' in locals() and line_writer is not None: 
-            try: del line_writer
-            except Exception as e_del: QgsMessageLog.logMessage(f"Excepción menor al 'del line_writer' en DAI except: {e_del}", "PluginDebug", Qgis.Debug)
-        if 'poly_writer' in locals() and poly_writer is not None: 
-            try: del poly_writer
-            except Exception as e_del: QgsMessageLog.logMessage(f"Excepción menor al 'del poly_writer' en DAI except: {e_del}", "PluginDebug", Qgis.Debug)
-        # ... (borrado de archivos parciales) ...
+        if line_sink is not None: line_sink.discard()
+        if poly_sink is not None: poly_sink.discard()
         return False, None, None
 
 # --- Lógica de DUMC ---
 def run_dumc_analysis_core(vias_qgs_layer, dir_field_name, cost_field_name,
                            puntos1_qgs_layer, id_puntos1_field_name, 
                            puntos2_qgs_layer, id_puntos2_field_name, 
-                           output_points_path, output_routes_path, iface):
-    global _G_nx, _id_to_shapely_point_nx
-    points_writer, routes_writer = None, None; points_layer_obj, routes_layer_obj = None, None
-    dp_points, dp_routes = None, None
+                           output_points_path, output_routes_path, iface=None, engine=DEFAULT_GRAPH_ENGINE, snap_tolerance=DEFAULT_SNAP_TOLERANCE, snap_mode=DEFAULT_SNAP_MODE,
+                           search="tree", feedback=None, profile_sidecar=WRITE_PROFILE_SIDECAR):
+    points_sink, routes_sink = None, None
     try:
-        if 'gpd' not in globals() or 'nx' not in globals():
-            err_msg = "Geopandas/NetworkX no instalados."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
-            iface.messageBar().pushMessage("Error Dependencia", err_msg, level=Qgis.Critical); return False, None, None
-
-        G, vias_gdf, vias_qgs_crs = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, force_rebuild=True)
-        if G is None: return False, None, None
+        if 'gpd' not in globals():
+            err_msg = "Geopandas no instalado."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
+            _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None, None
+        vias_qgs_layer = snapshot_layer(vias_qgs_layer)
+        puntos1_qgs_layer, puntos2_qgs_layer = snapshot_layer(puntos1_qgs_layer), snapshot_layer(puntos2_qgs_layer)
+
+        profile = profiling.RunProfile("DUMC", engine=engine, snap_mode=snap_mode, search=search)
+        with profile.stage("build"): entry = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, engine=engine, profile=profile)
+        if entry is None: return False, None, None
+        G, vias_qgs_crs = entry.network.graph, entry.crs
+        _graph_profile_counts(profile, G)
         
         out_points_fields = QgsFields(); out_points_fields.append(QgsField("ID_ORIGEN", QVariant.String))
         out_points_fields.append(QgsField("ID_UTILIDAD", QVariant.String)); out_points_fields.append(QgsField("COSTO_MIN", QVariant.Double))
         out_routes_fields = QgsFields(); out_routes_fields.append(QgsField("ID_ORIGEN", QVariant.String))
         out_routes_fields.append(QgsField("ID_UTILIDAD", QVariant.String)); out_routes_fields.append(QgsField("COSTO_RUTA", QVariant.Double))
+        for fields in (out_points_fields, out_routes_fields):
+            fields.append(QgsField("DIST_AJ_OR", QVariant.Double)); fields.append(QgsField("DIST_AJ_UT", QVariant.Double))
 
-        is_mem_points = output_points_path.startswith("memory:")
-        is_mem_routes = output_routes_path.startswith("memory:")
-
-        if is_mem_points:
-            uri_parts = output_points_path.split(':', 1); name = uri_parts[1] if len(uri_parts)>1 else "dumc_puntos_temp"
-            uri_schema = f"Point?crs={vias_qgs_crs.authid()}"
-            for fld in out_points_fields: uri_schema += f"&field={fld.name()}:{QVariant.typeToName(fld.type())}({fld.length() if fld.length() > 0 else 255})"
-            points_layer_obj = QgsVectorLayer(uri_schema, name, "memory")
-            if not points_layer_obj.isValid(): return False, None, None
-            dp_points = points_layer_obj.dataProvider(); points_layer_obj.startEditing()
-        else:
-            points_writer = create_file_writer(output_points_path, "dumc_puntos_nx", out_points_fields, QgsWkbTypes.Point, vias_qgs_crs)
-            if not points_writer: return False, None, None
-        
-        if is_mem_routes:
-            uri_parts = output_routes_path.split(':', 1); name = uri_parts[1] if len(uri_parts)>1 else "dumc_rutas_temp"
-            uri_schema = f"LineString?crs={vias_qgs_crs.authid()}"
-            for fld in out_routes_fields: uri_schema += f"&field={fld.name()}:{QVariant.typeToName(fld.type())}({fld.length() if fld.length() > 0 else 255})"
-            routes_layer_obj = QgsVectorLayer(uri_schema, name, "memory")
-            if not routes_layer_obj.isValid(): 
-                if points_writer is not None: del points_writer # Limpieza
-                return False, None, None
-            dp_routes = routes_layer_obj.dataProvider(); routes_layer_obj.startEditing()
-        else:
-            routes_writer = create_file_writer(output_routes_path, "dumc_rutas_nx", out_routes_fields, QgsWkbTypes.LineString, vias_qgs_crs)
-            if not routes_writer: 
-                if points_writer is not None: del points_writer 
-                return False, None, None
+        points_sink = FeatureSink(output_points_path, "dumc_puntos_temp", "dumc_puntos_nx", out_points_fields, QgsWkbTypes.Point, vias_qgs_crs)
+        if not points_sink.is_valid(): return False, None, None
+        routes_sink = FeatureSink(output_routes_path, "dumc_rutas_temp", "dumc_rutas_nx", out_routes_fields, QgsWkbTypes.LineString, vias_qgs_crs)
+        if not routes_sink.is_valid(): points_sink.discard(); return False, None, None
 
-        puntos2_gdf = qgs_layer_to_gdf(puntos2_qgs_layer, target_crs_qgis=vias_qgs_crs)
-        if puntos2_gdf is None or puntos2_gdf.empty: return False, None, None 
-        
-        snapped_utilidades_info = []
-        road_geoms_for_snap = vias_gdf['geometry'].tolist() if vias_gdf is not None else []
-        for _, row_util in puntos2_gdf.iterrows():
-            original_id_util = str(row_util[id_puntos2_field_name])
-            shapely_point_util = row_util.geometry
-            if not shapely_point_util or shapely_point_util.is_empty: continue
-            snapped_util_shapely = _snap_to_nearest_vertex_nx(shapely_point_util, road_geoms_for_snap)
-            util_nx_node_id = _get_or_create_nx_node_id(snapped_util_shapely)
-            if G.has_node(util_nx_node_id): snapped_utilidades_info.append((original_id_util, util_nx_node_id, shapely_point_util))
-            else: QgsMessageLog.logMessage(f"DUMC: Utilidad '{original_id_util}' no en grafo.", "PluginWarning", Qgis.Warning)
-        
-        if not snapped_utilidades_info: return False, None, None 
-
-        puntos1_gdf = qgs_layer_to_gdf(puntos1_qgs_layer, target_crs_qgis=vias_qgs_crs)
-        if puntos1_gdf is None or puntos1_gdf.empty: return False, None, None
-
-        for _, row_origen in puntos1_gdf.iterrows():
-            original_id_origen = str(row_origen[id_puntos1_field_name])
-            shapely_point_origen = row_origen.geometry
-            if not shapely_point_origen or shapely_point_origen.is_empty: continue
-            snapped_origen_shapely = _snap_to_nearest_vertex_nx(shapely_point_origen, road_geoms_for_snap)
-            source_nx_node_origen = _get_or_create_nx_node_id(snapped_origen_shapely)
-            if not G.has_node(source_nx_node_origen): continue
-
-            min_costo_actual = float('inf'); mejor_utilidad_id_str = None; mejor_utilidad_s_geom = None; mejor_ruta_s_geom = None
-            for util_orig_id_str, util_nx_node_id, util_s_geom_original in snapped_utilidades_info:
-                try:
-                    if source_nx_node_origen == util_nx_node_id: current_cost = 0.0; path_nx_nodes = [source_nx_node_origen]
-                    elif not G.has_node(util_nx_node_id): continue
-                    else:
-                        path_data = nx.single_source_dijkstra(G, source_nx_node_origen, target=util_nx_node_id, weight='weight')
-                        current_cost, path_nx_nodes = path_data[0], path_data[1]
-                    if current_cost < min_costo_actual:
-                        min_costo_actual = current_cost; mejor_utilidad_id_str = util_orig_id_str; mejor_utilidad_s_geom = util_s_geom_original
-                        route_coords = []
-                        if len(path_nx_nodes) >= 2:
-                            for k_idx in range(len(path_nx_nodes) - 1):
-                                u_n, v_n = path_nx_nodes[k_idx], path_nx_nodes[k_idx+1]; edge_data = G.get_edge_data(u_n, v_n)
-                                if edge_data and "geometry" in edge_data:
-                                    edge_s_geom = edge_data["geometry"]
-                                    if not route_coords: route_coords.extend(list(edge_s_geom.coords))
-                                    else: route_coords.extend(list(edge_s_geom.coords)[1:])
-                                else: route_coords = []; break
-                            if route_coords: mejor_ruta_s_geom = LineString(route_coords)
-                        elif len(path_nx_nodes) == 1: mejor_ruta_s_geom = snapped_origen_shapely 
-                except (nx.NetworkXNoPath, nx.NodeNotFound, KeyError): continue
-            
-            if mejor_utilidad_id_str is not None:
-                feat_pt = QgsFeature(out_points_fields); feat_pt.setGeometry(shapely_to_qgs_geometry(mejor_utilidad_s_geom))
-                feat_pt.setAttributes([original_id_origen, mejor_utilidad_id_str, min_costo_actual])
-                if is_mem_points and dp_points: dp_points.addFeature(feat_pt)
-                elif points_writer: points_writer.addFeature(feat_pt)
-                
-                if mejor_ruta_s_geom and not mejor_ruta_s_geom.is_empty:
-                    feat_rt = QgsFeature(out_routes_fields); feat_rt.setGeometry(shapely_to_qgs_geometry(mejor_ruta_s_geom))
-                    feat_rt.setAttributes([original_id_origen, mejor_utilidad_id_str, min_costo_actual])
-                    if is_mem_routes and dp_routes: dp_routes.addFeature(feat_rt)
-                    elif routes_writer: routes_writer.addFeature(feat_rt)
-
-        if is_mem_points and points_layer_obj: points_layer_obj.commitChanges(); points_layer_obj.updateExtents()
-        elif points_writer is not None: del points_writer; points_writer = None
-        if is_mem_routes and routes_layer_obj: routes_layer_obj.commitChanges(); routes_layer_obj.updateExtents()
-        elif routes_writer is not None: del routes_writer; routes_writer = None
+        with profile.stage("ingestion"): puntos2_gdf = qgs_layer_to_gdf(puntos2_qgs_layer, target_crs_qgis=vias_qgs_crs, field_names=[id_puntos2_field_name])
+        if puntos2_gdf is None or puntos2_gdf.empty: points_sink.discard(); routes_sink.discard(); return False, None, None
         
+        with profile.stage("ingestion"): puntos1_gdf = qgs_layer_to_gdf(puntos1_qgs_layer, target_crs_qgis=vias_qgs_crs, field_names=[id_puntos1_field_name])
+        if puntos1_gdf is None or puntos1_gdf.empty: points_sink.discard(); routes_sink.discard(); return False, None, None
+
+        # Orígenes y utilidades se ajustan juntos para compartir los nodos virtuales (modo "edge")
+        with profile.stage("snapping"): (snapped_utilidades, snapped_origenes), overlay = _snap_point_layers(
+            entry.network, [(puntos2_gdf, id_puntos2_field_name, "DUMC (utilidades)"), (puntos1_gdf, id_puntos1_field_name, "DUMC (orígenes)")], snap_tolerance, snap_mode)
+        if not snapped_utilidades: points_sink.discard(); routes_sink.discard(); return False, None, None
+
+        # Una sola búsqueda desde todas las utilidades sobre el grafo invertido: cada nodo
+        # queda etiquetado con su utilidad más cercana, el costo y el camino hacia ella
+        utilidad_por_nodo = {}
+        for util_orig_id_str, util_nx_node_id, util_s_geom_original, util_snap_dist in snapped_utilidades:
+            utilidad_por_nodo.setdefault(util_nx_node_id, (util_orig_id_str, util_s_geom_original, util_snap_dist))
+        profile.count("points", len(snapped_origenes) + len(utilidad_por_nodo)); stats = routing_engine.SearchStats()
+        hierarchy = None
+        if _resolve_search(G, search, "DUMC") == "ch":
+            with profile.stage("build"): hierarchy = _contraction_hierarchy(G, feedback)
+            if hierarchy is None: points_sink.discard(); routes_sink.discard(); return False, None, None
+        with profile.stage("search"):
+            nearest = routing_engine.nearest_facility_routes(G, list(utilidad_por_nodo), [node for _, node, _, _ in snapped_origenes], overlay, hierarchy, stats=stats)
+            for origin_index, utilidad_nx_node, min_costo_actual, route_coords in _with_progress(nearest, len(snapped_origenes), feedback):
+                original_id_origen, source_nx_node_origen, _, snap_dist_origen = snapped_origenes[origin_index]
+                if utilidad_nx_node not in utilidad_por_nodo: continue
+                mejor_utilidad_id_str, mejor_utilidad_s_geom, snap_dist_utilidad = utilidad_por_nodo[utilidad_nx_node]
+                atributos = [original_id_origen, mejor_utilidad_id_str, min_costo_actual, snap_dist_origen, snap_dist_utilidad]
+                points_sink.add_shapely(mejor_utilidad_s_geom, atributos)
+                if route_coords is not None and len(route_coords) >= 2: routes_sink.add_line(route_coords, atributos)
+                # Origen sobre el mismo nodo que la utilidad: la "ruta" es el propio punto
+                elif utilidad_nx_node == source_nx_node_origen: routes_sink.add_shapely(_node_point(entry.network, source_nx_node_origen, overlay), atributos)
+        profile.move_time("search", "output", points_sink.seconds + routes_sink.seconds)
+
+        if _is_canceled(feedback):
+            QgsMessageLog.logMessage("DUMC cancelado por el usuario.", "PluginWarning", Qgis.Warning)
+            points_sink.discard(); routes_sink.discard()
+            return False, None, None
+
+        with profile.stage("output"): points_output_obj, routes_output_obj = points_sink.close(), routes_sink.close()
+        _finish_profile(profile, stats, points_sink.count + routes_sink.count, output_points_path, profile_sidecar)
         QgsMessageLog.logMessage("Análisis DUMC (NetworkX) completado.", "PluginSuccess", Qgis.Success)
-        return True, points_layer_obj if is_mem_points else output_points_path, routes_layer_obj if is_mem_routes else output_routes_path
+        return True, points_output_obj, routes_output_obj
         
     except ImportError as e_imp:
         err_msg = f"ImportError: {e_imp}."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
-        iface.messageBar().pushMessage("Error Dependencia", err_msg, level=Qgis.Critical); return False, None, None
+        _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None, None
     except Exception as e:
         QgsMessageLog.logMessage(f"Error en DUMC (NX): {e}\n{traceback.format_exc()}", "PluginError", Qgis.Critical)
-        if 'points_writer' in locals() and points_writer is not None: 
-            try: del points_writer
-            except Exception as e_del: QgsMessageLog.logMessage(f"Excepción menor al 'del points_writer' en DUMC except: {e_del}", "PluginDebug", Qgis.Debug)
-        if 'routes_writer' in locals() and routes_writer is not None: 
-            try: del routes_writer
-            except Exception as e_del: QgsMessageLog.logMessage(f"Excepción menor al 'del routes_writer' en DUMC except: {e_del}", "PluginDebug", Qgis.Debug)
-        return False, None, None
\ No newline at end of file
+        if points_sink is not None: points_sink.discard()
+        if routes_sink is not None: routes_sink.discard()
+        return False, None, None
+
+def run_invalid_roads_core(vias_qgs_layer, dir_field_name, cost_field_name, output_path, iface=None, engine=DEFAULT_GRAPH_ENGINE, feedback=None):
+    # Capa de entidades inválidas: una entidad por vía y problema detectado al construir el
+    # grafo (ID_ENTIDAD, PROBLEMA, DESCRIPCION), con la geometría original de la vía
+    sink = None
+    try:
+        vias_qgs_layer = snapshot_layer(vias_qgs_layer)
+        entry = _build_or_get_networkx_graph(vias_qgs_layer, dir_field_name, cost_field_name, engine=engine, require_diagnostics=True)
+        if entry is None: return False, None
+        out_fields = QgsFields(); out_fields.append(QgsField("ID_ENTIDAD", QVariant.String))
+        out_fields.append(QgsField("PROBLEMA", QVariant.String)); out_fields.append(QgsField("DESCRIPCION", QVariant.String))
+        sink = FeatureSink(output_path, "vias_invalidas_temp", "vias_invalidas_nx", out_fields, vias_qgs_layer.wkbType(), entry.crs)
+        if not sink.is_valid(): return False, None
+
+        diagnostics = entry.diagnostics
+        issues = [(category, fid) for category in diagnostics.categories() for fid in diagnostics.ids(category).tolist()]
+        issue_fids = {fid for _, fid in issues}
+        geometries = {feat.id(): feat.geometry() for feat in vias_qgs_layer.getFeatures(QgsFeatureRequest().setFilterFids(issue_fids).setSubsetOfAttributes([]))} if issue_fids else {}
+        for category, fid in _with_progress(issues, len(issues), feedback):
+            sink.add(geometries.get(fid, QgsGeometry()), [str(fid), category, _ROAD_ISSUES[category][0]])
+
+        if _is_canceled(feedback):
+            QgsMessageLog.logMessage("Validación de vías cancelada por el usuario.", "PluginWarning", Qgis.Warning)
+            sink.discard(); return False, None
+        output = sink.close()
+        QgsMessageLog.logMessage(f"Validación de vías: {len(issues)} problemas en {len(issue_fids)} vías.", "PluginSuccess", Qgis.Success)
+        return True, output
+
+    except ImportError as e_imp:
+        err_msg = f"ImportError: {e_imp}."; QgsMessageLog.logMessage(err_msg, "PluginError", Qgis.Critical)
+        _push_message(iface, "Error Dependencia", err_msg, Qgis.Critical); return False, None
+    except Exception as e:
+        QgsMessageLog.logMessage(f"Error en la validación de vías: {e}\n{traceback.format_exc()}", "PluginError", Qgis.Critical)
+        if sink is not None: sink.discard()
+        return False, None
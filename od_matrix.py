@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+# Escritura por bloques de matrices origen-destino (solo costos, sin geometrías).
+# No depende de QGIS. Formatos según la extensión de salida:
+# - .npy: matriz densa float64 (filas = orígenes, columnas = destinos) escrita sobre un
+#   memmap, más un <nombre>_ids.csv con el ID de cada fila/columna. Sin ruta = NaN.
+# - .csv / .parquet: tabla larga ORIGEN_ID, DESTINO_ID, COSTO_ACC; se omiten los pares
+#   sin ruta y los de un punto consigo mismo. Parquet requiere pyarrow.
+import abc
+import csv
+import os
+
+import numpy as np
+
+OD_MATRIX_FORMATS = (".npy", ".csv", ".parquet")
+DEFAULT_CHUNK_ROWS = 100000
+
+
+def open_od_matrix_writer(path, ids, chunk_rows=DEFAULT_CHUNK_ROWS):
+    # ids: IDs de los puntos, que son a la vez orígenes y destinos (matriz cuadrada)
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".npy": return NpyMatrixWriter(path, ids)
+    if ext == ".csv": return CsvLongWriter(path, ids, chunk_rows)
+    if ext == ".parquet": return ParquetLongWriter(path, ids, chunk_rows)
+    raise ValueError(f"Formato de matriz OD no soportado: '{ext}' (use {', '.join(OD_MATRIX_FORMATS)})")
+
+
+def remove_od_matrix(path):
+    # Borra una matriz incompleta (análisis cancelado o con error), incluido el _ids.csv de .npy
+    if not path: return
+    candidates = [path]
+    if os.path.splitext(path)[1].lower() == ".npy": candidates.append(os.path.splitext(path)[0] + "_ids.csv")
+    for candidate in candidates:
+        if os.path.exists(candidate): os.remove(candidate)
+
+
+class _ODMatrixWriter(abc.ABC):
+    def __init__(self, path, ids):
+        self.path = path
+        self.ids = [str(i) for i in ids]
+
+    def __enter__(self): return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+    @abc.abstractmethod
+    def write_row(self, row_index, costs):
+        # costs: arreglo de largo len(ids) con el costo hacia cada destino (NaN sin ruta)
+        pass
+
+    def close(self): pass
+
+
+class NpyMatrixWriter(_ODMatrixWriter):
+    def __init__(self, path, ids):
+        super().__init__(path, ids)
+        n = len(self.ids)
+        self._matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float64, shape=(n, n))
+        with open(os.path.splitext(path)[0] + "_ids.csv", "w", newline="", encoding="utf-8") as fh:
+            out = csv.writer(fh); out.writerow(["INDICE", "ID"])
+            out.writerows(enumerate(self.ids))
+
+    def write_row(self, row_index, costs):
+        self._matrix[row_index] = costs
+
+    def close(self):
+        if self._matrix is not None:
+            self._matrix.flush(); self._matrix = None
+
+
+class _LongTableWriter(_ODMatrixWriter):
+    # Acumula hasta chunk_rows pares en arreglos preasignados y luego los vuelca
+    def __init__(self, path, ids, chunk_rows):
+        super().__init__(path, ids)
+        self.chunk_rows = max(int(chunk_rows), len(self.ids))
+        self._ids_array = np.array(self.ids, dtype=object)
+        self._origins = np.empty(self.chunk_rows, dtype=np.int64)
+        self._destinations = np.empty(self.chunk_rows, dtype=np.int64)
+        self._costs = np.empty(self.chunk_rows, dtype=np.float64)
+        self._size = 0
+
+    def write_row(self, row_index, costs):
+        costs = np.asarray(costs, dtype=np.float64)
+        keep = ~np.isnan(costs); keep[row_index] = False
+        destinations = np.nonzero(keep)[0]
+        if self._size + len(destinations) > self.chunk_rows: self._flush()
+        end = self._size + len(destinations)
+        self._origins[self._size:end] = row_index
+        self._destinations[self._size:end] = destinations
+        self._costs[self._size:end] = costs[destinations]
+        self._size = end
+
+    def _flush(self):
+        if self._size == 0: return
+        self._write_chunk(self._ids_array[self._origins[:self._size]], self._ids_array[self._destinations[:self._size]], self._costs[:self._size])
+        self._size = 0
+
+    @abc.abstractmethod
+    def _write_chunk(self, origin_ids, destination_ids, costs):
+        pass
+
+
+class CsvLongWriter(_LongTableWriter):
+    def __init__(self, path, ids, chunk_rows=DEFAULT_CHUNK_ROWS):
+        super().__init__(path, ids, chunk_rows)
+        self._fh = open(path, "w", newline="", encoding="utf-8")
+        self._csv = csv.writer(self._fh)
+        self._csv.writerow(["ORIGEN_ID", "DESTINO_ID", "COSTO_ACC"])
+
+    def _write_chunk(self, origin_ids, destination_ids, costs):
+        self._csv.writerows(zip(origin_ids, destination_ids, costs.tolist()))
+
+    def close(self):
+        if self._fh is None: return
+        self._flush(); self._fh.close(); self._fh = None
+
+
+class ParquetLongWriter(_LongTableWriter):
+    def __init__(self, path, ids, chunk_rows=DEFAULT_CHUNK_ROWS):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError as e:
+            raise ImportError(f"La salida Parquet requiere pyarrow: {e}") from e
+        super().__init__(path, ids, chunk_rows)
+        self._pa = pa
+        self._schema = pa.schema([("ORIGEN_ID", pa.string()), ("DESTINO_ID", pa.string()), ("COSTO_ACC", pa.float64())])
+        self._writer = pq.ParquetWriter(path, self._schema)
+
+    def _write_chunk(self, origin_ids, destination_ids, costs):
+        pa = self._pa
+        self._writer.write_table(pa.table([pa.array(origin_ids, pa.string()), pa.array(destination_ids, pa.string()), pa.array(costs, pa.float64())], schema=self._schema))
+
+    def close(self):
+        if self._writer is None: return
+        self._flush(); self._writer.close(); self._writer = None
@@ -0,0 +1,25 @@
+# -*- coding: utf-8 -*-
+# Opciones de los análisis (motores, modos de ajuste, salidas y búsquedas). Sin dependencias:
+# el proveedor de Processing las usa al registrar los algoritmos, al iniciar QGIS, sin cargar
+# numpy, geopandas ni networkx (ver main_plugin). routing_engine y network_algorithms toman de aquí sus valores por defecto.
+
+# Motor de grafo: "csr" (arreglos NumPy) o "networkx" (nx.DiGraph)
+GRAPH_ENGINES = ("csr", "networkx")
+DEFAULT_GRAPH_ENGINE = "csr"
+# "node": ajustar al nodo más cercano; "edge": proyectar sobre la arista más cercana con
+# nodos virtuales locales a la consulta (solo motor CSR)
+SNAP_MODES = ("node", "edge")
+DEFAULT_SNAP_MODE = "node"
+# Salida de líneas DAI: "tree" cada arista del árbol de caminos mínimos una sola vez (costo
+# acumulado en ambos extremos); "routes" una ruta completa por nodo alcanzado
+DAI_LINE_OUTPUTS = ("tree", "routes")
+DEFAULT_DAI_LINE_OUTPUT = "tree"
+# Búsqueda de rutas DRO: "tree" un árbol de caminos mínimos por origen hacia todos los
+# destinos; "astar" (heurística euclídea admisible) o "bidirectional" (Dijkstra bidireccional)
+# una búsqueda dirigida por par, que expande muchos menos nodos con pocos pares lejanos;
+# "ch" consultas sobre la jerarquía de contracción del grafo (solo motor CSR)
+DRO_SEARCH_METHODS = ("tree", "astar", "bidirectional", "ch")
+DEFAULT_DRO_SEARCH = "tree"
+# Procesos para las búsquedas por origen (DRO, matriz DRO y DAI): 1 = secuencial,
+# 0 = uno por CPU. Requiere el motor CSR; el grafo se comparte mediante archivos mapeados.
+DEFAULT_WORKERS = 1
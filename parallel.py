@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+# Ejecución de las búsquedas por origen en un pool de procesos. No depende de QGIS.
+# El grafo no se serializa: cada worker abre los arreglos del directorio de caché en disco
+# (ver graph_cache) con np.load(mmap_mode="r"), así las páginas se comparten entre procesos
+# a través de la caché del sistema operativo. Solo viajan índices de origen y resultados
+# compactos (costos y coordenadas), que el proceso principal escribe a medida que llegan.
+import multiprocessing
+import os
+import sys
+
+from . import graph_cache, routing_engine
+from .csr_graph import CSRGraph
+
+_state = None  # _WorkerState del proceso actual
+
+
+def resolve_workers(workers):
+    # None o <= 0: un proceso por CPU
+    if workers is None or workers <= 0: return max(os.cpu_count() or 1, 1)
+    return int(workers)
+
+
+def python_executable():
+    # Dentro de QGIS sys.executable es el binario de QGIS; los workers necesitan el intérprete
+    exe = sys.executable or ""
+    if os.path.basename(exe).lower().startswith("python"): return exe
+    names = ("pythonw.exe", "python.exe") if os.name == "nt" else ("python3", "python")
+    for folder in (sys.exec_prefix, os.path.join(sys.exec_prefix, "bin")):
+        for name in names:
+            candidate = os.path.join(folder, name)
+            if os.path.isfile(candidate): return candidate
+    return exe
+
+
+def open_graph_dir(graph_dir):
+    # CSRGraph sin geometrías Shapely; las coordenadas planas de las partes quedan en memmap
+    loaded = graph_cache.load_graph_arrays(os.path.dirname(graph_dir), os.path.basename(graph_dir), mmap=True)
+    if loaded is None: raise FileNotFoundError(f"No se encontró el grafo en {graph_dir}")
+    arrays, _ = loaded
+    return CSRGraph(arrays["indptr"], arrays["indices"], arrays["weights"], arrays["edge_ids"],
+                    node_xy=arrays["node_xy"], edge_reversed=arrays["edge_reversed"],
+                    part_coords=arrays["part_coords"], part_offsets=arrays["part_offsets"])
+
+
+class _WorkerState:
+    def __init__(self, graph, overlay, params):
+        self.network = routing_engine.RoutingNetwork(graph); self.overlay = overlay; self.params = params
+
+
+def _init_worker(graph_dir, overlay, params):
+    global _state
+    _state = _WorkerState(open_graph_dir(graph_dir), overlay, params)
+
+
+# --- Trabajos por origen (params["nodes"]: nodo de cada punto, en el orden de los índices) ---
+# Cada trabajo llama a la misma función de routing_engine que la ejecución en secuencia y
+# agrega al final su SearchStats, que run_jobs suma y quita del resultado.
+def dro_job(origin_index):
+    # -> (índice de origen, [(índice de destino, costo, coordenadas)])
+    params = _state.params; stats = routing_engine.SearchStats()
+    return origin_index, routing_engine.dro_origin_routes(_state.network.graph, params["nodes"], origin_index, params.get("search", "tree"), _state.overlay, stats), stats
+
+
+def dro_matrix_job(origin_index):
+    # -> (índice de origen, costos hacia todos los puntos; NaN sin ruta)
+    stats = routing_engine.SearchStats()
+    return origin_index, routing_engine.od_matrix_row(_state.network.graph, _state.params["nodes"], origin_index, _state.overlay, stats), stats
+
+
+def dai_job(origin_index):
+    # -> (índice de origen, líneas, [(costo, x, y)] de los nodos alcanzados); ver routing_engine.dai_origin
+    params = _state.params; stats = routing_engine.SearchStats()
+    lines, reached = routing_engine.dai_origin(_state.network, params["nodes"][origin_index], params["cutoff"], params["line_output"], _state.overlay, stats)
+    return origin_index, lines, reached, stats
+
+
+def run_jobs(job, origin_indices, graph_dir, overlay, params, workers, chunksize=1, stats=None, feedback=None):
+    # Itera los resultados de job(índice) a medida que los workers los terminan; suma los
+    # conteos de cada trabajo en stats (SearchStats), si se indica. Si se cancela (feedback)
+    # o el consumidor cierra el generador, los workers se terminan sin esperar los trabajos
+    # pendientes; al terminar normalmente el pool se cierra y se esperan sus procesos.
+    context = multiprocessing.get_context("spawn")
+    context.set_executable(python_executable())
+    pool = context.Pool(resolve_workers(workers), initializer=_init_worker, initargs=(graph_dir, overlay, params))
+    results = pool.imap_unordered(job, origin_indices, chunksize)
+    finished = False
+    try:
+        for result in results:
+            if feedback is not None and feedback.isCanceled(): return
+            if stats is not None: stats.merge(result[-1])
+            yield result[:-1]
+        finished = True
+    finally:
+        if finished: pool.close()
+        else: pool.terminate()
+        pool.join()
@@ -1,5 +1,6 @@
 # -*- coding: utf-8 -*-
 import os
+import tempfile
 import traceback
 import webbrowser  # <--- MODIFICACIÓN: Añadido para abrir el navegador
 
@@ -7,6 +8,7 @@ from qgis.PyQt import uic
 # <--- MODIFICACIÓN: Añadido QDialogButtonBox
 from qgis.PyQt.QtWidgets import QDialog, QFileDialog, QDialogButtonBox
 from qgis.core import (
+    QgsApplication,
     QgsVectorLayer,
     QgsProject,
     Qgis,
@@ -18,6 +20,7 @@ from qgis.core import (
 from qgis.gui import QgsFileWidget
 
 from . import network_algorithms
+from .analysis_task import AnalysisTask
 
 FORM_CLASS, _ = uic.loadUiType(os.path.join(
     os.path.dirname(__file__), 'plugin_dialog_base.ui'))
@@ -66,6 +69,13 @@ class PluginDialog(QDialog, FORM_CLASS):
         self.help_button.clicked.connect(self.mostrar_ayuda)
         # --- FIN DE LA MODIFICACIÓN ---
 
+        # Los análisis se ejecutan como QgsTask; este botón cancela el que está en curso
+        self._tarea_activa = None
+        self.cancel_button = self.buttonBox_main.addButton(
+            "Cancelar análisis", QDialogButtonBox.ActionRole)
+        self.cancel_button.clicked.connect(self.cancelar_tarea)
+        self._actualizar_estado_tarea(False)
+
     # --- INICIO DE LA MODIFICACIÓN ---
     # Nuevo método para mostrar el archivo de ayuda
     def mostrar_ayuda(self):
@@ -122,6 +132,13 @@ class PluginDialog(QDialog, FORM_CLASS):
         for widget, filtro in widgets_filtros:
             widget.setStorageMode(QgsFileWidget.SaveFile)
             widget.setFilter(filtro)
+        self.mCheckBox_dro_solo_matriz.toggled.connect(self._actualizar_filtro_salida_dro)
+
+    def _actualizar_filtro_salida_dro(self, solo_matriz):
+        if solo_matriz:
+            self.mFileWidget_dro_salida.setFilter("CSV (*.csv);;Parquet (*.parquet);;NumPy (*.npy)")
+        else:
+            self.mFileWidget_dro_salida.setFilter("Shapefiles (*.shp)")
 
     def _conectar_botones_examinar(self):
         self.mPushButton_dro_vias_browse.clicked.connect(lambda:
@@ -218,6 +235,59 @@ class PluginDialog(QDialog, FORM_CLASS):
         abrir_despues = check_abrir.isChecked()
         return output_path, abrir_despues
 
+    # --- Ejecución en segundo plano ---
+    def _ejecutar_tarea(self, nombre, funcion, args, kwargs, al_terminar):
+        # Lanza el análisis como QgsTask: QGIS no se congela, el avance se ve en la barra de
+        # progreso y el análisis puede cancelarse. al_terminar(resultado) corre en el hilo
+        # principal y solo se llama si el análisis terminó con éxito. Las capas se pasan como
+        # LayerSnapshot, creados aquí en el hilo principal, para leerlas desde el hilo de la tarea.
+        args = [network_algorithms.LayerSnapshot(arg) if isinstance(arg, QgsVectorLayer) else arg for arg in args]
+        tarea = AnalysisTask(f"Análisis {nombre}", funcion, args, kwargs,
+                             lambda tarea, exito: self._tarea_terminada(tarea, exito, nombre, al_terminar))
+        tarea.progressChanged.connect(lambda progreso: self.progressBar_tarea.setValue(int(progreso)))
+        self._tarea_activa = tarea
+        self._actualizar_estado_tarea(True)
+        QgsApplication.taskManager().addTask(tarea)
+
+    def _tarea_terminada(self, tarea, exito, nombre, al_terminar):
+        self._tarea_activa = None
+        self._actualizar_estado_tarea(False)
+        if tarea.isCanceled():
+            self.iface.messageBar().pushMessage(
+                "Aviso", f"Análisis {nombre} cancelado.", level=Qgis.Warning, duration=5)
+            return
+        if not exito:
+            self.iface.messageBar().pushMessage(
+                "Error", f"Falló el análisis {nombre}. Revise el Panel de Mensajes de Log.", level=Qgis.Critical, duration=5)
+            return
+        self.iface.messageBar().pushMessage(
+            "Éxito", f"Análisis {nombre} completado.", level=Qgis.Success, duration=5)
+        try:
+            al_terminar(tarea.result)
+        except Exception as e:
+            QgsMessageLog.logMessage(
+                f"Excepción al cargar las salidas de {nombre}: {e}\n{traceback.format_exc()}", "PluginError", Qgis.Critical)
+
+    def cancelar_tarea(self):
+        if self._tarea_activa is not None:
+            self._tarea_activa.cancel()
+
+    def _actualizar_estado_tarea(self, en_curso):
+        # Un análisis a la vez desde el diálogo: la barra de progreso y el botón Cancelar siguen a una sola tarea
+        for boton in (self.pushButton_run_dro, self.pushButton_run_dai, self.pushButton_run_dumc):
+            boton.setEnabled(not en_curso)
+        self.cancel_button.setEnabled(en_curso)
+        self.progressBar_tarea.setValue(0)
+
+    def _modo_ajuste(self, check_aristas):
+        # Modo de ajuste de los puntos a la red: a la arista más cercana o al nodo más cercano
+        return "edge" if check_aristas.isChecked() else "node"
+
+    def _tolerancia_ajuste(self):
+        # Distancia máxima de ajuste en unidades del CRS de vías; 0 ("Sin límite") es None
+        tolerancia = self.mDoubleSpinBox_tolerancia_ajuste.value()
+        return tolerancia if tolerancia > 0 else None
+
     def _cargar_capa_salida(self, layer_or_path, display_name_if_path, abrir_despues_de_ejecutar):
         if not abrir_despues_de_ejecutar or not layer_or_path:
             return
@@ -266,28 +336,33 @@ class PluginDialog(QDialog, FORM_CLASS):
             if not puntos_layer:
                 return
 
+            if self.mCheckBox_dro_solo_matriz.isChecked():
+                self._run_dro_matriz(vias_layer, dir_field_name, cost_field_name, puntos_layer, id_puntos_field_name)
+                return
+
             output_path, abrir_despues = self._manejar_salida(
                 self.mFileWidget_dro_salida, "rutas_optimas_dro_temp", self.mCheckBox_dro_abrir_salida)
 
             self.iface.messageBar().pushMessage(
                 "Info", "Procesando DRO...", level=Qgis.Info, duration=3)
 
-            success, result_info = network_algorithms.run_dro_analysis_core(
-                vias_layer, dir_field_name, cost_field_name,
-                puntos_layer, id_puntos_field_name,
-                output_path, self.iface
-            )
-
-            if success:
-                self.iface.messageBar().pushMessage(
-                    "Éxito", "Análisis DRO completado.", level=Qgis.Success, duration=5)
+            def al_terminar(result):
+                _, result_info = result
                 nombre_base = "rutas_optimas_dro_nx" if isinstance(
                     result_info, str) else result_info.name()
                 self._cargar_capa_salida(
                     result_info, nombre_base, abrir_despues)
-            else:
-                self.iface.messageBar().pushMessage(
-                    "Error", "Falló el análisis DRO. Revise el Panel de Mensajes de Log.", level=Qgis.Critical, duration=5)
+
+            self._ejecutar_tarea(
+                "DRO", network_algorithms.run_dro_analysis_core,
+                (vias_layer, dir_field_name, cost_field_name,
+                 puntos_layer, id_puntos_field_name,
+                 output_path, None),
+                dict(snap_mode=self._modo_ajuste(self.mCheckBox_dro_ajustar_aristas),
+                     snap_tolerance=self._tolerancia_ajuste(),
+                     workers=self.mSpinBox_procesos.value(),
+                     search=network_algorithms.DRO_SEARCH_METHODS[self.mComboBox_dro_busqueda.currentIndex()]),
+                al_terminar)
 
         except Exception as e:
             QgsMessageLog.logMessage(
@@ -295,6 +370,41 @@ class PluginDialog(QDialog, FORM_CLASS):
             self.iface.messageBar().pushMessage(
                 "Error Crítico", f"Ocurrió una excepción en DRO: {e}", level=Qgis.Critical, duration=10)
 
+    def _busqueda_matriz_dro(self):
+        # La matriz OD usa la jerarquía de contracción si está elegida; si no, el árbol por origen
+        busqueda = network_algorithms.DRO_SEARCH_METHODS[self.mComboBox_dro_busqueda.currentIndex()]
+        return "ch" if busqueda == "ch" else "tree"
+
+    def _run_dro_matriz(self, vias_layer, dir_field_name, cost_field_name, puntos_layer, id_puntos_field_name):
+        output_path = self.mFileWidget_dro_salida.filePath()
+        if not output_path:
+            output_path = os.path.join(tempfile.gettempdir(), "matriz_costos_dro.csv")
+        elif os.path.splitext(output_path)[1].lower() not in network_algorithms.OD_MATRIX_FORMATS:
+            output_path = os.path.splitext(output_path)[0] + ".csv"
+        abrir_despues = self.mCheckBox_dro_abrir_salida.isChecked()
+
+        self.iface.messageBar().pushMessage(
+            "Info", "Procesando matriz de costos DRO...", level=Qgis.Info, duration=3)
+
+        def al_terminar(result):
+            _, result_info = result
+            self.iface.messageBar().pushMessage(
+                "Info", f"Matriz de costos DRO guardada en {result_info}", level=Qgis.Info, duration=5)
+            # La matriz densa (.npy) no es una tabla que QGIS pueda abrir
+            if not result_info.lower().endswith(".npy"):
+                self._cargar_capa_salida(result_info, "matriz_costos_dro", abrir_despues)
+
+        self._ejecutar_tarea(
+            "Matriz de costos DRO", network_algorithms.run_dro_matrix_core,
+            (vias_layer, dir_field_name, cost_field_name,
+             puntos_layer, id_puntos_field_name,
+             output_path, None),
+            dict(snap_mode=self._modo_ajuste(self.mCheckBox_dro_ajustar_aristas),
+                 snap_tolerance=self._tolerancia_ajuste(),
+                 workers=self.mSpinBox_procesos.value(),
+                 search=self._busqueda_matriz_dro()),
+            al_terminar)
+
     def run_dai(self):
         try:
             vias_layer, dir_field_name, cost_field_name = self._validar_entradas_comunes(
@@ -308,7 +418,15 @@ class PluginDialog(QDialog, FORM_CLASS):
                 return
 
             umbral_costo = self.mDoubleSpinBox_dai_umbral.value()
-            if umbral_costo <= 0:
+            bandas_texto = self.mLineEdit_dai_bandas.text().strip()
+            if bandas_texto:
+                try:
+                    umbral_costo = [float(valor) for valor in bandas_texto.replace(";", ",").split(",") if valor.strip()]
+                except ValueError:
+                    self.iface.messageBar().pushMessage(
+                        "Error", "Las bandas de umbral deben ser números separados por comas.", level=Qgis.Critical, duration=3)
+                    return
+            if min(umbral_costo if isinstance(umbral_costo, list) else [umbral_costo], default=0) <= 0:
                 self.iface.messageBar().pushMessage(
                     "Error", "El umbral de costo debe ser mayor que cero.", level=Qgis.Critical, duration=3)
                 return
@@ -321,15 +439,8 @@ class PluginDialog(QDialog, FORM_CLASS):
             self.iface.messageBar().pushMessage(
                 "Info", "Procesando DAI...", level=Qgis.Info, duration=3)
 
-            success, line_result, poly_result = network_algorithms.run_dai_analysis_core(
-                vias_layer, dir_field_name, cost_field_name,
-                puntos_layer, id_puntos_field_name, umbral_costo,
-                output_line_path, output_poly_path, self.iface
-            )
-
-            if success:
-                self.iface.messageBar().pushMessage(
-                    "Éxito", "Análisis DAI completado.", level=Qgis.Success, duration=5)
+            def al_terminar(result):
+                _, line_result, poly_result = result
                 if line_result:
                     nombre_base_lineas = "dai_lineas_nx" if isinstance(
                         line_result, str) else line_result.name()
@@ -340,9 +451,17 @@ class PluginDialog(QDialog, FORM_CLASS):
                         poly_result, str) else poly_result.name()
                     self._cargar_capa_salida(
                         poly_result, nombre_base_polys, abrir_polys_despues)
-            else:
-                self.iface.messageBar().pushMessage(
-                    "Error", "Falló el análisis DAI. Revise el Panel de Mensajes de Log.", level=Qgis.Critical, duration=5)
+
+            self._ejecutar_tarea(
+                "DAI", network_algorithms.run_dai_analysis_core,
+                (vias_layer, dir_field_name, cost_field_name,
+                 puntos_layer, id_puntos_field_name, umbral_costo,
+                 output_line_path, output_poly_path, None),
+                dict(snap_mode=self._modo_ajuste(self.mCheckBox_dai_ajustar_aristas),
+                     snap_tolerance=self._tolerancia_ajuste(),
+                     line_output="routes" if self.mCheckBox_dai_rutas_completas.isChecked() else "tree",
+                     workers=self.mSpinBox_procesos.value()),
+                al_terminar)
 
         except Exception as e:
             QgsMessageLog.logMessage(
@@ -390,16 +509,8 @@ class PluginDialog(QDialog, FORM_CLASS):
             self.iface.messageBar().pushMessage(
                 "Info", "Procesando DUMC...", level=Qgis.Info, duration=3)
 
-            success, points_result, routes_result = network_algorithms.run_dumc_analysis_core(
-                vias_layer, dir_field_name, cost_field_name,
-                puntos1_layer, id_puntos1_field_name,
-                puntos2_layer, id_puntos2_field_name,
-                output_points_path, output_routes_path, self.iface
-            )
-
-            if success:
-                self.iface.messageBar().pushMessage(
-                    "Éxito", "Análisis DUMC completado.", level=Qgis.Success, duration=5)
+            def al_terminar(result):
+                _, points_result, routes_result = result
                 if points_result:
                     nombre_base_puntos = "dumc_puntos_nx" if isinstance(
                         points_result, str) else points_result.name()
@@ -410,9 +521,17 @@ class PluginDialog(QDialog, FORM_CLASS):
                         routes_result, str) else routes_result.name()
                     self._cargar_capa_salida(
                         routes_result, nombre_base_rutas, abrir_rutas_despues)
-            else:
-                self.iface.messageBar().pushMessage(
-                    "Error", "Falló el análisis DUMC. Revise el Panel de Mensajes de Log.", level=Qgis.Critical, duration=5)
+
+            self._ejecutar_tarea(
+                "DUMC", network_algorithms.run_dumc_analysis_core,
+                (vias_layer, dir_field_name, cost_field_name,
+                 puntos1_layer, id_puntos1_field_name,
+                 puntos2_layer, id_puntos2_field_name,
+                 output_points_path, output_routes_path, None),
+                dict(snap_mode=self._modo_ajuste(self.mCheckBox_dumc_ajustar_aristas),
+                     snap_tolerance=self._tolerancia_ajuste(),
+                     search="ch" if self.mCheckBox_dumc_jerarquia.isChecked() else "tree"),
+                al_terminar)
 
         except Exception as e:
             detailed_error = traceback.format_exc()
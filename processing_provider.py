@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Proveedor de Processing: expone DRO, la matriz de costos DRO, DAI, DUMC y la validación de la capa de vías como algoritmos
+# (Caja de herramientas, modelos, modo por lotes y qgis_process). Cada algoritmo llama a la
+# misma función run_*_core que el diálogo. El grafo construido queda en la caché en memoria de
+# network_algorithms y en la caché en disco, así las ejecuciones consecutivas sobre la misma
+# capa de vías (por ejemplo, las filas de una ejecución por lotes) no vuelven a construirlo.
+# El proveedor se registra al iniciar QGIS: network_algorithms (y con él geopandas y
+# shapely) se importa recién al ejecutar el primer algoritmo.
+import os
+
+from qgis.PyQt.QtGui import QIcon
+from qgis.core import (
+    QgsProcessing, QgsProcessingAlgorithm, QgsProcessingException, QgsProcessingProvider,
+    QgsProcessingParameterBoolean, QgsProcessingParameterDistance, QgsProcessingParameterEnum, QgsProcessingParameterField,
+    QgsProcessingParameterFileDestination, QgsProcessingParameterNumber, QgsProcessingParameterString,
+    QgsProcessingParameterVectorDestination, QgsProcessingParameterVectorLayer, QgsVectorLayer
+)
+
+from . import options
+
+_SEARCH_NAMES = ("Árbol por origen (todos los destinos)", "A* (heurística euclídea)",
+                 "Dijkstra bidireccional", "Jerarquía de contracción (precalculada)")
+
+
+class AnalisisRedesProvider(QgsProcessingProvider):
+    def id(self): return "analisisredes"
+
+    def name(self): return "Análisis de Redes de Transporte"
+
+    def icon(self): return QIcon(os.path.join(os.path.dirname(__file__), "icon.png"))
+
+    def loadAlgorithms(self):
+        for algorithm in (DroAlgorithm(), DroMatrixAlgorithm(), DaiAlgorithm(), DumcAlgorithm(), InvalidRoadsAlgorithm()):
+            self.addAlgorithm(algorithm)
+
+    # FeatureSink escribe Shapefile o GeoPackage según la extensión
+    def supportedOutputVectorLayerExtensions(self): return ["gpkg", "shp"]
+
+    def defaultVectorFileExtension(self, hasGeometry=True): return "gpkg"
+
+
+def _network_algorithms():
+    # Las dependencias faltantes se informan como error del algoritmo, no al cargar el proveedor
+    try: from . import network_algorithms
+    except ImportError as e: raise QgsProcessingException(str(e)) from e
+    return network_algorithms
+
+
+class _NetworkAlgorithm(QgsProcessingAlgorithm):
+    # Parámetros comunes: capa de vías con sus campos, ajuste de puntos y procesos
+    VIAS = "VIAS"; CAMPO_DIRECCION = "CAMPO_DIRECCION"; CAMPO_COSTO = "CAMPO_COSTO"
+    AJUSTAR_ARISTAS = "AJUSTAR_ARISTAS"; TOLERANCIA_AJUSTE = "TOLERANCIA_AJUSTE"; PROCESOS = "PROCESOS"; GUARDAR_PERFIL = "GUARDAR_PERFIL"
+
+    def createInstance(self): return type(self)()
+
+    def group(self): return "Análisis de redes"
+
+    def groupId(self): return "analisisredes"
+
+    def _add_network_parameters(self, snapping=True):
+        self.addParameter(QgsProcessingParameterVectorLayer(self.VIAS, "Capa de vías", [QgsProcessing.TypeVectorLine]))
+        self.addParameter(QgsProcessingParameterField(self.CAMPO_DIRECCION, "Campo de dirección (0 doble sentido, 1 digitalización, 2 inverso)", parentLayerParameterName=self.VIAS, type=QgsProcessingParameterField.Numeric, optional=True))
+        self.addParameter(QgsProcessingParameterField(self.CAMPO_COSTO, "Campo de costo (vacío o nulo = longitud)", parentLayerParameterName=self.VIAS, type=QgsProcessingParameterField.Numeric, optional=True))
+        if not snapping: return
+        self.addParameter(QgsProcessingParameterBoolean(self.AJUSTAR_ARISTAS, "Ajustar puntos a la arista más cercana", defaultValue=(options.DEFAULT_SNAP_MODE == "edge")))
+        self.addParameter(QgsProcessingParameterDistance(self.TOLERANCIA_AJUSTE, "Tolerancia de ajuste (0 = sin límite; puntos más lejanos se omiten)", defaultValue=0.0, parentParameterName=self.VIAS, minValue=0.0))
+
+    def _add_workers_parameter(self):
+        self.addParameter(QgsProcessingParameterNumber(self.PROCESOS, "Procesos en paralelo (0 = uno por núcleo)", QgsProcessingParameterNumber.Integer, defaultValue=options.DEFAULT_WORKERS, minValue=0))
+
+    def _add_profile_parameter(self):
+        self.addParameter(QgsProcessingParameterBoolean(self.GUARDAR_PERFIL, "Guardar el perfil de ejecución (.perfil.json junto a la salida)", defaultValue=False))
+
+    def prepareAlgorithm(self, parameters, context, feedback):
+        # Corre en el hilo principal: las capas de entrada se copian en LayerSnapshot para que
+        # processAlgorithm (en segundo plano) no lea las capas del proyecto desde otro hilo
+        network_algorithms = _network_algorithms()
+        self._snapshots = {}
+        for definition in self.parameterDefinitions():
+            if not isinstance(definition, QgsProcessingParameterVectorLayer): continue
+            layer = self.parameterAsVectorLayer(parameters, definition.name(), context)
+            if layer is not None: self._snapshots[definition.name()] = network_algorithms.LayerSnapshot(layer)
+        return True
+
+    def _input_layer(self, parameters, layer_name, context):
+        snapshots = getattr(self, "_snapshots", None)
+        if snapshots is not None: return snapshots.get(layer_name)
+        return self.parameterAsVectorLayer(parameters, layer_name, context)
+
+    def _network_inputs(self, parameters, context):
+        vias_layer = self._input_layer(parameters, self.VIAS, context)
+        if vias_layer is None: raise QgsProcessingException("Capa de vías no válida.")
+        return (vias_layer, self.parameterAsString(parameters, self.CAMPO_DIRECCION, context),
+                self.parameterAsString(parameters, self.CAMPO_COSTO, context))
+
+    def _snap_mode(self, parameters, context):
+        return "edge" if self.parameterAsBool(parameters, self.AJUSTAR_ARISTAS, context) else "node"
+
+    def _snap_tolerance(self, parameters, context):
+        # Distancia máxima de ajuste en unidades del CRS de vías; 0 es sin límite (None)
+        tolerance = self.parameterAsDouble(parameters, self.TOLERANCIA_AJUSTE, context)
+        return tolerance if tolerance > 0 else None
+
+    def _profile_sidecar(self, parameters, context):
+        return self.parameterAsBool(parameters, self.GUARDAR_PERFIL, context)
+
+    def _point_inputs(self, parameters, layer_name, field_name, context, label):
+        layer = self._input_layer(parameters, layer_name, context)
+        if layer is None: raise QgsProcessingException(f"Capa de {label} no válida.")
+        return layer, self.parameterAsString(parameters, field_name, context)
+
+    def _add_point_parameters(self, layer_name, field_name, label):
+        self.addParameter(QgsProcessingParameterVectorLayer(layer_name, label, [QgsProcessing.TypeVectorPoint]))
+        self.addParameter(QgsProcessingParameterField(field_name, f"Campo identificador ({label.lower()})", parentLayerParameterName=layer_name))
+
+    def _output_value(self, result, context):
+        # Las salidas de memoria se entregan a Processing por el almacén temporal del contexto
+        if isinstance(result, QgsVectorLayer):
+            context.temporaryLayerStore().addMapLayer(result)
+            return result.id()
+        return result
+
+    def _check(self, result, name):
+        if not result[0]: raise QgsProcessingException(f"{name} no produjo resultados; revise el registro de mensajes (pestaña 'PluginError').")
+
+
+class DroAlgorithm(_NetworkAlgorithm):
+    PUNTOS = "PUNTOS"; CAMPO_ID = "CAMPO_ID"; BUSQUEDA = "BUSQUEDA"; SALIDA = "SALIDA"
+
+    def name(self): return "dro"
+
+    def displayName(self): return "Determinación de Ruta Óptima (DRO)"
+
+    def shortHelpString(self):
+        return "Calcula la ruta de menor costo entre cada par de puntos de la capa de puntos. Las ejecuciones consecutivas sobre la misma capa de vías reutilizan el grafo construido."
+
+    def initAlgorithm(self, config=None):
+        self._add_network_parameters()
+        self._add_point_parameters(self.PUNTOS, self.CAMPO_ID, "Puntos")
+        self.addParameter(QgsProcessingParameterEnum(self.BUSQUEDA, "Búsqueda de rutas", options=list(_SEARCH_NAMES), defaultValue=0))
+        self._add_workers_parameter()
+        self.addParameter(QgsProcessingParameterVectorDestination(self.SALIDA, "Rutas óptimas", QgsProcessing.TypeVectorLine))
+        self._add_profile_parameter()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        vias_layer, dir_field, cost_field = self._network_inputs(parameters, context)
+        puntos_layer, id_field = self._point_inputs(parameters, self.PUNTOS, self.CAMPO_ID, context, "puntos")
+        result = _network_algorithms().run_dro_analysis_core(
+            vias_layer, dir_field, cost_field, puntos_layer, id_field,
+            self.parameterAsOutputLayer(parameters, self.SALIDA, context), None,
+            snap_mode=self._snap_mode(parameters, context), snap_tolerance=self._snap_tolerance(parameters, context),
+            workers=self.parameterAsInt(parameters, self.PROCESOS, context),
+            search=options.DRO_SEARCH_METHODS[self.parameterAsEnum(parameters, self.BUSQUEDA, context)],
+            profile_sidecar=self._profile_sidecar(parameters, context), feedback=feedback)
+        self._check(result, "DRO")
+        return {self.SALIDA: self._output_value(result[1], context)}
+
+
+class DroMatrixAlgorithm(_NetworkAlgorithm):
+    PUNTOS = "PUNTOS"; CAMPO_ID = "CAMPO_ID"; JERARQUIA = "JERARQUIA"; SALIDA = "SALIDA"
+
+    def name(self): return "dro_matriz"
+
+    def displayName(self): return "Matriz de costos DRO"
+
+    def shortHelpString(self):
+        return "Calcula solo el costo mínimo entre cada par de puntos (sin geometrías) y lo escribe como tabla larga (.csv, .parquet) o matriz densa (.npy)."
+
+    def initAlgorithm(self, config=None):
+        self._add_network_parameters()
+        self._add_point_parameters(self.PUNTOS, self.CAMPO_ID, "Puntos")
+        self.addParameter(QgsProcessingParameterBoolean(self.JERARQUIA, "Usar jerarquía de contracción precalculada", defaultValue=False))
+        self._add_workers_parameter()
+        self.addParameter(QgsProcessingParameterFileDestination(self.SALIDA, "Matriz de costos", "CSV (*.csv);;Parquet (*.parquet);;NumPy (*.npy)"))
+        self._add_profile_parameter()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        vias_layer, dir_field, cost_field = self._network_inputs(parameters, context)
+        puntos_layer, id_field = self._point_inputs(parameters, self.PUNTOS, self.CAMPO_ID, context, "puntos")
+        output_path = self.parameterAsFileOutput(parameters, self.SALIDA, context)
+        result = _network_algorithms().run_dro_matrix_core(
+            vias_layer, dir_field, cost_field, puntos_layer, id_field, output_path, None,
+            snap_mode=self._snap_mode(parameters, context), snap_tolerance=self._snap_tolerance(parameters, context),
+            workers=self.parameterAsInt(parameters, self.PROCESOS, context),
+            search="ch" if self.parameterAsBool(parameters, self.JERARQUIA, context) else "tree",
+            profile_sidecar=self._profile_sidecar(parameters, context), feedback=feedback)
+        self._check(result, "Matriz de costos DRO")
+        return {self.SALIDA: result[1]}
+
+
+class DaiAlgorithm(_NetworkAlgorithm):
+    PUNTOS = "PUNTOS"; CAMPO_ID = "CAMPO_ID"; UMBRAL = "UMBRAL"; BANDAS = "BANDAS"
+    RUTAS_COMPLETAS = "RUTAS_COMPLETAS"; SALIDA_LINEAS = "SALIDA_LINEAS"; SALIDA_POLIGONOS = "SALIDA_POLIGONOS"
+
+    def name(self): return "dai"
+
+    def displayName(self): return "Determinación de Área de Influencia (DAI)"
+
+    def shortHelpString(self):
+        return "Calcula el área alcanzable desde cada punto central sin superar el umbral de costo. Con bandas (valores separados por comas) se genera un polígono por banda."
+
+    def initAlgorithm(self, config=None):
+        self._add_network_parameters()
+        self._add_point_parameters(self.PUNTOS, self.CAMPO_ID, "Puntos centrales")
+        self.addParameter(QgsProcessingParameterNumber(self.UMBRAL, "Umbral de costo", QgsProcessingParameterNumber.Double, defaultValue=1000.0, minValue=0.0))
+        self.addParameter(QgsProcessingParameterString(self.BANDAS, "Bandas de umbral (separadas por comas; reemplazan al umbral)", optional=True))
+        self.addParameter(QgsProcessingParameterBoolean(self.RUTAS_COMPLETAS, "Escribir una ruta completa por nodo alcanzado", defaultValue=False))
+        self._add_workers_parameter()
+        self.addParameter(QgsProcessingParameterVectorDestination(self.SALIDA_LINEAS, "Líneas DAI", QgsProcessing.TypeVectorLine))
+        self.addParameter(QgsProcessingParameterVectorDestination(self.SALIDA_POLIGONOS, "Polígonos DAI", QgsProcessing.TypeVectorPolygon))
+        self._add_profile_parameter()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        vias_layer, dir_field, cost_field = self._network_inputs(parameters, context)
+        puntos_layer, id_field = self._point_inputs(parameters, self.PUNTOS, self.CAMPO_ID, context, "puntos centrales")
+        umbral_costo = self.parameterAsDouble(parameters, self.UMBRAL, context)
+        bandas_texto = self.parameterAsString(parameters, self.BANDAS, context).strip()
+        if bandas_texto:
+            try: umbral_costo = [float(valor) for valor in bandas_texto.replace(";", ",").split(",") if valor.strip()]
+            except ValueError: raise QgsProcessingException("Las bandas de umbral deben ser números separados por comas.")
+        if min(umbral_costo if isinstance(umbral_costo, list) else [umbral_costo], default=0) <= 0:
+            raise QgsProcessingException("El umbral de costo debe ser mayor que cero.")
+        result = _network_algorithms().run_dai_analysis_core(
+            vias_layer, dir_field, cost_field, puntos_layer, id_field, umbral_costo,
+            self.parameterAsOutputLayer(parameters, self.SALIDA_LINEAS, context),
+            self.parameterAsOutputLayer(parameters, self.SALIDA_POLIGONOS, context), None,
+            snap_mode=self._snap_mode(parameters, context), snap_tolerance=self._snap_tolerance(parameters, context),
+            line_output="routes" if self.parameterAsBool(parameters, self.RUTAS_COMPLETAS, context) else "tree",
+            workers=self.parameterAsInt(parameters, self.PROCESOS, context),
+            profile_sidecar=self._profile_sidecar(parameters, context), feedback=feedback)
+        self._check(result, "DAI")
+        return {self.SALIDA_LINEAS: self._output_value(result[1], context),
+                self.SALIDA_POLIGONOS: self._output_value(result[2], context)}
+
+
+class DumcAlgorithm(_NetworkAlgorithm):
+    ORIGENES = "ORIGENES"; CAMPO_ID_ORIGENES = "CAMPO_ID_ORIGENES"
+    UTILIDADES = "UTILIDADES"; CAMPO_ID_UTILIDADES = "CAMPO_ID_UTILIDADES"
+    JERARQUIA = "JERARQUIA"; SALIDA_PUNTOS = "SALIDA_PUNTOS"; SALIDA_RUTAS = "SALIDA_RUTAS"
+
+    def name(self): return "dumc"
+
+    def displayName(self): return "Determinación de Utilidad Más Cercana (DUMC)"
+
+    def shortHelpString(self):
+        return "Para cada origen encuentra la utilidad de menor costo y traza la ruta hacia ella."
+
+    def initAlgorithm(self, config=None):
+        self._add_network_parameters()
+        self._add_point_parameters(self.ORIGENES, self.CAMPO_ID_ORIGENES, "Orígenes")
+        self._add_point_parameters(self.UTILIDADES, self.CAMPO_ID_UTILIDADES, "Utilidades")
+        self.addParameter(QgsProcessingParameterBoolean(self.JERARQUIA, "Usar jerarquía de contracción precalculada", defaultValue=False))
+        self.addParameter(QgsProcessingParameterVectorDestination(self.SALIDA_PUNTOS, "Utilidades más cercanas", QgsProcessing.TypeVectorPoint))
+        self.addParameter(QgsProcessingParameterVectorDestination(self.SALIDA_RUTAS, "Rutas DUMC", QgsProcessing.TypeVectorLine))
+        self._add_profile_parameter()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        vias_layer, dir_field, cost_field = self._network_inputs(parameters, context)
+        origenes_layer, id_origenes = self._point_inputs(parameters, self.ORIGENES, self.CAMPO_ID_ORIGENES, context, "orígenes")
+        utilidades_layer, id_utilidades = self._point_inputs(parameters, self.UTILIDADES, self.CAMPO_ID_UTILIDADES, context, "utilidades")
+        result = _network_algorithms().run_dumc_analysis_core(
+            vias_layer, dir_field, cost_field, origenes_layer, id_origenes, utilidades_layer, id_utilidades,
+            self.parameterAsOutputLayer(parameters, self.SALIDA_PUNTOS, context),
+            self.parameterAsOutputLayer(parameters, self.SALIDA_RUTAS, context), None,
+            snap_mode=self._snap_mode(parameters, context), snap_tolerance=self._snap_tolerance(parameters, context),
+            search="ch" if self.parameterAsBool(parameters, self.JERARQUIA, context) else "tree",
+            profile_sidecar=self._profile_sidecar(parameters, context), feedback=feedback)
+        self._check(result, "DUMC")
+        return {self.SALIDA_PUNTOS: self._output_value(result[1], context),
+                self.SALIDA_RUTAS: self._output_value(result[2], context)}
+
+
+class InvalidRoadsAlgorithm(_NetworkAlgorithm):
+    SALIDA = "SALIDA"
+
+    def name(self): return "vias_invalidas"
+
+    def displayName(self): return "Validar capa de vías"
+
+    def shortHelpString(self):
+        return ("Lista las vías que el grafo omite o corrige (sin geometría, tipo no lineal, partes de menos de 2 coordenadas, "
+                "dirección no numérica o no reconocida, costo no numérico): una entidad por vía y problema, con su ID.")
+
+    def initAlgorithm(self, config=None):
+        self._add_network_parameters(snapping=False)
+        self.addParameter(QgsProcessingParameterVectorDestination(self.SALIDA, "Vías inválidas", QgsProcessing.TypeVectorAnyGeometry))
+
+    def processAlgorithm(self, parameters, context, feedback):
+        vias_layer, dir_field, cost_field = self._network_inputs(parameters, context)
+        result = _network_algorithms().run_invalid_roads_core(
+            vias_layer, dir_field, cost_field, self.parameterAsOutputLayer(parameters, self.SALIDA, context), None, feedback=feedback)
+        self._check(result, "Validación de vías")
+        return {self.SALIDA: self._output_value(result[1], context)}
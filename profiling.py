@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+# Perfil de una ejecución de análisis: tiempo de pared y memoria pico por etapa, más conteos
+# (nodos, aristas, búsquedas, nodos asentados, entidades escritas). No depende de QGIS:
+# network_algorithms lo registra en una sola entrada del log y, opcionalmente, en un JSON
+# junto a la salida, para dimensionar equipos y detectar regresiones con corridas reales.
+# La memoria pico de una etapa es lo máximo que creció la memoria asignada desde Python
+# (incluidos los arreglos NumPy) durante la etapa respecto de su inicio, medida con tracemalloc
+# mientras haya alguna etapa abierta; no incluye la memoria de librerías en C que no la
+# informan (GEOS, GDAL) ni la de los workers de parallel. Con análisis simultáneos incluye la
+# de los demás; sin tracemalloc.reset_peak (Python < 3.9) no se mide (None). Aparte se informa el máximo de memoria residente del proceso desde que empezó
+# (de toda la sesión de QGIS, no de la ejecución); None si el sistema no permite medirla.
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from collections import OrderedDict
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+STAGES = ("ingestion", "build", "snapping", "search", "output")
+STAGE_NAMES = {"ingestion": "ingesta", "build": "grafo", "snapping": "ajuste", "search": "búsquedas", "output": "escritura"}
+COUNT_NAMES = OrderedDict([("nodes", "nodos"), ("edges", "aristas"), ("points", "puntos"), ("searches", "búsquedas"),
+                           ("settled_nodes", "nodos asentados"), ("routes", "rutas"), ("features_written", "entidades escritas")])
+SIDECAR_SUFFIX = ".perfil.json"
+
+
+def process_peak_memory_mb():
+    # Máximo de memoria residente del proceso desde que empezó, en MB, o None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024.0 ** 2 if sys.platform == "darwin" else 1024.0)  # bytes en macOS, KB en Linux
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, "peak_wset", info.rss) / 1024.0 ** 2
+    except Exception:
+        return None
+
+
+# Etapas abiertas de todos los perfiles: [memoria trazada al entrar, máximo visto] por etapa.
+# El pico de tracemalloc es uno solo por proceso: antes de reiniciarlo se pasa a todas las
+# etapas abiertas, de modo que las etapas anidadas o de otros hilos no se pisan.
+_memory_lock = threading.Lock()
+_open_stages = []
+_owns_tracing = False
+
+def _fold_traced_peak():
+    current, peak = tracemalloc.get_traced_memory()
+    for stage in _open_stages: stage[1] = max(stage[1], peak)
+    tracemalloc.reset_peak()
+    return current
+
+def _enter_memory_stage():
+    global _owns_tracing
+    if not hasattr(tracemalloc, "reset_peak"): return None
+    with _memory_lock:
+        if not _open_stages and not tracemalloc.is_tracing(): tracemalloc.start(); _owns_tracing = True
+        current = _fold_traced_peak()
+        stage = [current, current]; _open_stages.append(stage)
+        return stage
+
+def _exit_memory_stage(stage):
+    # -> pico de la etapa en MB (crecimiento máximo sobre la memoria trazada al entrar)
+    global _owns_tracing
+    if stage is None: return None
+    with _memory_lock:
+        _fold_traced_peak(); del _open_stages[next(k for k, open_stage in enumerate(_open_stages) if open_stage is stage)]  # por identidad
+        if not _open_stages and _owns_tracing: tracemalloc.stop(); _owns_tracing = False
+        return (stage[1] - stage[0]) / 1024.0 ** 2
+
+
+class RunProfile:
+    def __init__(self, analysis, **settings):
+        self.analysis = analysis; self.settings = settings
+        self.started = datetime.datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self.stages = OrderedDict(); self.counts = OrderedDict(); self.total_seconds = None
+        self._active = []  # por cada etapa abierta, el tiempo de sus etapas anidadas
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {"seconds": 0.0, "peak_memory_mb": None})
+
+    @contextmanager
+    def stage(self, name):
+        # Acumula el tiempo del bloque en la etapa (una etapa puede medirse en varios bloques).
+        # El tiempo de una etapa anidada se descuenta de la etapa que la contiene.
+        # La memoria pico es el máximo de todos sus bloques e incluye la de sus etapas anidadas.
+        start = time.perf_counter(); nested = [0.0]; self._active.append(nested)
+        memory = _enter_memory_stage()
+        try: yield
+        finally:
+            peak = _exit_memory_stage(memory)
+            self._active.pop(); elapsed = time.perf_counter() - start
+            if self._active: self._active[-1][0] += elapsed
+            stage = self._stage(name); stage["seconds"] += elapsed - nested[0]
+            if peak is not None: stage["peak_memory_mb"] = max(stage["peak_memory_mb"] or 0.0, peak)
+
+    def move_time(self, from_stage, to_stage, seconds):
+        # Traspasa tiempo medido dentro de otra etapa (p. ej. la escritura intercalada con las búsquedas)
+        self._stage(from_stage)["seconds"] -= seconds; self._stage(to_stage)["seconds"] += seconds
+
+    def set_detail(self, stage, key, value):
+        self._stage(stage)[key] = value
+
+    def count(self, name, value):
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self._start
+        return self
+
+    def as_dict(self):
+        ordered = OrderedDict((name, self.stages[name]) for name in STAGES if name in self.stages)
+        ordered.update((name, stage) for name, stage in self.stages.items() if name not in ordered)
+        return {"analysis": self.analysis, "started": self.started, "settings": self.settings,
+                "total_seconds": self.total_seconds, "process_peak_memory_mb": process_peak_memory_mb(),
+                "stages": ordered, "counts": dict(self.counts)}
+
+    def summary(self):
+        # Una línea: total, etapas (tiempo / memoria pico de la etapa) y conteos
+        data = self.as_dict()
+        def _mb(value): return "?" if value is None else f"{value:.1f} MB" if value < 10 else f"{value:.0f} MB"
+        parts = []
+        for name, stage in data["stages"].items():
+            text = f"{STAGE_NAMES.get(name, name)} {stage['seconds']:.2f} s / {_mb(stage['peak_memory_mb'])}"
+            if stage.get("route_seconds"): text += f" (armado de rutas {stage['route_seconds']:.2f} s)"
+            parts.append(text)
+        counts = [f"{COUNT_NAMES.get(name, name)} {value}" for name, value in data["counts"].items()]
+        total = "?" if data["total_seconds"] is None else f"{data['total_seconds']:.2f} s"
+        return f"{self.analysis}: perfil de ejecución (total {total}, máximo del proceso {_mb(data['process_peak_memory_mb'])}): " + "; ".join(parts) + (" | " + ", ".join(counts) if counts else "")
+
+    def write_sidecar(self, output_path):
+        # JSON junto a la salida (<salida sin extensión>.perfil.json); devuelve la ruta
+        path = os.path.splitext(output_path)[0] + SIDECAR_SUFFIX
+        with open(path, "w", encoding="utf-8") as fh: json.dump(self.as_dict(), fh, indent=2, ensure_ascii=False)
+        return path
@@ -0,0 +1,481 @@
+# -*- coding: utf-8 -*-
+# Motor de ruteo sin QGIS: construcción del grafo, ajuste de puntos, búsquedas y armado de
+# rutas. Recibe arreglos NumPy y geometrías Shapely y devuelve arreglos; no registra
+# mensajes ni escribe capas (eso lo hace network_algorithms, el adaptador a QGIS). Lo usan
+# también los workers de parallel, los benchmarks y los scripts.
+# Las rutas se devuelven como arreglos de coordenadas (n x 2) armados directamente desde el
+# búfer plano de partes del grafo (ver csr_graph.gather_part_coords).
+import heapq
+import time
+from collections import namedtuple
+
+# networkx se importa solo en las ramas del motor "networkx": el motor CSR y los workers de
+# parallel no lo cargan.
+import numpy as np
+import shapely
+
+from . import contraction
+from .options import DEFAULT_GRAPH_ENGINE, DEFAULT_SNAP_MODE, DEFAULT_DAI_LINE_OUTPUT, DEFAULT_DRO_SEARCH
+from .csr_graph import (CSRGraph, NodeKeyIndex, build_topology_arrays, cheapest_parallel_edges, gather_part_coords, node_keys, part_directions,
+                        part_edges, part_lengths)
+from .snapping import NodeSnapper, EdgeSnapper, build_edge_overlay
+
+# Resultado de la construcción, para que el adaptador informe lo omitido o corregido: issues
+# es {categoría: filas de las vías afectadas (posiciones en geometries)}, en el orden de BUILD_ISSUES
+BUILD_ISSUES = ("no_geometry", "wrong_type", "short_parts", "unknown_direction", "missing_cost")
+BuildReport = namedtuple("BuildReport", ["roads", "parts", "issues"])
+# Partes de vía de una red (una fila por id de parte), para actualizarla sin reconstruirla:
+# vía de origen (road_ids), nodos extremos, costo, sentidos habilitados y si sigue en la red
+PartTable = namedtuple("PartTable", ["road_ids", "u", "v", "weights", "forward", "backward", "live"])
+# Proporción de partes muertas (de vías borradas o editadas) a partir de la cual
+# RoutingNetwork.update no actualiza la red: conviene reconstruirla
+MAX_DEAD_PARTS = 0.25
+
+
+class SearchStats:
+    # Conteos y tiempo de armado de rutas de las búsquedas de un análisis. Los análisis y
+    # búsquedas los reciben como stats=None (sin conteo); los workers de parallel devuelven
+    # los suyos con cada trabajo y el proceso principal los suma con merge.
+    __slots__ = ("searches", "settled", "routes", "route_seconds")
+
+    def __init__(self): self.searches = 0; self.settled = 0; self.routes = 0; self.route_seconds = 0.0
+
+    def searched(self, settled, searches=1): self.searches += searches; self.settled += settled
+
+    def merge(self, other):
+        self.searches += other.searches; self.settled += other.settled
+        self.routes += other.routes; self.route_seconds += other.route_seconds
+
+
+def _timed_routes(stats, route_to):
+    # Envuelve route_to para sumar las rutas armadas y su tiempo
+    if stats is None: return route_to
+    def _route(node):
+        start = time.perf_counter(); result = route_to(node)
+        stats.routes += 1; stats.route_seconds += time.perf_counter() - start
+        return result
+    return _route
+
+
+# --- Construcción del grafo ---
+def _road_parts(geometries, direction, cost):
+    # Partes LineString (o de MultiLineString) con al menos 2 coordenadas de las vías
+    # -> (partes, fila de la vía de cada parte, búfer plano de coordenadas, offsets, dirección y costo por parte, issues)
+    geoms = np.asarray(geometries, dtype=object)
+    type_ids = shapely.get_type_id(geoms)
+    empty = (type_ids < 0) | shapely.is_empty(geoms)
+    valid_rows = np.isin(type_ids, (1, 5)) & ~empty  # 1 = LineString, 5 = MultiLineString
+    parts, part_rows = shapely.get_parts(geoms[valid_rows], return_index=True)
+    part_rows = np.nonzero(valid_rows)[0][part_rows]
+    num_coords = shapely.get_num_coordinates(parts)
+    short_parts = num_coords < 2
+    issues = {"no_geometry": np.nonzero(empty)[0], "wrong_type": np.nonzero(~valid_rows & ~empty)[0], "short_parts": np.unique(part_rows[short_parts])}
+    parts = parts[~short_parts]; part_rows = part_rows[~short_parts]; num_coords = num_coords[~short_parts]
+    direction = np.asarray(direction, dtype=np.float64)[part_rows]; cost = np.asarray(cost, dtype=np.float64)[part_rows]
+    issues["unknown_direction"] = np.empty(0, dtype=np.int64); issues["missing_cost"] = np.unique(part_rows[np.isnan(cost)])
+    # Búfer plano de coordenadas de todas las partes; la parte p ocupa part_offsets[p]:part_offsets[p + 1]
+    coords = shapely.get_coordinates(parts).reshape(-1, 2)
+    part_offsets = np.concatenate(([0], np.cumsum(num_coords))).astype(np.int64)
+    return parts, part_rows, coords, part_offsets, direction, cost, issues
+
+
+def build_graph(geometries, direction, cost, engine=DEFAULT_GRAPH_ENGINE):
+    # geometries: una geometría Shapely por vía; direction y cost: un valor por vía (NaN si es
+    # nulo o no numérico; sin costo se usa la longitud). Se usan las partes LineString (o de
+    # MultiLineString) con al menos 2 coordenadas. Devuelve (grafo o None si no hay partes, BuildReport).
+    network, report = build_network(geometries, direction, cost, engine)
+    return (None if network is None else network.graph), report
+
+
+def build_network(geometries, direction, cost, engine=DEFAULT_GRAPH_ENGINE, road_ids=None):
+    # Como build_graph, pero devuelve la RoutingNetwork con su PartTable, que permite
+    # actualizarla (update). road_ids: id de cada vía (por defecto, su fila en geometries).
+    parts, part_rows, coords, part_offsets, direction, cost, issues = _road_parts(geometries, direction, cost)
+    report = BuildReport(len(geometries), len(parts), issues)
+    if len(parts) == 0: return None, report
+    starts, ends = part_offsets[:-1], part_offsets[1:]
+    topology = build_topology_arrays(coords[starts], coords[ends - 1], shapely.length(parts), direction, cost)
+    issues["unknown_direction"] = np.unique(part_rows[topology.unknown_direction_mask])
+    road_ids = part_rows if road_ids is None else np.asarray(road_ids)[part_rows]
+    part_table = PartTable(road_ids, topology.part_u, topology.part_v, topology.part_weights, topology.part_forward, topology.part_backward,
+                           np.ones(len(parts), dtype=bool))
+    if engine == "csr":
+        G = CSRGraph.from_edge_arrays(len(topology.node_xy), topology.sources, topology.targets, topology.weights, topology.part_ids,
+                                      node_xy=topology.node_xy, edge_reversed=topology.reversed, geometries=parts,
+                                      part_coords=coords, part_offsets=part_offsets)
+        return RoutingNetwork(G, part_table), report
+    # Cada arista guarda la parte que recorre y el sentido; las coordenadas quedan en el búfer del grafo.
+    # nx.DiGraph admite una sola arista por par: se conserva la paralela de menor costo, como en CSR.
+    import networkx as nx
+    G = nx.DiGraph(part_coords=coords, part_offsets=part_offsets, node_xy=topology.node_xy)
+    _add_nx_edges(G, topology.sources, topology.targets, topology.weights, topology.part_ids, topology.reversed)
+    return RoutingNetwork(G, part_table), report
+
+
+def _add_nx_edges(G, sources, targets, weights, part_ids, reversed_flags):
+    keep = cheapest_parallel_edges(sources, targets, weights)
+    G.add_edges_from((u_id, v_id, {"weight": weight, "part": part_idx, "reversed": reversed_part})
+                     for u_id, v_id, weight, part_idx, reversed_part in zip(sources[keep].tolist(), targets[keep].tolist(), weights[keep].tolist(),
+                                                                            part_ids[keep].tolist(), reversed_flags[keep].tolist()))
+
+
+def graph_node_xy(G):
+    # Coordenadas de los nodos (fila = id de nodo) de cualquiera de los dos motores
+    return G.node_xy if isinstance(G, CSRGraph) else G.graph["node_xy"]
+
+
+def graph_part_coords(G):
+    # (búfer plano de coordenadas de las partes, offsets) de cualquiera de los dos motores
+    return (G.part_coords, G.part_offsets) if isinstance(G, CSRGraph) else (G.graph["part_coords"], G.graph["part_offsets"])
+
+
+class RoutingNetwork:
+    # Grafo con sus índices espaciales de ajuste, que se crean en el primer uso y se
+    # conservan mientras el grafo siga en caché. parts (PartTable) permite actualizarlo.
+    def __init__(self, graph, parts=None):
+        self.graph = graph; self.parts = parts
+        self.node_xy = np.asarray(graph_node_xy(graph), dtype=np.float64)
+        self._node_snapper = None; self._edge_snapper = None; self._node_keys = None
+
+    @property
+    def node_snapper(self):
+        if self._node_snapper is None: self._node_snapper = NodeSnapper(self.node_xy, self._snap_nodes())
+        return self._node_snapper
+
+    @property
+    def edge_snapper(self):
+        if self._edge_snapper is None and isinstance(self.graph, CSRGraph): self._edge_snapper = EdgeSnapper(self.graph.geometries, np.unique(self.graph.edge_ids))
+        return self._edge_snapper
+
+    @property
+    def node_keys(self):
+        if self._node_keys is None: self._node_keys = NodeKeyIndex(node_keys(self.node_xy))
+        return self._node_keys
+
+    def _snap_nodes(self):
+        # Nodos extremos de alguna parte de la red (tras una actualización, los de las vías
+        # quitadas pueden quedar sin partes); None si son todos
+        if self.parts is None or self.parts.live.all(): return None
+        live = self.parts.live; num_nodes = len(self.node_xy)
+        return np.flatnonzero(np.bincount(self.parts.u[live], minlength=num_nodes) + np.bincount(self.parts.v[live], minlength=num_nodes))
+
+    def update(self, removed_road_ids, geometries, direction, cost, road_ids):
+        # Red con las vías removed_road_ids quitadas y las vías geometries (ids road_ids)
+        # agregadas, sin reconstruirla: las partes de las vías quitadas quedan muertas (sin
+        # aristas) y las nuevas se agregan al final, con nodos a continuación de los existentes;
+        # los ids de nodo y de parte no cambian y solo se rearman las aristas salientes de los
+        # nodos tocados. Los índices de ajuste ya creados conservan sus árboles. El grafo original
+        # no se modifica. -> (RoutingNetwork o None, BuildReport de las vías agregadas); None si
+        # la red no guarda sus partes, se queda sin partes o superaría MAX_DEAD_PARTS.
+        parts, part_rows, coords, part_offsets, direction, cost, issues = _road_parts(geometries, direction, cost)
+        report = BuildReport(len(geometries), len(parts), issues)
+        table = self.parts
+        if table is None: return None, report
+        dead = table.live & np.isin(table.road_ids, np.asarray(list(removed_road_ids)))
+        num_parts = len(table.u) + len(parts)
+        if num_parts - table.live.sum() + dead.sum() > MAX_DEAD_PARTS * num_parts or table.live.sum() - dead.sum() + len(parts) == 0: return None, report
+        # Nodos de las partes nuevas: los existentes se reutilizan aunque hayan quedado sin partes
+        starts, ends = part_offsets[:-1], part_offsets[1:]
+        endpoints = np.empty((2 * len(parts), 2), dtype=np.float64)
+        endpoints[0::2] = coords[starts]; endpoints[1::2] = coords[ends - 1]
+        endpoint_ids, keys, new_rows = self.node_keys.assign(node_keys(endpoints))
+        node_xy = np.concatenate([self.node_xy, endpoints[new_rows]])
+        u_ids, v_ids = endpoint_ids[0::2], endpoint_ids[1::2]
+        weights, forward, backward, unknown_direction = part_directions(u_ids, v_ids, shapely.length(parts), direction, cost)
+        issues["unknown_direction"] = np.unique(part_rows[unknown_direction])
+        table = PartTable(np.concatenate([table.road_ids, np.asarray(road_ids)[part_rows]]), np.concatenate([table.u, u_ids]), np.concatenate([table.v, v_ids]),
+                          np.concatenate([table.weights, weights]), np.concatenate([table.forward, forward]), np.concatenate([table.backward, backward]),
+                          np.concatenate([table.live & ~dead, np.ones(len(parts), dtype=bool)]))
+        # Filas tocadas: extremos de las partes quitadas y agregadas. Sus aristas salientes se
+        # regeneran desde todas las partes vivas que las tocan, con la misma deduplicación
+        touched = np.zeros(len(node_xy), dtype=bool)
+        touched[self.parts.u[dead]] = True; touched[self.parts.v[dead]] = True; touched[u_ids] = True; touched[v_ids] = True
+        candidates = np.flatnonzero(table.live & (touched[table.u] | touched[table.v]))
+        sources, targets, edge_weights, part_ids, reversed_flags = part_edges(candidates, table.u, table.v, table.weights, table.forward, table.backward)
+        in_rows = touched[sources]
+        sources, targets, edge_weights, part_ids, reversed_flags = sources[in_rows], targets[in_rows], edge_weights[in_rows], part_ids[in_rows], reversed_flags[in_rows]
+        keep = cheapest_parallel_edges(sources, targets, edge_weights)
+        G = self.graph; base_coords, base_offsets = graph_part_coords(G)
+        part_coords = np.concatenate([np.asarray(base_coords), coords]); all_offsets = np.concatenate([np.asarray(base_offsets), base_offsets[-1] + part_offsets[1:]])
+        if isinstance(G, CSRGraph):
+            updated = G.with_rows(touched, sources[keep], targets[keep], edge_weights[keep], part_ids[keep], reversed_flags[keep], node_xy,
+                                  np.concatenate([np.asarray(G.geometries, dtype=object), parts]), part_coords, all_offsets)
+        else:
+            updated = G.copy()
+            touched_nodes = [node for node in np.flatnonzero(touched).tolist() if node in updated]
+            updated.remove_edges_from([(u, v) for u in touched_nodes for v in list(updated.successors(u))])
+            updated.graph.update(part_coords=part_coords, part_offsets=all_offsets, node_xy=node_xy)
+            _add_nx_edges(updated, sources, targets, edge_weights, part_ids, reversed_flags)
+            updated.remove_nodes_from([node for node in touched_nodes if updated.degree(node) == 0])
+        network = RoutingNetwork(updated, table); network._node_keys = keys
+        if self._node_snapper is not None: network._node_snapper = self._node_snapper.updated(network.node_xy, network._snap_nodes())
+        if self._edge_snapper is not None and isinstance(updated, CSRGraph): network._edge_snapper = self._edge_snapper.updated(updated.geometries, np.unique(updated.edge_ids))
+        return network, report
+
+    def supports_edge_snapping(self): return isinstance(self.graph, CSRGraph) and self.graph.geometries is not None
+
+    def node_coords(self, node, overlay=None):
+        if overlay is not None and overlay.has_node(node): return tuple(overlay.node_coords(node))
+        return tuple(self.node_xy[node])
+
+    def snap(self, geometry_sets, tolerance=None, mode=DEFAULT_SNAP_MODE):
+        # geometry_sets: lista de arreglos de puntos Shapely. Todos se ajustan juntos, de modo
+        # que en modo "edge" comparten un único QueryOverlay. Devuelve ([(nodos, distancias)]
+        # por conjunto; nodo -1 fuera de la tolerancia), overlay o None, modo usado)
+        geometry_sets = [np.asarray(geoms, dtype=object) for geoms in geometry_sets]
+        if mode == "edge" and self.supports_edge_snapping() and geometry_sets:
+            part_idx, along, all_distances, projected_xy = self.edge_snapper.snap(np.concatenate(geometry_sets), tolerance)
+            overlay, all_nodes = build_edge_overlay(self.graph, self.graph.geometries, part_idx, along, projected_xy)
+            split_at = np.cumsum([len(g) for g in geometry_sets])[:-1]
+            return list(zip(np.split(all_nodes, split_at), np.split(all_distances, split_at))), overlay, "edge"
+        return [self.node_snapper.snap(geoms, tolerance) for geoms in geometry_sets], None, "node"
+
+
+# --- Búsquedas, comunes a ambos motores ---
+def nx_route_coords(G, path):
+    # Coordenadas de un camino (lista de nodos) del grafo NetworkX, o None si tiene menos de 2 nodos
+    if len(path) < 2: return None
+    edges = [G[u][v] for u, v in zip(path[:-1], path[1:])]
+    return gather_part_coords(G.graph["part_coords"], G.graph["part_offsets"], [e["part"] for e in edges], [e["reversed"] for e in edges])
+
+
+def nx_shortest_path_tree(G, source, targets=None, cutoff=None):
+    # Dijkstra sobre el grafo NetworkX con la misma parada que CSRGraph.shortest_path_tree: se
+    # detiene al asentar todos los targets, si se indican. Devuelve dist {nodo: costo} y pred
+    # {nodo: nodo anterior}, solo para nodos asentados; los caminos se arman al pedirlos.
+    if source not in G:
+        import networkx as nx
+        raise nx.NodeNotFound(f"Source {source} not in G")
+    adj = G.adj
+    dist = {}; pred = {}; tentative = {source: 0.0}; heap = [(0.0, source)]
+    pending = None if targets is None else set(targets)
+    heappop, heappush = heapq.heappop, heapq.heappush
+    while heap:
+        d, u = heappop(heap)
+        if u in dist: continue
+        dist[u] = d
+        if pending is not None:
+            pending.discard(u)
+            if not pending: break
+        for v, data in adj[u].items():
+            if v in dist: continue
+            nd = d + data["weight"]
+            if cutoff is not None and nd > cutoff: continue
+            old = tentative.get(v)
+            if old is None or nd < old: tentative[v] = nd; pred[v] = u; heappush(heap, (nd, v))
+    return dist, {v: pred[v] for v in dist if v in pred}
+
+
+def nx_path_nodes(pred, node):
+    # Nodos del camino desde la fuente hasta node, según pred de nx_shortest_path_tree
+    path = [node]
+    while path[-1] in pred: path.append(pred[path[-1]])
+    return path[::-1]
+
+
+def single_source_routes(G, source, targets=None, cutoff=None, overlay=None, stats=None):
+    # Una sola búsqueda desde source; con targets se detiene al asentarlos. Devuelve
+    # ({nodo: costo}, función nodo -> coordenadas de la ruta desde source, o None).
+    if isinstance(G, CSRGraph):
+        dist, pred = G.shortest_path_tree(source, targets=None if targets is None else set(targets), cutoff=cutoff, overlay=overlay)
+        route_to = lambda node: G.route_coords(G.path_edges(pred, node, overlay), overlay)
+    else:
+        dist, pred = nx_shortest_path_tree(G, source, targets=targets, cutoff=cutoff)
+        route_to = lambda node: nx_route_coords(G, nx_path_nodes(pred, node))
+    if stats is not None: stats.searched(len(dist))
+    return dist, _timed_routes(stats, route_to)
+
+
+def _nx_cost_per_distance_bound(G):
+    # Igual que CSRGraph.cost_per_distance_bound, sobre las aristas del grafo NetworkX
+    if "cost_per_distance_bound" not in G.graph:
+        lengths = part_lengths(G.graph["part_coords"], G.graph["part_offsets"])
+        ratios = [data["weight"] / lengths[data["part"]] for _, _, data in G.edges(data=True) if lengths[data["part"]] > 0]
+        G.graph["cost_per_distance_bound"] = max(min(ratios), 0.0) if ratios else 0.0
+    return G.graph["cost_per_distance_bound"]
+
+
+def point_to_point_route(G, source, target, search, overlay=None, stats=None):
+    # Ruta de un solo par con A* o Dijkstra bidireccional: (costo, coordenadas) o None sin camino.
+    # Los nodos asentados solo se cuentan con el motor CSR.
+    if isinstance(G, CSRGraph):
+        found = G.astar_path(source, target, overlay, stats=stats) if search == "astar" else G.bidirectional_path(source, target, overlay, stats=stats)
+        if found is None: return None
+        return found[0], _timed_routes(stats, lambda edges: G.route_coords(edges, overlay))(found[1])
+    import networkx as nx
+    if stats is not None: stats.searched(0)
+    try:
+        if search == "astar":
+            scale = _nx_cost_per_distance_bound(G); node_xy = G.graph["node_xy"]
+            path = nx.astar_path(G, source, target, heuristic=lambda u, v: scale * float(np.hypot(*(node_xy[u] - node_xy[v]))), weight='weight')
+            cost = nx.path_weight(G, path, 'weight')
+        else: cost, path = nx.bidirectional_dijkstra(G, source, target, weight='weight')
+    except (nx.NetworkXNoPath, nx.NodeNotFound): return None
+    return cost, _timed_routes(stats, lambda nodes: nx_route_coords(G, nodes))(path)
+
+
+def shortest_path_tree_edges(G, source, cutoff=None, overlay=None, stats=None):
+    # Devuelve ({nodo: costo}, [(u, v, coordenadas)]) con cada arista del árbol una sola vez
+    if isinstance(G, CSRGraph):
+        dist, pred = G.shortest_path_tree(source, cutoff=cutoff, overlay=overlay)
+        start = time.perf_counter()
+        edges = [(G.edge_source(pos, overlay), v, G.edge_coords(pos, overlay)) for v, pos in pred.items()]
+    else:
+        import networkx as nx
+        dist, paths = nx.single_source_dijkstra(G, source, cutoff=cutoff, weight='weight')
+        start = time.perf_counter()
+        edges = [(path[-2], v, nx_route_coords(G, path[-2:])) for v, path in paths.items() if len(path) >= 2]
+    if stats is not None:
+        stats.searched(len(dist)); stats.routes += len(edges); stats.route_seconds += time.perf_counter() - start
+    return dist, edges
+
+
+def single_source_costs(G, source, targets, overlay=None, stats=None):
+    # Solo costos (sin caminos) desde source hacia los destinos alcanzados
+    if isinstance(G, CSRGraph): dist = G.shortest_path_tree(source, targets=set(targets), overlay=overlay)[0]
+    else:
+        import networkx as nx
+        dist = nx.single_source_dijkstra_path_length(G, source, weight='weight')
+    if stats is not None: stats.searched(len(dist))
+    return dist
+
+
+def nearest_source_dijkstra(G, sources, targets, overlay=None, stats=None):
+    # Búsqueda multi-origen desde todas las fuentes sobre el grafo invertido. Devuelve
+    # ({nodo: costo hasta la fuente más cercana}, función nodo -> (fuente más cercana,
+    # coordenadas de la ruta en sentido de circulación o None)). Con CSR se detiene al
+    # asentar todos los targets.
+    if isinstance(G, CSRGraph):
+        dist, pred = G.shortest_path_tree(sources, targets=set(targets), overlay=overlay, reverse=True)
+        def _route(node):
+            edges = G.path_edges(pred, node, overlay, reverse=True)
+            if not edges: return node, None
+            return G.edge_target(edges[-1], overlay), G.route_coords(edges, overlay)
+    else:
+        import networkx as nx
+        dist, paths = nx.multi_source_dijkstra(G.reverse(copy=False), set(sources), weight='weight')
+        _route = lambda node: (paths[node][0], nx_route_coords(G, paths[node][::-1]))
+    if stats is not None: stats.searched(len(dist))
+    return dist, _timed_routes(stats, _route)
+
+
+def nearest_source_hierarchy(G, hierarchy, sources, targets, overlay=None, stats=None):
+    # Igual que nearest_source_dijkstra, con una búsqueda invertida multi-origen en la
+    # jerarquía y una búsqueda ascendente por target
+    backward = hierarchy.search(list(sources), overlay, backward=True)
+    if stats is not None: stats.searched(len(backward.dist))
+    dist = {}; found = {}
+    for node in set(targets):
+        forward = hierarchy.search(node, overlay); meeting = hierarchy.meeting(forward, backward)
+        if stats is not None: stats.searched(len(forward.dist))
+        if meeting is not None: dist[node] = meeting.cost; found[node] = (forward, meeting)
+    def _route(node):
+        forward, meeting = found[node]
+        edges = hierarchy.path_edges(forward, backward, meeting)
+        return hierarchy.start_node(backward, meeting), G.route_coords(edges, overlay) if edges else None
+    return dist, _timed_routes(stats, _route)
+
+
+# --- Análisis por origen (nodos de los puntos en orden de índice) ---
+def dro_origin_routes(G, nodes, origin_index, search=DEFAULT_DRO_SEARCH, overlay=None, stats=None):
+    # Rutas desde nodes[origin_index] hacia los demás puntos: [(índice de destino, costo, coordenadas)].
+    # search "tree" (un árbol por origen) o "astar"/"bidirectional" (una búsqueda por par).
+    source = nodes[origin_index]; routes = []
+    if search in ("astar", "bidirectional"):
+        for dest_index, target in enumerate(nodes):
+            if dest_index == origin_index: continue
+            found = point_to_point_route(G, source, target, search, overlay, stats)
+            if found is not None and found[1] is not None and len(found[1]) >= 2: routes.append((dest_index, found[0], found[1]))
+        return routes
+    dist, route_to = single_source_routes(G, source, targets=[node for i, node in enumerate(nodes) if i != origin_index], overlay=overlay, stats=stats)
+    for dest_index, target in enumerate(nodes):
+        if dest_index == origin_index or target not in dist: continue
+        coords = route_to(target)
+        if coords is not None and len(coords) >= 2: routes.append((dest_index, dist[target], coords))
+    return routes
+
+
+def dro_hierarchy_routes(G, hierarchy, nodes, overlay=None, stats=None):
+    # DRO muchos a muchos sobre la jerarquía: búsquedas invertidas de todos los puntos
+    # indexadas por nodo y una ascendente por origen. Itera (índice de origen, rutas) como dro_origin_routes.
+    backward = [hierarchy.search(node, overlay, backward=True) for node in nodes]
+    if stats is not None: stats.searched(sum(len(b.dist) for b in backward), len(backward))
+    buckets = contraction.bucket_index(backward)
+    route = _timed_routes(stats, lambda edges: G.route_coords(edges, overlay))
+    for origin_index, source in enumerate(nodes):
+        forward = hierarchy.search(source, overlay); routes = []
+        if stats is not None: stats.searched(len(forward.dist))
+        for dest_index, meeting in contraction.best_meetings(forward, buckets).items():
+            if dest_index == origin_index: continue
+            edges = hierarchy.path_edges(forward, backward[dest_index], meeting)
+            coords = route(edges)
+            if coords is not None and len(coords) >= 2: routes.append((dest_index, hierarchy.route_cost(edges, overlay), coords))
+        yield origin_index, routes
+
+
+def od_matrix_row(G, nodes, origin_index, overlay=None, stats=None):
+    # Costos desde nodes[origin_index] hacia todos los puntos (NaN sin ruta)
+    dist = single_source_costs(G, nodes[origin_index], nodes, overlay, stats)
+    return np.fromiter((dist.get(node, np.nan) for node in nodes), dtype=np.float64, count=len(nodes))
+
+
+def od_matrix_hierarchy_rows(hierarchy, nodes, overlay=None, stats=None):
+    # Filas de la matriz de costos sobre la jerarquía: (índice de origen, costos)
+    backward = [hierarchy.search(node, overlay, backward=True) for node in nodes]
+    if stats is not None: stats.searched(sum(len(b.dist) for b in backward), len(backward))
+    buckets = contraction.bucket_index(backward)
+    for origin_index, source in enumerate(nodes):
+        row_costs = np.full(len(nodes), np.nan); forward = hierarchy.search(source, overlay)
+        if stats is not None: stats.searched(len(forward.dist))
+        for dest_index, meeting in contraction.best_meetings(forward, buckets).items(): row_costs[dest_index] = meeting.cost
+        yield origin_index, row_costs
+
+
+def dai_origin(network, source, cutoff, line_output=DEFAULT_DAI_LINE_OUTPUT, overlay=None, stats=None):
+    # Área alcanzable desde source hasta cutoff -> (líneas, [(costo, x, y)] de los nodos alcanzados)
+    # líneas: [(u, v, costo u, costo v, coords)] en modo "tree"; [(nodo, costo, coords)] en "routes"
+    G = network.graph; lines = []; reached = []
+    if not (G.has_node(source) or (overlay is not None and overlay.has_node(source))): return [], []
+    if line_output != "routes":
+        # Árbol de caminos mínimos: cada arista alcanzada se escribe una sola vez
+        dist, tree_edges = shortest_path_tree_edges(G, source, cutoff=cutoff, overlay=overlay, stats=stats)
+        lines = [(u, v, dist[u], dist[v], coords) for u, v, coords in tree_edges if coords is not None and len(coords) >= 2]
+        return lines, [(cost,) + network.node_coords(node, overlay) for node, cost in dist.items()]
+    dist, route_to = single_source_routes(G, source, cutoff=cutoff, overlay=overlay, stats=stats)
+    for node, cost in dist.items():
+        if node != source:
+            coords = route_to(node)
+            if coords is None or len(coords) < 2: continue
+            lines.append((node, cost, coords))
+        reached.append((cost,) + network.node_coords(node, overlay))
+    return lines, reached
+
+
+def threshold_band(thresholds, cost):
+    # Menor umbral (de la lista ordenada) que alcanza el costo dado
+    return float(thresholds[min(int(np.searchsorted(thresholds, cost, side="left")), len(thresholds) - 1)])
+
+
+def reach_polygons(reached, thresholds):
+    # Envolvente convexa de los nodos alcanzados dentro de cada umbral: [(umbral, polígono)]
+    reached = np.asarray(reached, dtype=np.float64).reshape(-1, 3); polygons = []
+    for threshold in np.asarray(thresholds, dtype=np.float64).tolist():
+        inside = reached[reached[:, 0] <= threshold, 1:]
+        if len(inside) < 3: continue
+        hull = shapely.multipoints(inside).convex_hull
+        if not hull.is_empty and hull.geom_type == "Polygon": polygons.append((threshold, hull))
+    return polygons
+
+
+def nearest_facility_routes(G, facility_nodes, origin_nodes, overlay=None, hierarchy=None, stats=None):
+    # Utilidad más cercana a cada origen: itera (índice de origen, nodo de la utilidad, costo,
+    # coordenadas de la ruta o None si el origen está sobre la utilidad); omite los orígenes
+    # sin ruta. Una sola búsqueda desde todas las utilidades sobre el grafo invertido, o sobre
+    # la jerarquía de contracción si se indica.
+    origin_nodes = list(origin_nodes)
+    if hierarchy is not None: dist, route_to = nearest_source_hierarchy(G, hierarchy, facility_nodes, origin_nodes, overlay, stats)
+    else: dist, route_to = nearest_source_dijkstra(G, facility_nodes, origin_nodes, overlay, stats)
+    for origin_index, node in enumerate(origin_nodes):
+        if node not in dist: continue
+        facility_node, coords = route_to(node)
+        yield origin_index, facility_node, dist[node], coords
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+# Ajuste (snap) de puntos al grafo mediante índices espaciales: al nodo más cercano o,
+# proyectando sobre la arista más cercana, a nodos virtuales locales a la consulta.
+# No depende de QGIS: recibe coordenadas de nodos y geometrías Shapely.
+import numpy as np
+import shapely
+import shapely.ops
+
+from .csr_graph import QueryOverlay
+
+
+# Altas y bajas (proporción del árbol) a partir de las cuales un índice actualizado se
+# reconstruye en lugar de consultar el árbol original más uno chico con las altas
+MAX_INDEX_CHANGES = 0.1
+
+
+class _NearestIndex:
+    # Vecino más cercano (STRtree) sobre geometrías identificadas por ids. update devuelve el
+    # índice de otro conjunto de ids conservando el árbol: los ids dados de baja se descartan de
+    # sus resultados y las altas van a un árbol chico aparte.
+    def __init__(self, geometries, ids):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.geometries = np.asarray(geometries, dtype=object)
+        self._tree = None
+        self._removed = None  # máscara sobre ids: dados de baja (None si ninguno)
+        self._added = None  # _NearestIndex con las altas
+
+    @property
+    def tree(self):
+        if self._tree is None: self._tree = shapely.STRtree(self.geometries)
+        return self._tree
+
+    def update(self, ids, geometries_of):
+        # ids: conjunto vigente; geometries_of(ids) devuelve sus geometrías. Si el árbol aún no
+        # se construyó o hay muchos cambios, el índice nuevo arma el suyo en el primer uso.
+        ids = np.asarray(ids, dtype=np.int64)
+        removed = ~np.isin(self.ids, ids); added = np.setdiff1d(ids, self.ids)
+        if self._tree is None or removed.sum() + len(added) > MAX_INDEX_CHANGES * len(self.ids): return _NearestIndex(geometries_of(ids), ids)
+        index = _NearestIndex(self.geometries, self.ids); index._tree = self._tree
+        index._removed = removed if removed.any() else None
+        index._added = _NearestIndex(geometries_of(added), added) if len(added) else None
+        return index
+
+    def nearest(self, geometries, max_distance=None):
+        # Más cercano vigente de cada geometría -> (ids, distancias); -1 y NaN si no hay ninguno a max_distance
+        ids = np.full(len(geometries), -1, dtype=np.int64); distances = np.full(len(geometries), np.inf)
+        if len(self.ids):
+            (query_idx, tree_idx), dists = self.tree.query_nearest(geometries, max_distance=max_distance, return_distance=True, all_matches=False)
+            if self._removed is not None:
+                dropped = self._removed[tree_idx]
+                if dropped.any(): self._nearest_kept(geometries, query_idx[dropped], dists[dropped], max_distance, ids, distances)
+                query_idx, tree_idx, dists = query_idx[~dropped], tree_idx[~dropped], dists[~dropped]
+            ids[query_idx] = self.ids[tree_idx]; distances[query_idx] = dists
+        if self._added is not None:
+            added_ids, added_distances = self._added.nearest(geometries, max_distance)
+            closer = (added_ids >= 0) & (added_distances < distances)
+            ids[closer] = added_ids[closer]; distances[closer] = added_distances[closer]
+        distances[ids < 0] = np.nan
+        return ids, distances
+
+    def _nearest_kept(self, geometries, rows, radius, max_distance, ids, distances):
+        # Puntos cuyo más cercano está dado de baja: se buscan los vigentes del árbol en radios
+        # crecientes, hasta encontrar uno o cubrir todo el árbol (o max_distance)
+        x0, y0, x1, y1 = shapely.total_bounds(self.geometries)
+        corners = shapely.points([(x0, y0), (x0, y1), (x1, y0), (x1, y1)])
+        reach = shapely.distance(geometries[rows][:, None], corners[None, :]).max(axis=1)
+        radius = np.maximum(2.0 * radius, 1e-9)
+        while len(rows):
+            if max_distance is not None: radius = np.minimum(radius, max_distance)
+            query_idx, tree_idx = self.tree.query(geometries[rows], predicate="dwithin", distance=radius)
+            keep = ~self._removed[tree_idx]; query_idx, tree_idx = query_idx[keep], tree_idx[keep]
+            dists = shapely.distance(geometries[rows[query_idx]], self.geometries[tree_idx])
+            order = np.lexsort((dists, query_idx)); query_idx, tree_idx, dists = query_idx[order], tree_idx[order], dists[order]
+            first = np.ones(len(query_idx), dtype=bool); first[1:] = query_idx[1:] != query_idx[:-1]
+            found = query_idx[first]
+            ids[rows[found]] = self.ids[tree_idx[first]]; distances[rows[found]] = dists[first]
+            pending = np.ones(len(rows), dtype=bool); pending[found] = False
+            pending &= radius < reach
+            if max_distance is not None: pending &= radius < max_distance
+            rows, radius, reach = rows[pending], 4.0 * radius[pending], reach[pending]
+
+
+class NodeSnapper:
+    # El STRtree sobre los nodos se construye una sola vez por grafo (en el primer uso)
+    # y todos los puntos de una capa se ajustan con una única consulta de vecino más cercano.
+    # node_ids limita el ajuste a esos nodos (p. ej. sin los que quedaron sin vías al
+    # actualizar el grafo); updated reutiliza el árbol para el grafo actualizado.
+    def __init__(self, node_xy, node_ids=None, index=None):
+        self.node_xy = np.asarray(node_xy, dtype=np.float64).reshape(-1, 2)
+        self.node_ids = np.arange(len(self.node_xy), dtype=np.int64) if node_ids is None else np.asarray(node_ids, dtype=np.int64)
+        self._index = index
+
+    @property
+    def index(self):
+        if self._index is None: self._index = _NearestIndex(shapely.points(self.node_xy[self.node_ids]), self.node_ids)
+        return self._index
+
+    def updated(self, node_xy, node_ids=None):
+        snapper = NodeSnapper(node_xy, node_ids)
+        if self._index is not None: snapper._index = self._index.update(snapper.node_ids, lambda ids: shapely.points(snapper.node_xy[ids]))
+        return snapper
+
+    def snap(self, geometries, tolerance=None):
+        # Devuelve (ids de nodo, distancias). Los puntos nulos, vacíos o a más de
+        # `tolerance` del nodo más cercano quedan con id -1 y distancia NaN.
+        geometries = np.asarray(geometries, dtype=object)
+        node_ids = np.full(len(geometries), -1, dtype=np.int64)
+        distances = np.full(len(geometries), np.nan)
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        if not valid.any() or len(self.node_ids) == 0: return node_ids, distances
+        max_distance = None if tolerance is None else max(float(tolerance), 1e-12)
+        node_ids[valid], distances[valid] = self.index.nearest(geometries[valid], max_distance)
+        return node_ids, distances
+
+
+class EdgeSnapper:
+    # Índice sobre las partes de vía que generan aristas en el grafo; proyecta cada punto
+    # sobre la parte más cercana y devuelve la distancia recorrida a lo largo de ella.
+    def __init__(self, part_geometries, candidate_parts, index=None):
+        self.parts = np.asarray(part_geometries, dtype=object)
+        self.candidate_parts = np.asarray(candidate_parts, dtype=np.int64)
+        self._index = index
+
+    @property
+    def index(self):
+        if self._index is None: self._index = _NearestIndex(self.parts[self.candidate_parts], self.candidate_parts)
+        return self._index
+
+    def updated(self, part_geometries, candidate_parts):
+        snapper = EdgeSnapper(part_geometries, candidate_parts)
+        if self._index is not None: snapper._index = self._index.update(snapper.candidate_parts, lambda parts: snapper.parts[parts])
+        return snapper
+
+    def snap(self, geometries, tolerance=None):
+        # Devuelve (parte, distancia a lo largo de la parte, distancia de ajuste, xy proyectado);
+        # los puntos sin parte dentro de la tolerancia quedan con parte -1.
+        geometries = np.asarray(geometries, dtype=object)
+        part_idx = np.full(len(geometries), -1, dtype=np.int64)
+        along = np.full(len(geometries), np.nan); distances = np.full(len(geometries), np.nan)
+        projected_xy = np.full((len(geometries), 2), np.nan)
+        valid = ~(shapely.is_missing(geometries) | shapely.is_empty(geometries))
+        if not valid.any() or len(self.candidate_parts) == 0: return part_idx, along, distances, projected_xy
+        valid_idx = np.nonzero(valid)[0]
+        max_distance = None if tolerance is None else max(float(tolerance), 1e-12)
+        nearest_parts, dists = self.index.nearest(geometries[valid], max_distance)
+        found = nearest_parts >= 0
+        rows = valid_idx[found]; parts = nearest_parts[found]
+        # El primer vértice de la línea más corta punto-parte es la proyección sobre la parte
+        nearest_on_part = shapely.get_point(shapely.shortest_line(self.parts[parts], geometries[rows]), 0)
+        part_idx[rows] = parts; distances[rows] = dists[found]
+        along[rows] = shapely.line_locate_point(self.parts[parts], nearest_on_part)
+        projected_xy[rows] = shapely.get_coordinates(nearest_on_part)
+        return part_idx, along, distances, projected_xy
+
+
+def build_edge_overlay(graph, part_geometries, part_idx, along, projected_xy):
+    # Crea un QueryOverlay con un nodo virtual por punto ajustado. Cada arista del grafo
+    # que recorre una parte con puntos se replica como una cadena u -> x1 -> ... -> v cuyos
+    # costos son proporcionales a la longitud recorrida; el grafo no se modifica.
+    overlay = QueryOverlay(graph)
+    virtual_nodes = np.full(len(part_idx), -1, dtype=np.int64)
+    snapped_rows = np.nonzero(part_idx >= 0)[0]
+    for row in snapped_rows: virtual_nodes[row] = overlay.add_node(*projected_xy[row])
+    if len(snapped_rows) == 0: return overlay, virtual_nodes
+
+    rows_by_part = {}
+    for row in snapped_rows[np.argsort(along[snapped_rows], kind="stable")]: rows_by_part.setdefault(int(part_idx[row]), []).append(row)
+    edge_positions = np.nonzero(np.isin(graph.edge_ids, np.fromiter(rows_by_part, dtype=np.int64)))[0]
+    for pos in edge_positions.tolist():
+        part = int(graph.edge_ids[pos]); geom = part_geometries[part]; length = geom.length
+        reversed_edge = bool(graph.edge_reversed[pos]); weight = float(graph.weights[pos])
+        rows = rows_by_part[part][::-1] if reversed_edge else rows_by_part[part]
+        # Posiciones a lo largo de la parte (en el sentido de digitalización) de cada tramo
+        stops = [length if reversed_edge else 0.0] + [float(along[row]) for row in rows] + [0.0 if reversed_edge else length]
+        chain = [graph.edge_source(pos)] + [int(virtual_nodes[row]) for row in rows] + [graph.edge_target(pos)]
+        for k in range(len(chain) - 1):
+            start, end = stops[k], stops[k + 1]
+            fraction = abs(end - start) / length if length > 0 else (1.0 if k == len(chain) - 2 else 0.0)
+            piece = shapely.ops.substring(geom, min(start, end), max(start, end))
+            coords = list(piece.coords)
+            if len(coords) == 1: coords = coords * 2
+            if reversed_edge: coords = coords[::-1]
+            overlay.add_edge(chain[k], chain[k + 1], weight * fraction, coords)
+    return overlay, virtual_nodes
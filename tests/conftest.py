@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+# Las pruebas usan las redes sintéticas de los benchmarks y no dependen de QGIS. Se ejecutan
+# desde la carpeta del plugin con `python -m pytest -q`.
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+import synthetic  # noqa: E402
+
+
+@pytest.fixture(params=synthetic.NETWORK_KINDS)
+def network(request):
+    # Red sintética pequeña de cada tipo (con vías de un solo sentido en ambos sentidos)
+    return synthetic.make_network(request.param, 300, seed=7)
+
+
+@pytest.fixture
+def points(network):
+    return synthetic.random_points(network, 12, seed=3)
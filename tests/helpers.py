@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+# Utilidades comunes de las pruebas
+import numpy as np
+import pytest
+import shapely
+
+import synthetic
+
+from .. import routing_engine
+
+
+def build(network, engine="csr"):
+    geometries = synthetic.network_geometries(network)
+    return routing_engine.build_graph(geometries, network.direction.astype(np.float64), network.cost, engine=engine)[0]
+
+
+def point_sets(points):
+    return [shapely.points(points)]
+
+
+def assert_costs_equal(actual, expected):
+    # Mismos nodos alcanzados con los mismos costos
+    assert set(actual) == set(expected)
+    for node, cost in expected.items(): assert actual[node] == pytest.approx(cost, rel=1e-9, abs=1e-9), node
+
+
+def tree_costs(G, source, targets, overlay=None):
+    # Costos de referencia desde source: árbol de Dijkstra completo del grafo CSR (NaN sin camino)
+    dist = G.shortest_path_tree(source, overlay=overlay)[0]
+    return np.array([dist.get(node, np.nan) for node in targets], dtype=np.float64)
+
+
+def edge_weight(G, pos, overlay=None):
+    if overlay is not None and pos >= G.number_of_edges(): return overlay.weights[pos - overlay.base_edges]
+    return float(G.weights[pos])
+
+
+def assert_valid_path(G, source, target, cost, edges, overlay=None):
+    # Las aristas encadenan source con target y sus costos suman cost
+    if source == target: assert edges == [] and cost == 0.0; return
+    assert G.edge_source(edges[0], overlay) == source and G.edge_target(edges[-1], overlay) == target
+    for prev, pos in zip(edges[:-1], edges[1:]): assert G.edge_target(prev, overlay) == G.edge_source(pos, overlay)
+    assert sum(edge_weight(G, pos, overlay) for pos in edges) == pytest.approx(cost, rel=1e-9, abs=1e-9)
+
+
+def snap_points(G, points, mode):
+    # Nodos (reales o virtuales) de los puntos y el overlay del ajuste
+    snapped, overlay, _ = routing_engine.RoutingNetwork(G).snap(point_sets(points), mode=mode)
+    return [int(node) for node in snapped[0][0]], overlay
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+# La jerarquía de contracción debe dar los mismos costos que Dijkstra sobre el grafo
+# original, punto a punto y muchos a muchos, con nodos reales y con nodos virtuales de un
+# QueryOverlay (ajuste a aristas)
+import numpy as np
+import pytest
+
+from .. import routing_engine
+from ..contraction import build_contraction_hierarchy
+from .helpers import assert_valid_path, build, snap_points, tree_costs
+
+
+@pytest.fixture
+def hierarchy_case(network, request):
+    G = build(network)
+    return G, build_contraction_hierarchy(G, **getattr(request, "param", {}))
+
+
+@pytest.mark.parametrize("hierarchy_case", [{}, {"witness_settle_limit": 1}], indirect=True, ids=["default", "few_witnesses"])
+@pytest.mark.parametrize("mode", ["node", "edge"])
+def test_point_to_point_costs_match_dijkstra(hierarchy_case, points, mode):
+    G, hierarchy = hierarchy_case
+    nodes, overlay = snap_points(G, points, mode)
+    for source in nodes:
+        expected = tree_costs(G, source, nodes, overlay)
+        for target, cost in zip(nodes, expected):
+            found = hierarchy.route(source, target, overlay)
+            if np.isnan(cost): assert found is None; continue
+            assert found[0] == pytest.approx(cost, rel=1e-9, abs=1e-9)
+            assert_valid_path(G, source, target, found[0], found[1], overlay)
+
+
+@pytest.mark.parametrize("mode", ["node", "edge"])
+def test_many_to_many_costs_match_dijkstra(hierarchy_case, points, mode):
+    G, hierarchy = hierarchy_case
+    nodes, overlay = snap_points(G, points, mode)
+    rows = dict(routing_engine.od_matrix_hierarchy_rows(hierarchy, nodes, overlay))
+    assert sorted(rows) == list(range(len(nodes)))
+    for origin_index in range(len(nodes)):
+        expected = routing_engine.od_matrix_row(G, nodes, origin_index, overlay)
+        np.testing.assert_allclose(rows[origin_index], expected, rtol=1e-9, atol=1e-9)
+        np.testing.assert_allclose(expected, tree_costs(G, nodes[origin_index], nodes, overlay), rtol=1e-9, atol=1e-9)
+
+
+@pytest.mark.parametrize("mode", ["node", "edge"])
+def test_dro_routes_match_dijkstra_tree(hierarchy_case, points, mode):
+    G, hierarchy = hierarchy_case
+    nodes, overlay = snap_points(G, points, mode)
+    for origin_index, routes in routing_engine.dro_hierarchy_routes(G, hierarchy, nodes, overlay):
+        expected = {dest_index: cost for dest_index, cost, _ in routing_engine.dro_origin_routes(G, nodes, origin_index, overlay=overlay)}
+        assert {dest_index for dest_index, _, _ in routes} == set(expected)
+        for dest_index, cost, coords in routes:
+            assert cost == pytest.approx(expected[dest_index], rel=1e-9, abs=1e-9)
+            assert len(coords) >= 2
+
+
+@pytest.mark.parametrize("mode", ["node", "edge"])
+def test_nearest_source_matches_dijkstra(hierarchy_case, points, mode):
+    G, hierarchy = hierarchy_case
+    nodes, overlay = snap_points(G, points, mode)
+    sources, targets = nodes[:3], nodes[3:]
+    expected = routing_engine.nearest_source_dijkstra(G, sources, targets, overlay)[0]
+    dist, route_to = routing_engine.nearest_source_hierarchy(G, hierarchy, sources, targets, overlay)
+    assert set(dist) == {node for node in targets if node in expected}
+    for node in dist:
+        assert dist[node] == pytest.approx(expected[node], rel=1e-9, abs=1e-9)
+        source, _ = route_to(node)
+        assert source in sources
+        # El costo es el del viaje desde node hasta su fuente más cercana
+        assert tree_costs(G, node, [source], overlay)[0] == pytest.approx(dist[node], rel=1e-9, abs=1e-9)
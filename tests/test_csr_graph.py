@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+# Búsquedas punto a punto (A*, Dijkstra bidireccional) y aristas virtuales del QueryOverlay,
+# contrastadas con el árbol de Dijkstra del mismo grafo
+import math
+
+import numpy as np
+import pytest
+import shapely
+
+from .. import routing_engine
+from ..csr_graph import QueryOverlay
+from ..snapping import build_edge_overlay
+from .helpers import assert_valid_path, build, edge_weight, snap_points
+
+
+@pytest.mark.parametrize("mode", ["node", "edge"])
+def test_point_to_point_searches_match_dijkstra_tree(network, points, mode):
+    G = build(network)
+    nodes, overlay = snap_points(G, points, mode)
+    assert (overlay is not None) == (mode == "edge")
+    for source in nodes:
+        dist = G.shortest_path_tree(source, overlay=overlay)[0]
+        for target in nodes:
+            for found in (G.astar_path(source, target, overlay), G.bidirectional_path(source, target, overlay)):
+                if target not in dist: assert found is None; continue
+                assert found[0] == pytest.approx(dist[target], rel=1e-9, abs=1e-9)
+                assert_valid_path(G, source, target, found[0], found[1], overlay)
+
+
+def test_dijkstra_tree_with_overlay_matches_networkx(network, points):
+    # Referencia independiente: un nx.DiGraph con las aristas del grafo y las del overlay
+    nx = pytest.importorskip("networkx")
+    G = build(network)
+    nodes, overlay = snap_points(G, points, "edge")
+    reference = nx.DiGraph()
+    edges = [(int(u), int(v), float(w)) for u, v, w in zip(G.edge_sources, G.indices, G.weights)]
+    edges += list(zip(overlay.sources, overlay.targets, overlay.weights))
+    for u, v, w in edges:
+        if not reference.has_edge(u, v) or w < reference[u][v]["weight"]: reference.add_edge(u, v, weight=w)
+    for source in nodes[:5]:
+        expected = nx.single_source_dijkstra_path_length(reference, source, weight="weight")
+        dist = G.shortest_path_tree(source, overlay=overlay)[0]
+        assert set(dist) == set(expected)
+        for node, cost in expected.items(): assert dist[node] == pytest.approx(cost, rel=1e-9, abs=1e-9)
+
+
+def _single_road(direction, cost=100.0):
+    geometries = np.array([shapely.LineString([(0, 0), (50, 0), (100, 0)])], dtype=object)
+    return routing_engine.build_graph(geometries, [float(direction)], [cost])[0]
+
+
+@pytest.mark.parametrize("direction", [0, 1, 2])
+def test_overlay_with_two_virtual_nodes_on_the_same_edge(direction):
+    # Dos puntos proyectados cerca de cada extremo de la misma arista: el overlay encadena
+    # u -> x1 -> x2 -> v por cada sentido habilitado, con costos proporcionales a lo recorrido
+    G = _single_road(direction)
+    nodes, overlay = snap_points(G, np.array([(10.0, 3.0), (90.0, -2.0)]), "edge")
+    near_start, near_end = nodes
+    assert overlay.has_node(near_start) and overlay.has_node(near_end)
+    np.testing.assert_allclose(overlay.node_coords(near_start), (10.0, 0.0))
+    np.testing.assert_allclose(overlay.node_coords(near_end), (90.0, 0.0))
+    forward = direction in (0, 1); backward = direction in (0, 2)
+    assert overlay.number_of_edges() == 3 * (forward + backward)
+    for source, target, allowed in ((near_start, near_end, forward), (near_end, near_start, backward)):
+        dist = G.shortest_path_tree(source, overlay=overlay)[0]
+        for found in (G.astar_path(source, target, overlay), G.bidirectional_path(source, target, overlay)):
+            if not allowed: assert found is None and target not in dist; continue
+            assert found[0] == pytest.approx(80.0) and dist[target] == pytest.approx(80.0)
+            assert_valid_path(G, source, target, found[0], found[1], overlay)
+            coords = G.route_coords(found[1], overlay)
+            np.testing.assert_allclose(coords[[0, -1]], [overlay.node_coords(source), overlay.node_coords(target)])
+            assert shapely.length(shapely.linestrings(coords)) == pytest.approx(80.0)
+
+
+def test_overlay_reaches_graph_nodes_through_virtual_chain():
+    # Desde un punto virtual en una vía de un solo sentido solo se alcanza el extremo final
+    G = _single_road(1)
+    nodes, overlay = snap_points(G, np.array([(25.0, 1.0)]), "edge")
+    start_node, end_node = G.edge_source(0), G.edge_target(0)
+    dist = G.shortest_path_tree(nodes[0], overlay=overlay)[0]
+    assert dist[end_node] == pytest.approx(75.0) and start_node not in dist
+    reverse_dist = G.shortest_path_tree(nodes[0], overlay=overlay, reverse=True)[0]
+    assert reverse_dist[start_node] == pytest.approx(25.0) and end_node not in reverse_dist
+
+
+def test_build_edge_overlay_ignores_unsnapped_points():
+    G = _single_road(0)
+    overlay, virtual_nodes = build_edge_overlay(G, G.geometries, np.array([-1, 0]), np.array([math.nan, 40.0]), np.array([[math.nan, math.nan], [40.0, 0.0]]))
+    assert virtual_nodes[0] == -1 and overlay.has_node(virtual_nodes[1])
+    assert overlay.number_of_nodes() == 1 and overlay.number_of_edges() == 4
+    assert sum(edge_weight(G, pos, overlay) for pos in overlay.out[int(virtual_nodes[1])]) == pytest.approx(100.0)
+
+
+def test_query_overlay_keeps_cheapest_parallel_virtual_edge():
+    G = _single_road(0)
+    overlay = QueryOverlay(G)
+    x = overlay.add_node(1.0, 1.0)
+    overlay.add_edge(0, x, 5.0, [(0, 0), (1, 1)]); cheap = overlay.add_edge(0, x, 2.0, [(0, 0), (1, 1)])
+    assert overlay.find_edge(0, x) == cheap and G.find_edge(0, x, overlay) == cheap
+    assert G.shortest_path_tree(0, overlay=overlay)[0][x] == pytest.approx(2.0)
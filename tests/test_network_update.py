@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+# RoutingNetwork.update debe dar los mismos costos y ajustes que reconstruir la red con las
+# vías editadas, sin renumerar los nodos ni modificar la red original
+import numpy as np
+import pytest
+import shapely
+
+import synthetic
+
+from .. import routing_engine
+from .helpers import assert_costs_equal, point_sets, tree_costs
+
+
+def _roads(network):
+    geometries = np.asarray(synthetic.network_geometries(network), dtype=object)
+    return geometries, network.direction.astype(np.float64), np.asarray(network.cost, dtype=np.float64).copy(), np.arange(len(geometries)) * 10
+
+
+def _edits(geometries, direction, cost, road_ids, seed=5):
+    # Quita 6 vías, edita 6 (costo, sentido o trazado) y agrega 3 nuevas
+    rng = np.random.default_rng(seed)
+    chosen = rng.choice(len(geometries), 12, replace=False); removed, edited = chosen[:6], chosen[6:]
+    new_geoms = list(geometries[edited]); new_direction = list(direction[edited]); new_cost = list(cost[edited] * 3.0)
+    new_direction[0] = 1.0; new_direction[1] = 2.0
+    coords = shapely.get_coordinates(new_geoms[2]); new_geoms[2] = shapely.LineString([coords[0], coords[0] + (7.0, 3.0), coords[-1]])
+    new_cost[3] = np.nan
+    nodes = shapely.get_coordinates(geometries[rng.choice(len(geometries), 4, replace=False)])
+    new_geoms += [shapely.LineString([nodes[0], nodes[-1]]), shapely.LineString([nodes[1], nodes[1] + (40.0, 25.0)]),
+                  shapely.LineString([nodes[1] + (40.0, 25.0), nodes[2]])]
+    new_direction += [0.0, 1.0, 0.0]; new_cost += [np.nan, 12.0, 9.0]
+    new_ids = np.concatenate([road_ids[edited], [100001, 100002, 100003]])
+    keep = np.ones(len(geometries), dtype=bool); keep[chosen] = False
+    final = (np.concatenate([geometries[keep], np.asarray(new_geoms, dtype=object)]), np.concatenate([direction[keep], new_direction]),
+             np.concatenate([cost[keep], new_cost]), np.concatenate([road_ids[keep], new_ids]))
+    return road_ids[chosen], (np.asarray(new_geoms, dtype=object), np.asarray(new_direction), np.asarray(new_cost), new_ids), final
+
+
+def _costs_by_coords(network, source):
+    G = network.graph
+    if isinstance(G, routing_engine.CSRGraph): dist = G.shortest_path_tree(source)[0]
+    else: dist = pytest.importorskip("networkx").single_source_dijkstra_path_length(G, source, weight="weight")
+    return {tuple(network.node_xy[node]): cost for node, cost in dist.items()}
+
+
+@pytest.mark.parametrize("engine", ["csr", "networkx"])
+def test_update_matches_rebuild(network, points, engine):
+    if engine == "networkx": pytest.importorskip("networkx")
+    geometries, direction, cost, road_ids = _roads(network)
+    base, _ = routing_engine.build_network(geometries, direction, cost, engine, road_ids)
+    base.snap(point_sets(points), mode="node"); base.snap(point_sets(points), mode="edge")  # índices ya creados
+    base_nodes, base_edges = base.graph.number_of_nodes(), base.graph.number_of_edges()
+    removed, added, final = _edits(geometries, direction, cost, road_ids)
+    updated, report = base.update(removed, *added)
+    rebuilt, _ = routing_engine.build_network(*final[:3], engine, final[3])
+    assert report.roads == 6 + 3
+    # La red original no cambia y los nodos existentes conservan su id
+    assert (base.graph.number_of_nodes(), base.graph.number_of_edges()) == (base_nodes, base_edges)
+    np.testing.assert_array_equal(updated.node_xy[:len(base.node_xy)], base.node_xy)
+    assert updated.graph.number_of_edges() == rebuilt.graph.number_of_edges()
+
+    (nodes, distances), = updated.snap(point_sets(points), mode="node")[0]
+    (rebuilt_nodes, rebuilt_distances), = rebuilt.snap(point_sets(points), mode="node")[0]
+    np.testing.assert_allclose(distances, rebuilt_distances)
+    np.testing.assert_allclose(updated.node_xy[nodes], rebuilt.node_xy[rebuilt_nodes])
+    for node, rebuilt_node in list(zip(nodes, rebuilt_nodes))[:4]:
+        assert_costs_equal(_costs_by_coords(updated, int(node)), _costs_by_coords(rebuilt, int(rebuilt_node)))
+
+
+def test_update_matches_rebuild_with_edge_snapping(network, points):
+    geometries, direction, cost, road_ids = _roads(network)
+    base, _ = routing_engine.build_network(geometries, direction, cost, "csr", road_ids)
+    base.snap(point_sets(points), mode="edge")
+    removed, added, final = _edits(geometries, direction, cost, road_ids, seed=11)
+    updated, _ = base.update(removed, *added)
+    rebuilt, _ = routing_engine.build_network(*final[:3], "csr", final[3])
+    # El árbol de las partes se conserva: solo las altas van a un árbol aparte
+    assert updated.edge_snapper.index.tree is base.edge_snapper.index.tree
+    ((nodes, distances),), overlay, _ = updated.snap(point_sets(points), mode="edge")
+    ((rebuilt_nodes, rebuilt_distances),), rebuilt_overlay, _ = rebuilt.snap(point_sets(points), mode="edge")
+    np.testing.assert_allclose(distances, rebuilt_distances)
+    for k in range(4):
+        np.testing.assert_allclose(tree_costs(updated.graph, int(nodes[k]), nodes, overlay),
+                                   tree_costs(rebuilt.graph, int(rebuilt_nodes[k]), rebuilt_nodes, rebuilt_overlay), rtol=1e-9)
+
+
+def test_update_skips_removed_nearest_node():
+    # El nodo más cercano al punto queda sin vías: el ajuste pasa al siguiente vigente
+    geometries = np.array([shapely.LineString([(0, 0), (10, 0)]), shapely.LineString([(0, 50), (10, 50)])]
+                          + [shapely.LineString([(100 + 10 * i, 0), (105 + 10 * i, 0)]) for i in range(20)], dtype=object)
+    base, _ = routing_engine.build_network(geometries, np.zeros(22), np.full(22, np.nan), "csr", np.arange(1, 23))
+    point = point_sets([(1.0, 1.0)])
+    assert base.snap(point, mode="node")[0][0][1][0] == pytest.approx(np.hypot(1, 1))
+    updated, _ = base.update([1], [], [], [], [])
+    assert updated.node_snapper.index.tree is base.node_snapper.index.tree
+    ((nodes, distances),) = updated.snap(point, mode="node")[0]
+    np.testing.assert_allclose(updated.node_xy[nodes], [(0, 50)]); np.testing.assert_allclose(distances, [np.hypot(1, 49)])
+    assert updated.snap(point, tolerance=20.0, mode="node")[0][0][0][0] == -1
+    (parts, _, edge_distances, _) = updated.edge_snapper.snap(point[0])
+    assert parts[0] == 1 and edge_distances[0] == pytest.approx(49.0)
+
+
+def test_update_declines_when_most_parts_are_dead():
+    geometries = np.array([shapely.LineString([(i, 0), (i + 1, 0)]) for i in range(8)], dtype=object)
+    base, _ = routing_engine.build_network(geometries, np.zeros(8), np.ones(8), "csr", np.arange(8))
+    assert base.update([0], [], [], [], [])[0] is not None
+    assert base.update([0, 1, 2], [], [], [], [])[0] is None
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+# Búsquedas por origen en el pool de procesos: mismos resultados que en secuencia, y al
+# cancelar o cerrar el generador no quedan workers vivos
+import multiprocessing
+
+import numpy as np
+import pytest
+
+from .. import graph_cache, parallel, routing_engine
+from .helpers import build, snap_points
+
+
+class _Feedback:
+    def __init__(self): self.canceled = False
+
+    def isCanceled(self): return self.canceled
+
+
+@pytest.fixture
+def matrix_case(tmp_path):
+    import synthetic
+    network = synthetic.make_network("grid", 300, seed=7)
+    G = build(network)
+    graph_dir = graph_cache.save_graph(str(tmp_path), "grafo", G, G.part_coords, G.part_offsets)
+    nodes, _ = snap_points(G, synthetic.random_points(network, 12, seed=3), "node")
+    return G, graph_dir, nodes
+
+
+def test_run_jobs_matches_sequential_rows(matrix_case):
+    G, graph_dir, nodes = matrix_case
+    rows = dict(parallel.run_jobs(parallel.dro_matrix_job, range(len(nodes)), graph_dir, None, {"nodes": nodes}, 2))
+    for origin_index in range(len(nodes)):
+        np.testing.assert_array_equal(rows[origin_index], routing_engine.od_matrix_row(G, nodes, origin_index))
+    assert not multiprocessing.active_children()
+
+
+def test_run_jobs_terminates_pool_on_cancel(matrix_case):
+    _, graph_dir, nodes = matrix_case
+    feedback = _Feedback()
+    results = []
+    for result in parallel.run_jobs(parallel.dro_matrix_job, range(len(nodes)), graph_dir, None, {"nodes": nodes}, 2, feedback=feedback):
+        results.append(result); feedback.canceled = True
+    assert len(results) == 1
+    assert not multiprocessing.active_children()
+
+
+def test_closing_run_jobs_terminates_pool(matrix_case):
+    _, graph_dir, nodes = matrix_case
+    results = parallel.run_jobs(parallel.dro_matrix_job, range(len(nodes)), graph_dir, None, {"nodes": nodes}, 2)
+    next(results)
+    assert multiprocessing.active_children()
+    results.close()
+    assert not multiprocessing.active_children()
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+# Ambos motores de grafo (CSR y NetworkX) deben dar los mismos costos y las mismas rutas
+import numpy as np
+import pytest
+import shapely
+
+from .. import routing_engine
+from .helpers import assert_costs_equal, build
+
+nx = pytest.importorskip("networkx")
+
+
+def test_engines_agree_on_synthetic_networks(network, points):
+    csr = build(network, "csr"); G = build(network, "networkx")
+    assert csr.number_of_edges() == G.number_of_edges()
+    nodes = routing_engine.RoutingNetwork(csr).snap([shapely.points(points)], mode="node")[0][0][0]
+    for source in nodes[:4]:
+        source = int(source)
+        expected = csr.shortest_path_tree(source)[0]
+        assert_costs_equal(nx.single_source_dijkstra_path_length(G, source, weight="weight"), expected)
+        dist, route_to = routing_engine.single_source_routes(G, source)
+        csr_dist, csr_route_to = routing_engine.single_source_routes(csr, source)
+        for target in nodes:
+            if target == source or target not in expected: continue
+            # Los caminos solo podrían diferir entre empates de costo: se compara su longitud
+            length = shapely.length(shapely.linestrings(route_to(target)))
+            assert length == pytest.approx(shapely.length(shapely.linestrings(csr_route_to(target))))
+
+
+
+def test_networkx_search_stops_at_targets(network, points):
+    # Con targets la búsqueda NetworkX se detiene al asentarlos, como la CSR
+    csr = build(network, "csr"); G = build(network, "networkx")
+    nodes = [int(node) for node in routing_engine.RoutingNetwork(csr).snap([shapely.points(points)], mode="node")[0][0][0]]
+    source, targets = nodes[0], [node for node in nodes[1:4] if node != nodes[0]]
+    dist, route_to = routing_engine.single_source_routes(G, source, targets=targets)
+    csr_dist = routing_engine.single_source_routes(csr, source, targets=targets)[0]
+    assert len(dist) == len(csr_dist) < G.number_of_nodes()
+    for target in targets:
+        assert dist[target] == pytest.approx(csr_dist[target])
+        if target != source: assert shapely.length(shapely.linestrings(route_to(target))) > 0
+
+def test_parallel_edges_keep_cheapest_in_both_engines():
+    # Dos vías entre los mismos extremos: la recta (costo 2) y un desvío (costo 5), cargada
+    # después. Antes el motor NetworkX se quedaba con la última arista paralela.
+    geometries = np.array([shapely.LineString([(0, 0), (10, 0)]), shapely.LineString([(0, 0), (5, 5), (10, 0)])], dtype=object)
+    direction = np.array([0.0, 0.0]); cost = np.array([2.0, 5.0])
+    results = {}
+    for engine in ("csr", "networkx"):
+        G = routing_engine.build_graph(geometries, direction, cost, engine=engine)[0]
+        source, target = (int(i) for i in routing_engine.RoutingNetwork(G).snap([shapely.points([(0, 0), (10, 0)])], mode="node")[0][0][0])
+        dist, route_to = routing_engine.single_source_routes(G, source)
+        results[engine] = (dist[target], route_to(target))
+        for search in ("astar", "bidirectional"):
+            found = routing_engine.point_to_point_route(G, source, target, search)
+            assert found[0] == pytest.approx(2.0)
+            np.testing.assert_allclose(found[1], [(0, 0), (10, 0)])
+    for engine, (cost_found, coords) in results.items():
+        assert cost_found == pytest.approx(2.0), engine
+        np.testing.assert_allclose(coords, [(0, 0), (10, 0)])